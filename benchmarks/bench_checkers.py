@@ -0,0 +1,37 @@
+from re import compile
+from timeit import repeat
+
+from parking_app.checkers import Checkers
+
+plates = ["S-627-JM", "Z-810-TU", "S627JM", "K-452-BM", "L713KQ", "Q-495-DL", "N-713-KQ", "F-130-AE"] * 125
+lengths_of_stay = ["1.23", "4.55", "1.233", "226.14", "9111.22", "0.01", "75.36", "abc"] * 125
+
+
+def check_if_license_plate_valid_compiling_per_call(plate_number):
+    license_plate_format = compile(r'^[A-Z\d]{1,3}-[A-Z\d]{1,3}-[A-Z\d]{1,3}$')
+    return False if len(plate_number) != 8 or not license_plate_format.match(plate_number) or not \
+        isinstance(plate_number, str) else True
+
+
+def check_length_of_stay_compiling_per_call(length_of_stay):
+    length_of_stay_format = compile(r'^\d{1,4}\.[0-5]\d$')
+    return bool(length_of_stay_format.match(length_of_stay)) and float(length_of_stay) <= 8765.82
+
+
+def report(name, statement, number=200):
+    best = min(repeat(statement, number=number, repeat=5)) / number
+    print(f"{name:<48} {best * 1e6:10.1f} us per 1000 items")
+    return best
+
+
+if __name__ == '__main__':
+    checker = Checkers()
+    baseline = report("plates, compile per call", lambda: [check_if_license_plate_valid_compiling_per_call(plate)
+                                                           for plate in plates])
+    single = report("plates, precompiled", lambda: [checker.check_if_license_plate_valid(plate) for plate in plates])
+    batch = report("plates, batch", lambda: checker.check_license_plates(plates))
+    print(f"speed-up: {baseline / single:.1f}x single, {baseline / batch:.1f}x batch")
+    baseline = report("lengths of stay, compile per call", lambda: [check_length_of_stay_compiling_per_call(length)
+                                                                    for length in lengths_of_stay])
+    batch = report("lengths of stay, batch", lambda: checker.check_lengths_of_stay(lengths_of_stay))
+    print(f"speed-up: {baseline / batch:.1f}x batch")
@@ -0,0 +1,241 @@
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from time import perf_counter
+
+from parking_app.sqlite_backend import create_database
+
+plate_characters = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+
+def generate_plate(number):
+    characters = []
+    for position in range(6):
+        number, remainder = divmod(number, len(plate_characters))
+        characters.append(plate_characters[remainder])
+    return "{}{}{}-{}{}-{}".format(*characters)
+
+
+def seed_database(path, spots, history, batch_size=10000):
+    create_database(path)
+    cnx = sqlite3.connect(path)
+    seeded_spots = cnx.execute("SELECT COUNT(*) FROM parking_spot_data;").fetchone()[0]
+    extra_spots = [(f"B{number:07d}", "B", number % 5, "compact" if number % 10 < 2 else "standard",
+                    int(number % 25 == 0)) for number in range(max(spots - seeded_spots, 0))]
+    for start in range(0, len(extra_spots), batch_size):
+        cnx.executemany("INSERT INTO parking_spot_data (spot_id, zone, level, size_class, has_ev_charger) "
+                        "VALUES (?, ?, ?, ?, ?);", extra_spots[start:start + batch_size])
+    spot_ids = [spot_id for spot_id, in cnx.execute("SELECT spot_id FROM parking_spot_data;")]
+    seeded_history = cnx.execute("SELECT COUNT(*) FROM parked_vehicles_data;").fetchone()[0]
+    arrival_time = datetime(2022, 1, 1)
+    for start in range(0, max(history - seeded_history, 0), batch_size):
+        rows = []
+        for number in range(start, min(start + batch_size, history - seeded_history)):
+            arrival = arrival_time + timedelta(minutes=number)
+            rows.append((spot_ids[number % len(spot_ids)], generate_plate(number), str(arrival), 1.0,
+                         str(arrival + timedelta(hours=1)), 1, str(arrival + timedelta(minutes=50)), 1))
+        cnx.executemany("INSERT INTO parked_vehicles_data (spot_id, vehicle_number, arrival_time, "
+                        "selected_length_of_stay, expected_departure_time, has_left, actual_departure_time, "
+                        "has_expired) VALUES (?, ?, ?, ?, ?, ?, ?, ?);", rows)
+    cnx.commit()
+    cnx.close()
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def measure(name, operation, iterations, query_recorder):
+    durations = []
+    queries = []
+    rows = []
+    statuses = {}
+    for iteration in range(iterations):
+        query_recorder.reset()
+        started_at = perf_counter()
+        status = operation(iteration)
+        durations.append(perf_counter() - started_at)
+        queries.append(query_recorder.queries)
+        rows.append(query_recorder.rows)
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    durations.sort()
+    result = {"operation": name, "iterations": iterations, "ops_per_sec": iterations / sum(durations),
+              "p50_ms": percentile(durations, 0.5) * 1000, "p99_ms": percentile(durations, 0.99) * 1000,
+              "mean_ms": sum(durations) / iterations * 1000, "queries_per_op": sum(queries) / iterations,
+              "rows_per_op": sum(rows) / iterations, "statuses": statuses}
+    print(f"{name:<52} {result['ops_per_sec']:10.1f} ops/s {result['p50_ms']:9.3f} ms p50 "
+          f"{result['p99_ms']:9.3f} ms p99 {result['queries_per_op']:6.1f} queries/op")
+    return result
+
+
+def route_operations(client, db_data_class, cnx, vacant_spots, batch_size):
+    plates = (generate_plate(2_000_000_000 + number) for number in range(10 ** 9))
+    parked = []
+    log_out_client = client.application.test_client()
+
+    def request(method, path, **kwargs):
+        return lambda iteration: getattr(client, method)(path, **kwargs).status_code
+
+    def park_car(iteration):
+        spot, plate = vacant_spots[iteration % len(vacant_spots)], next(plates)
+        response = client.post("/park-car", json={"parking_spot": spot, "license_plate": plate,
+                                                  "length_of_stay": "1.00"})
+        parked.append(plate)
+        return response.status_code
+
+    def leave_parking_spot(iteration):
+        return client.post("/leave-parking-spot", json={"license_plate": parked.pop()}).status_code
+
+    def park_at_next_available_spot(iteration):
+        plate = next(plates)
+        parked.append(plate)
+        return client.post("/park-at-next-available-spot", json={"license_plate": plate,
+                                                                 "length_of_stay": "1.00"}).status_code
+
+    def park_cars(iteration):
+        requests = [{"parking_spot": spot, "license_plate": next(plates), "length_of_stay": "1.00"}
+                    for spot in vacant_spots[iteration * batch_size % len(vacant_spots):][:batch_size]]
+        parked.extend(parking_request["license_plate"] for parking_request in requests)
+        return client.post("/park-cars", json=requests).status_code
+
+    def leave_parking_spots(iteration):
+        requests = [{"license_plate": parked.pop()} for count in range(min(batch_size, len(parked)))]
+        return client.post("/leave-parking-spots", json=requests).status_code
+
+    def register(iteration):
+        return client.post("/register", json={"username": f"benchuser{iteration}",
+                                              "email_address": f"benchuser{iteration}@example.com",
+                                              "password": "Pa55wor!"}).status_code
+
+    def log_out(iteration):
+        # A separate client is logged in again each time, so the other routes keep their session.
+        with log_out_client.session_transaction() as session:
+            session["login_success"] = True
+            session["username"] = "testuser"
+        return log_out_client.get("/log-out").status_code
+
+    def first_occupancy_event(iteration):
+        response = client.get("/occupancy-stream", buffered=False)
+        next(iter(response.response))
+        response.close()
+        return response.status_code
+
+    def vacant_spots_not_modified(iteration):
+        etag = client.get("/vacant-spots").headers["ETag"]
+        return client.get("/vacant-spots", headers={"If-None-Match": etag}).status_code
+
+    def export_parking_history(iteration):
+        response = client.get("/parking-history/export?format=ndjson")
+        sum(len(chunk) for chunk in response.response)
+        return response.status_code
+
+    def db_operation(method):
+        def operation(iteration):
+            result = method(db_data_class(cnx))
+            if hasattr(result, "__next__"):
+                sum(1 for row in result)
+            return "ok"
+        return operation
+
+    return [
+        ("GET /", request("get", "/")),
+        ("POST /log-in", request("post", "/log-in", json={"username": "testuser", "password": "Pa55wor!"})),
+        ("POST /register", register),
+        ("GET /log-out", log_out),
+        ("POST /search-license-plate", request("post", "/search-license-plate", json={"license_plate": "S-627-JM"})),
+        ("GET /spots", request("get", "/spots")),
+        ("GET /vacant-spots", request("get", "/vacant-spots")),
+        ("GET /vacant-spots (304)", vacant_spots_not_modified),
+        ("GET /vacant-spots (bitmap, gzip)", request("get", "/vacant-spots", headers={
+            "Accept": "application/vnd.parking-app.bitmap", "Accept-Encoding": "gzip"})),
+        ("GET /vacant-spots-count", request("get", "/vacant-spots-count")),
+        ("GET /unavailable-spots", request("get", "/unavailable-spots")),
+        ("GET /unavailable-spots (columnar)", request("get", "/unavailable-spots", headers={
+            "Accept": "application/vnd.parking-app.columnar+json"})),
+        ("GET /next-available-spot", request("get", "/next-available-spot")),
+        ("POST /park-car", park_car),
+        ("POST /leave-parking-spot", leave_parking_spot),
+        ("POST /park-at-next-available-spot", park_at_next_available_spot),
+        ("POST /leave-parking-spot (after next available)", leave_parking_spot),
+        (f"POST /park-cars ({batch_size} vehicles)", park_cars),
+        (f"POST /leave-parking-spots ({batch_size} vehicles)", leave_parking_spots),
+        ("GET /occupancy-stream (first event)", first_occupancy_event),
+        ("GET /parking-history/export", export_parking_history),
+        ("GET /occupancy-stats", request("get", "/occupancy-stats")),
+        ("GET /analytics", request("get", "/analytics")),
+        ("GET /cache-stats", request("get", "/cache-stats")),
+        ("GET /metrics", request("get", "/metrics")),
+        ("db: get_vacant_spots without index", db_operation(lambda db_data: db_data.get_vacant_spots())),
+        ("db: get_unavailable_spots_and_plates without index",
+         db_operation(lambda db_data: db_data.get_unavailable_spots_and_plates())),
+        ("db: get_next_available_spot without index", db_operation(lambda db_data: db_data.get_next_available_spot())),
+        ("db: iter_parking_history", db_operation(lambda db_data: db_data.iter_parking_history()))
+    ]
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser(description="Benchmark every route through the Flask test client on SQLite.")
+    parser.add_argument("--spots", type=int, default=10000)
+    parser.add_argument("--history", type=int, default=10000)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--slow-iterations", type=int, default=5,
+                        help="iterations for registering, logging in and reads of the whole history")
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--output", default=f"bench_routes_{datetime.now():%Y%m%d_%H%M%S}.json")
+    options = parser.parse_args(arguments)
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_path = os.path.join(directory, "parking_app.db")
+        started_at = perf_counter()
+        seed_database(database_path, options.spots, options.history)
+        print(f"seeded {options.spots} spots and {options.history} history rows in {perf_counter() - started_at:.1f} s")
+        # The analytics report is built once up front, as a separate process would, so no background scan of the
+        # history runs while the routes are timed.
+        analytics_report_path = os.path.join(directory, "analytics.json")
+        os.environ.update(DATABASE_BACKEND="sqlite", DATABASE_PATH=database_path, BCRYPT_LOG_ROUNDS="4",
+                          BATCH_MAX_SIZE=str(options.batch_size), ANALYTICS_REPORT_PATH=analytics_report_path,
+                          SECRET_KEY=os.getenv("SECRET_KEY", "benchmark"))
+        from parking_app import main as application
+        from parking_app.analytics import build_report, write_report
+        from parking_app.db import DBData
+        from parking_app.metrics import query_recorder
+        from parking_app.sqlite_backend import connect_to_sqlite
+
+        client = application.app.test_client()
+        client.post("/log-in", json={"username": "testuser", "password": "Pa55wor!"})
+        cnx = connect_to_sqlite(database_path)
+        write_report(build_report(DBData(cnx).iter_parking_history()), analytics_report_path)
+        vacant_spots = DBData(cnx).get_vacant_spots()
+        results = []
+        for name, operation in route_operations(client, DBData, cnx, vacant_spots, options.batch_size):
+            # Registering and logging in run bcrypt, at the seeded cost when logging in, and the history reads scale
+            # with --history.
+            slow = name.startswith(("POST /register", "POST /log-in")) or "history" in name
+            results.append(measure(name, operation, options.slow_iterations if slow else options.iterations,
+                                   query_recorder))
+        cnx.close()
+
+    report = {"created_at": datetime.now().isoformat(timespec="seconds"), "git_commit": git_commit(),
+              "python": platform.python_version(), "spots": options.spots, "history": options.history,
+              "iterations": options.iterations, "batch_size": options.batch_size, "results": results}
+    with open(options.output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"results saved to {options.output}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
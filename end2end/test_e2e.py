@@ -1,4 +1,5 @@
 import requests
+from time import sleep
 from unittest import TestCase
 
 root_address = "http://localhost:5000/"
@@ -180,6 +181,22 @@ class Test03DataRetrieval(TestCase):
         result = requests.get(root_address + "next-available-spot", cookies=cookies)
         self.assertEqual(result.status_code, 200)
 
+    def test_unauthorized_action_get_analytics(self):
+        result = requests.get(root_address + "analytics")
+        self.assertEqual(result.status_code, 403)
+        self.assertEqual(result.content.decode(), "Please log in to continue.")
+
+    def test_getting_analytics(self):
+        # The first report is built in the background right after the application starts.
+        for attempt in range(10):
+            result = requests.get(root_address + "analytics", cookies=cookies)
+            if result.status_code != 503:
+                break
+            sleep(1)
+        self.assertEqual(result.status_code, 200)
+        self.assertIn("by_spot", result.json())
+        self.assertIn("generated_at", result.json())
+
 
 class Test04ParkingAndLeaving(TestCase):
     def test_unauthorized_action_park_car(self):
@@ -294,3 +311,15 @@ class Test04ParkingAndLeaving(TestCase):
         result = requests.post(root_address + "leave-parking-spot", json=license_plate, cookies=cookies)
         self.assertEqual(result.status_code, 200)
         self.assertEqual(result.text, "Parking spot now available.")
+
+    def test_unsuccessfully_parking_too_many_vehicles_at_once(self):
+        vehicles = [{"parking_spot": "A03", "license_plate": "N-713-KQ", "length_of_stay": "1.00"}] * 501
+        result = requests.post(root_address + "park-cars", json=vehicles, cookies=cookies)
+        self.assertEqual(result.status_code, 400)
+        self.assertEqual(result.text, "At most 500 vehicles can be sent at once.")
+
+    def test_unsuccessfully_leaving_with_too_many_vehicles_at_once(self):
+        vehicles = [{"license_plate": "N-713-KQ"}] * 501
+        result = requests.post(root_address + "leave-parking-spots", json=vehicles, cookies=cookies)
+        self.assertEqual(result.status_code, 400)
+        self.assertEqual(result.text, "At most 500 vehicles can be sent at once.")
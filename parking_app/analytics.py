@@ -0,0 +1,160 @@
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+from itertools import islice
+
+import numpy as np
+
+from parking_app.db import DBData
+
+weekdays = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+totals_columns = ("stays", "completed_stays", "stay_seconds", "expired_stays", "lateness_seconds", "late_departures")
+epoch = datetime(1970, 1, 1)
+one_second = timedelta(seconds=1)
+not_a_time = np.iinfo(np.int64).min
+
+
+def _to_datetime64(times):
+    # Several times faster than letting np.array convert the datetime objects itself. NaT is the smallest int64.
+    return np.fromiter(((time - epoch) // one_second if time is not None else not_a_time for time in times),
+                       dtype=np.int64, count=len(times)).view("datetime64[s]")
+
+
+def _to_columns(rows):
+    _, spot_ids, _, arrival_times, _, expected_departure_times, has_left, actual_departure_times, has_expired = \
+        zip(*rows)
+    return {"spot_id": spot_ids,
+            "arrival_time": _to_datetime64(arrival_times),
+            "expected_departure_time": _to_datetime64(expected_departure_times),
+            "has_left": np.array(has_left, dtype=bool),
+            "actual_departure_time": _to_datetime64(actual_departure_times),
+            "has_expired": np.array(has_expired, dtype=bool)}
+
+
+class ParkingAnalytics:
+    # Keeps one row of running totals per spot, hour of day and weekday, so memory depends on the number of spots
+    # and on the chunk size, never on the number of stays.
+
+    def __init__(self):
+        self.spots = {}
+        self.by_spot = np.zeros((len(totals_columns), 0))
+        self.by_hour = np.zeros((len(totals_columns), 24))
+        self.by_weekday = np.zeros((len(totals_columns), 7))
+        self.first_arrival = None
+        self.last_arrival = None
+
+    def _spot_codes(self, spot_ids):
+        spots = self.spots
+        codes = np.fromiter((spots.setdefault(spot_id, len(spots)) for spot_id in spot_ids), dtype=np.intp,
+                            count=len(spot_ids))
+        if len(spots) > self.by_spot.shape[1]:
+            self.by_spot = np.pad(self.by_spot, ((0, 0), (0, len(spots) - self.by_spot.shape[1])))
+        return codes
+
+    @staticmethod
+    def _grouped_totals(groups, size, weights):
+        return np.stack([np.bincount(groups, weights=column, minlength=size) for column in weights])
+
+    def add(self, columns):
+        arrival_times = columns["arrival_time"]
+        actual_departure_times = columns["actual_departure_time"]
+        completed = columns["has_left"] & ~np.isnat(actual_departure_times)
+        stay_seconds = np.where(completed, (actual_departure_times - arrival_times).astype(np.float64), 0)
+        lateness_seconds = np.where(completed, (actual_departure_times - columns["expected_departure_time"])
+                                    .astype(np.float64), 0)
+        weights = [np.ones(len(arrival_times)), completed.astype(np.float64), stay_seconds,
+                   columns["has_expired"].astype(np.float64), lateness_seconds, (lateness_seconds > 0) * 1.0]
+        arrival_days = arrival_times.astype("datetime64[D]")
+        hours = ((arrival_times - arrival_days).astype(np.int64) // 3600).astype(np.intp)
+        # 1970-01-01 was a Thursday, the fourth day of the week counting from Monday.
+        days_of_week = ((arrival_days.astype(np.int64) + 3) % 7).astype(np.intp)
+        spot_codes = self._spot_codes(columns["spot_id"])
+        self.by_spot += self._grouped_totals(spot_codes, self.by_spot.shape[1], weights)
+        self.by_hour += self._grouped_totals(hours, 24, weights)
+        self.by_weekday += self._grouped_totals(days_of_week, 7, weights)
+        first_arrival, last_arrival = arrival_times.min(), arrival_times.max()
+        self.first_arrival = first_arrival if self.first_arrival is None else min(self.first_arrival, first_arrival)
+        self.last_arrival = last_arrival if self.last_arrival is None else max(self.last_arrival, last_arrival)
+
+    def add_rows(self, rows, chunk_size=50000):
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                return self
+            self.add(_to_columns(chunk))
+
+    @staticmethod
+    def _metrics(totals, days=None):
+        stays, completed_stays, stay_seconds, expired_stays, lateness_seconds, late_departures = totals
+        with np.errstate(divide="ignore", invalid="ignore"):
+            metrics = {"stays": stays.astype(np.int64),
+                       "completed_stays": completed_stays.astype(np.int64),
+                       "average_stay_hours": stay_seconds / completed_stays / 3600,
+                       "overstay_rate": expired_stays / stays,
+                       "average_lateness_minutes": lateness_seconds / completed_stays / 60,
+                       "late_departure_rate": late_departures / completed_stays}
+            if days is not None:
+                metrics["turnover_per_day"] = stays / days
+        return metrics
+
+    @staticmethod
+    def _rows(metrics):
+        # NaN marks groups without the stays the metric needs; JSON has no NaN, so they become null.
+        return [{name: None if np.isnan(value) else value.item() for name, value in zip(metrics, values)}
+                for values in zip(*metrics.values())]
+
+    def result(self):
+        days = None
+        if self.first_arrival is not None:
+            days = max((self.last_arrival - self.first_arrival).astype(np.int64) / 86400, 1)
+        overall = self._rows(self._metrics(self.by_spot.sum(axis=1, keepdims=True), days))[0]
+        return {**overall,
+                "first_arrival": None if self.first_arrival is None else str(self.first_arrival),
+                "last_arrival": None if self.last_arrival is None else str(self.last_arrival),
+                "by_spot": dict(sorted(zip(self.spots, self._rows(self._metrics(self.by_spot, days))))),
+                "by_hour": [{"hour": hour, **metrics} for hour, metrics in
+                            enumerate(self._rows(self._metrics(self.by_hour)))],
+                "by_weekday": [{"weekday": weekday, **metrics} for weekday, metrics in
+                               zip(weekdays, self._rows(self._metrics(self.by_weekday)))]}
+
+
+def compute_analytics(rows, chunk_size=50000):
+    return ParkingAnalytics().add_rows(rows, chunk_size).result()
+
+
+def build_report(rows, chunk_size=50000):
+    return {**compute_analytics(rows, chunk_size), "generated_at": datetime.now().replace(microsecond=0).isoformat()}
+
+
+def write_report(report, path):
+    # Written next to the target and renamed over it, so readers never see half a report.
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    os.replace(temporary_path, path)
+
+
+def read_report(path):
+    with open(path) as report_file:
+        return json.load(report_file)
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser(description="Compute stay, overstay, lateness and turnover statistics over the "
+                                                 "whole parking history.")
+    parser.add_argument("--chunk-size", type=int, default=50000)
+    parser.add_argument("--output", help="write the JSON report to this file instead of standard output")
+    options = parser.parse_args(arguments)
+    report = build_report(DBData().iter_parking_history(), options.chunk_size)
+    if options.output:
+        write_report(report, options.output)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,33 +1,36 @@
 from re import compile
 from datetime import datetime, timedelta
 
+username_format = compile(r'[A-Za-z\d]+')
+email_address_format = compile(r'[^@]+@[^@]+\.[^@]+')
+password_format = compile(r'^(?=.*[a-z])(?=.*[A-Z])(?=.*\d)(?=.*[@$!%*?&])[A-Za-z\d@$!%*?&]{8,10}$')
+license_plate_format = compile(r'^(?=.{8}\Z)[A-Z\d]{1,3}-[A-Z\d]{1,3}-[A-Z\d]{1,3}\Z')
+length_of_stay_format = compile(r'^\d{1,4}\.[0-5]\d$')
+longest_length_of_stay = 8765.82
+spot_attribute_types = {"zone": str, "level": int, "size_class": str, "has_ev_charger": bool}
+spot_attributes = tuple(spot_attribute_types)
+
 
 class Checkers:
 
     @staticmethod
     def check_if_username_valid(username):
-        username_format = compile(r'[A-Za-z\d]+')
         return False if not username_format.match(username) or username.lower() == "username" else True
 
     @staticmethod
     def check_if_email_address_valid(email_address):
-        email_address_format = compile(r'[^@]+@[^@]+\.[^@]+')
         return False if not email_address_format.match(email_address) else True
 
     @staticmethod
     def check_if_password_valid(password):
-        password_format = compile(r'^(?=.*[a-z])(?=.*[A-Z])(?=.*\d)(?=.*[@$!%*?&])[A-Za-z\d@$!%*?&]{8,10}$')
         return False if not password_format.match(password) or password.lower() == "password" else True
 
     @staticmethod
     def check_if_license_plate_valid(plate_number):
-        license_plate_format = compile(r'^[A-Z\d]{1,3}-[A-Z\d]{1,3}-[A-Z\d]{1,3}$')
-        return False if len(plate_number) != 8 or not license_plate_format.match(plate_number) or not \
-            isinstance(plate_number, str) else True
+        return False if not license_plate_format.match(plate_number) else True
 
     @staticmethod
     def check_if_length_of_stay_valid(length_of_stay):
-        length_of_stay_format = compile(r'^\d{1,4}\.[0-5]\d$')
         return False if not length_of_stay_format.match(length_of_stay) else True
 
     @staticmethod
@@ -44,4 +47,19 @@ class Checkers:
 
     @staticmethod
     def check_if_length_of_stay_over_a_year(length_of_stay):
-        return False if float(length_of_stay) > 8765.82 else True
+        return False if float(length_of_stay) > longest_length_of_stay else True
+
+    @staticmethod
+    def check_if_spot_constraints_valid(constraints):
+        return all(type(value) is spot_attribute_types.get(attribute) for attribute, value in constraints.items())
+
+    @staticmethod
+    def check_license_plates(plate_numbers):
+        match = license_plate_format.match
+        return [isinstance(plate_number, str) and match(plate_number) is not None for plate_number in plate_numbers]
+
+    @staticmethod
+    def check_lengths_of_stay(lengths_of_stay):
+        match = length_of_stay_format.match
+        return [isinstance(length_of_stay, str) and match(length_of_stay) is not None and
+                float(length_of_stay) <= longest_length_of_stay for length_of_stay in lengths_of_stay]
@@ -1,15 +1,29 @@
 import os
+import re
 import mysql.connector
+from mysql.connector import IntegrityError
+from contextlib import nullcontext
 from datetime import datetime
-from parking_app.checkers import Checkers
+from time import perf_counter
+from parking_app.checkers import Checkers, spot_attributes
+from parking_app.metrics import query_recorder
+from parking_app.sqlite_backend import connect_to_sqlite
+from parking_app.statements import StatementCursor
+from parking_app.rollups import rollup_columns, rollup_events, arrival_event, departure_event, hour_start
 
 from parking_app.exceptions import NoSpotsAvailable, InvalidPlateNumber, LicensePlateNotFound, AllSpotsAvailable, \
     InvalidSpotNumber, SpotNotAvailable, VehicleAlreadyInOtherSpot, UserNotFound, \
     InvalidLengthOfStay, TooLong, MissingData, UsernameAlreadyUsed, EmailAlreadyUsed, InvalidUsername, InvalidEmail, \
-    InvalidPassword
+    InvalidPassword, InvalidSpotConstraints
+
+# Duplicate entry errors end with the name of the violated key. The value that caused it comes earlier in the message,
+# so only the end can be trusted to name the key.
+duplicate_key_format = re.compile(r"for key '(?:\w+\.)?(\w+)'$")
 
 
 def _connect_to_db():
+    if os.getenv("DATABASE_BACKEND", "mysql") == "sqlite":
+        return connect_to_sqlite(os.getenv("DATABASE_PATH", "parking_app.db"))
     cnx = mysql.connector.connect(
         host=os.getenv('DATABASE_HOST'),
         user=os.getenv('DATABASE_USER'),
@@ -20,22 +34,96 @@ def _connect_to_db():
     return cnx
 
 
+def _connect_to_replica():
+    if os.getenv("DATABASE_BACKEND", "mysql") == "sqlite":
+        return connect_to_sqlite(os.getenv("REPLICA_DATABASE_PATH"))
+    cnx = mysql.connector.connect(
+        host=os.getenv('REPLICA_DATABASE_HOST'),
+        user=os.getenv('REPLICA_DATABASE_USER', os.getenv('DATABASE_USER')),
+        password=os.getenv('REPLICA_DATABASE_PASSWORD', os.getenv('DATABASE_PASSWORD')),
+        auth_plugin='mysql_native_password',
+        database=os.getenv('DATABASE_DB')
+    )
+    return cnx
+
+
 class DBClient:
-    def __init__(self):
-        self.cnx = _connect_to_db()
+    prepared_statements = frozenset()
+
+    def __init__(self, cnx=None, read_cnx=None, statement_cache=None, get_read_cnx=None):
+        self.cnx = cnx if cnx is not None else _connect_to_db()
+        # Reads that may be answered slightly out of date go through read_cnx, which is a replica connection when
+        # one is configured and the caller has not just written. Given get_read_cnx instead, the connection is only
+        # taken when such a read is actually made.
+        self._read_cnx = read_cnx
+        self._get_read_cnx = get_read_cnx
+        self.statement_cache = statement_cache
         self.checker = Checkers()
 
+    @property
+    def read_cnx(self):
+        if self._read_cnx is None:
+            self._read_cnx = self._get_read_cnx() if self._get_read_cnx is not None else self.cnx
+        return self._read_cnx
+
+    def _cursor(self, cnx):
+        if self.statement_cache is None:
+            return cnx.cursor()
+        return StatementCursor(cnx, self.statement_cache, self.prepared_statements)
+
+    @staticmethod
+    def _rowcount(cursor):
+        rowcount = cursor.rowcount
+        return rowcount if isinstance(rowcount, int) and rowcount > 0 else 0
+
     @staticmethod
     def _selection_query(cursor, statement, lookup_value=None):
+        started_at = perf_counter()
         if lookup_value is not None:
             cursor.execute(statement, lookup_value)
         else:
             cursor.execute(statement)
         matches = [match for match in cursor]
+        query_recorder.record(started_at, len(matches))
         return matches
 
     @staticmethod
-    def _insertion_query(cursor, statement, input_values=None, filter_values=None):
+    def _streaming_query(cursor, statement, lookup_value=None, chunk_size=500):
+        started_at = perf_counter()
+        if lookup_value is not None:
+            cursor.execute(statement, lookup_value)
+        else:
+            cursor.execute(statement)
+        query_recorder.record(started_at, 0)
+        while True:
+            started_at = perf_counter()
+            matches = cursor.fetchmany(chunk_size)
+            query_recorder.record(started_at, len(matches), queries=0)
+            if not matches:
+                return
+            yield from matches
+
+    @classmethod
+    def _execute(cls, cursor, statement, values=None):
+        started_at = perf_counter()
+        if values is not None:
+            cursor.execute(statement, values)
+        else:
+            cursor.execute(statement)
+        query_recorder.record(started_at, cls._rowcount(cursor))
+
+    @classmethod
+    def _execute_many(cls, cursor, statement, rows):
+        started_at = perf_counter()
+        cursor.executemany(statement, rows)
+        query_recorder.record(started_at, cls._rowcount(cursor))
+
+    @staticmethod
+    def _placeholders(values):
+        return ", ".join(["%s"] * len(values))
+
+    @classmethod
+    def _insertion_query(cls, cursor, statement, input_values=None, filter_values=None):
         sql_data = None
         if input_values and filter_values:
             sql_data = input_values + filter_values
@@ -43,52 +131,98 @@ class DBClient:
             sql_data = input_values
         elif not input_values and filter_values:
             sql_data = filter_values
-        else:
-            cursor.execute(statement)
-        cursor.execute(statement, sql_data)
+        cls._execute(cursor, statement, sql_data)
 
 
 class DBUsers(DBClient):
+    user_data_query = "SELECT user_id, username, email_address, password FROM login_data WHERE username = %s;"
+    prepared_statements = frozenset([user_data_query])
+
+    def __init__(self, cnx=None, known_users=None, user_cache=None, read_cnx=None, statement_cache=None,
+                 get_read_cnx=None):
+        super().__init__(cnx, read_cnx, statement_cache, get_read_cnx)
+        self.known_users = known_users
+        self.user_cache = user_cache
+
+    @staticmethod
+    def _username_key(username):
+        return "username:" + username.lower()
+
+    @staticmethod
+    def _email_address_key(email_address):
+        return "email_address:" + email_address.lower()
+
+    def get_known_user_keys(self):
+        with self.cnx.cursor(buffered=False) as cursor:
+            query = "SELECT username, email_address FROM login_data;"
+            for username, email_address in self._streaming_query(cursor, query):
+                yield self._username_key(username)
+                yield self._email_address_key(email_address)
+
+    def load_known_users(self):
+        self.known_users.ensure_loaded(self.get_known_user_keys)
 
     def create_user(self, username, email, hashed_password):
         with self.cnx.cursor() as cursor:
             query = "INSERT INTO login_data (username, email_address, password) VALUES (%s, %s, %s);"
-            self._insertion_query(cursor, query, [username, email, hashed_password])
+            try:
+                self._insertion_query(cursor, query, [username, email, hashed_password])
+            except IntegrityError as error:
+                self.cnx.rollback()
+                duplicate_key = duplicate_key_format.search(error.msg or "")
+                if duplicate_key is not None and duplicate_key.group(1) == "email_address_UNIQUE":
+                    raise EmailAlreadyUsed
+                raise UsernameAlreadyUsed
             self.cnx.commit()
+        if self.known_users is not None:
+            self.known_users.add(self._username_key(username))
+            self.known_users.add(self._email_address_key(email))
+        if self.user_cache is not None:
+            self.user_cache.invalidate(username.lower())
 
-    def check_if_username_already_exists(self, username):
-        with self.cnx.cursor() as cursor:
-            query = "SELECT EXISTS(SELECT * from login_data WHERE username = %s);"
-            matches = self._selection_query(cursor, query, [username])
-            name = "".join(
-                [str(username) for username in list(sum(matches, ())) if username != 0])
-            return False if not name else True
+    def _might_be_registered(self, username, email_address):
+        if self.known_users is None or not isinstance(username, str) or not isinstance(email_address, str):
+            return True
+        return self._username_key(username) in self.known_users or \
+            self._email_address_key(email_address) in self.known_users
 
-    def check_if_email_address_already_exists(self, email_address):
-        with self.cnx.cursor() as cursor:
-            query = "SELECT EXISTS(SELECT * from login_data WHERE email_address = %s);"
-            matches = self._selection_query(cursor, query, [email_address])
-            address = "".join(
-                [str(email_address) for email_address in list(sum(matches, ())) if email_address != 0])
-            return False if not address else True
+    def check_if_already_registered(self, username, email_address):
+        if not self._might_be_registered(username, email_address):
+            return False, False
+        with self.read_cnx.cursor() as cursor:
+            query = "SELECT username = %s, email_address = %s FROM login_data WHERE username = %s " \
+                    "OR email_address = %s;"
+            matches = self._selection_query(cursor, query, [username, email_address, username, email_address])
+            return any(match[0] for match in matches), any(match[1] for match in matches)
 
     def get_user_data_from_username(self, username):
+        use_cache = self.user_cache is not None and isinstance(username, str)
+        if use_cache:
+            user_data = self.user_cache.get(username.lower())
+            if user_data is not None:
+                return dict(user_data)
         login_data_headers = ["user_id", "username", "email_address", "password"]
-        with self.cnx.cursor() as cursor:
-            query = "SELECT user_id, username, email_address, password FROM login_data WHERE username = %s;"
-            matches = self._selection_query(cursor, query, [username])
-            if matches:
-                raw_values = [value for value in list(sum(matches, ()))]
-                user_data = dict(zip(login_data_headers, raw_values))
-                return user_data
+        with self._cursor(self.read_cnx) as cursor:
+            matches = self._selection_query(cursor, self.user_data_query, [username])
+        if not matches and self.read_cnx is not self.cnx:
+            # A user who has just registered may not have reached the replica yet.
+            with self._cursor(self.cnx) as cursor:
+                matches = self._selection_query(cursor, self.user_data_query, [username])
+        # Misses are not cached: the user may be registering through another worker process right now.
+        if not matches:
             raise UserNotFound
+        user_data = dict(zip(login_data_headers, matches[0]))
+        if use_cache:
+            self.user_cache.set(username.lower(), user_data)
+        return dict(user_data)
 
     def check_registration_input(self, username, email_address, password):
         if not username or not email_address or not password:
             raise MissingData
-        elif self.check_if_username_already_exists(username):
+        username_used, email_address_used = self.check_if_already_registered(username, email_address)
+        if username_used:
             raise UsernameAlreadyUsed
-        elif self.check_if_email_address_already_exists(email_address):
+        elif email_address_used:
             raise EmailAlreadyUsed
         elif not self.checker.check_if_username_valid(username):
             raise InvalidUsername
@@ -99,42 +233,163 @@ class DBUsers(DBClient):
 
 
 class DBData(DBClient):
+    parking_time_insertion_query = "INSERT INTO parked_vehicles_data (spot_id, vehicle_number, arrival_time, " \
+                                   "selected_length_of_stay, expected_departure_time, has_left, " \
+                                   "actual_departure_time, has_expired) VALUES (%s, %s, %s, %s, %s, %s, %s, %s);"
+    occupancy_version_query = "SELECT version FROM occupancy_version WHERE id = 1;"
+    # The bump hands the new version and occupied count back packed into LAST_INSERT_ID, which arrives as the
+    # cursor's lastrowid, instead of reading them with a second query. MySQL runs the assignments left to right and
+    # SQLite against the old row, so the pair is packed before the version is bumped.
+    occupancy_version_bump_query = "UPDATE occupancy_version SET " \
+                                   "occupied = LAST_INSERT_ID(((version + 1) << 32) | (occupied + %s)) & 4294967295, " \
+                                   "version = version + 1 WHERE id = 1;"
+    occupancy_rollup_update_query = "UPDATE occupancy_rollup SET arrivals = arrivals + %s, " \
+                                    "departures = departures + %s, " \
+                                    "peak_occupancy = CASE WHEN peak_occupancy > %s THEN peak_occupancy ELSE %s END, " \
+                                    "closing_occupancy = %s, stay_seconds = stay_seconds + %s, " \
+                                    "overstays = overstays + %s WHERE hour_start = %s;"
+    spot_from_plate_query = "SELECT spot_id FROM parking_spot_data WHERE vehicle_number = %s;"
+    vacant_spot_occupation_query = "UPDATE parking_spot_data SET vehicle_number = %s WHERE spot_id = %s AND " \
+                                   "vehicle_number IS NULL;"
+    spot_vacation_query = "UPDATE parking_spot_data SET vehicle_number = NULL WHERE spot_id = %s;"
+    occupied_spot_vacation_query = "UPDATE parking_spot_data SET vehicle_number = NULL WHERE spot_id = %s AND " \
+                                   "vehicle_number = %s;"
+    departure_query = "UPDATE parked_vehicles_data SET has_left = 1, actual_departure_time = %s  WHERE " \
+                      "vehicle_number = %s and has_left = 0;"
+    # Statements run by nearly every request. Reads of the history stay on plain cursors: prepared cursors return
+    # FLOAT columns through the binary protocol, without the rounding of the text protocol.
+    prepared_statements = frozenset([parking_time_insertion_query, occupancy_version_query,
+                                     occupancy_version_bump_query, occupancy_rollup_update_query, spot_from_plate_query,
+                                     vacant_spot_occupation_query, occupied_spot_vacation_query, departure_query])
 
-    def _check_if_spot_exists(self, parking_spot):
+    def __init__(self, cnx=None, occupancy=None, expirations=None, history_buffer=None, read_cnx=None,
+                 statement_cache=None):
+        super().__init__(cnx, read_cnx, statement_cache)
+        self.occupancy = occupancy
+        self.expirations = expirations
+        self.history_buffer = history_buffer
+
+    # The in-process occupancy index is always loaded from the primary: parks pick their spot from it, and its
+    # version has to follow the ones handed out by _bump_occupancy_version.
+    def get_spots_and_plates(self):
         with self.cnx.cursor() as cursor:
-            query = "SELECT EXISTS(SELECT * from parking_spot_data WHERE spot_id = %s);"
-            matches = self._selection_query(cursor, query, [parking_spot])
-            spot = "".join(
-                [str(parking_spot) for parking_spot in list(sum(matches, ())) if parking_spot != 0])
-            return False if not spot else True
+            query = f"SELECT spot_id, vehicle_number, {', '.join(spot_attributes)} FROM parking_spot_data;"
+            return self._selection_query(cursor, query)
+
+    def get_expected_departures(self):
+        with self.cnx.cursor() as cursor:
+            query = "SELECT spot_id, expected_departure_time FROM parked_vehicles_data WHERE has_left = 0;"
+            return self._selection_query(cursor, query)
+
+    def get_occupancy_version(self):
+        with self._cursor(self.cnx) as cursor:
+            return self._selection_query(cursor, self.occupancy_version_query)[0][0]
 
-    def _check_if_spot_available(self, parking_spot):
+    def write_replication_heartbeat(self, beat_at):
         with self.cnx.cursor() as cursor:
-            query = "SELECT vehicle_number FROM parking_spot_data WHERE spot_id = %s;"
-            matches = self._selection_query(cursor, query, [parking_spot])
-            spot = "".join(
-                [parking_spot for parking_spot in list(sum(matches, ())) if parking_spot is not None])
-            return True if not spot else False
+            self._execute(cursor, "UPDATE replication_heartbeat SET beat_at = %s WHERE id = 1;", [beat_at])
+            self.cnx.commit()
+
+    def get_replication_heartbeat(self):
+        with self.read_cnx.cursor() as cursor:
+            return self._selection_query(cursor, "SELECT beat_at FROM replication_heartbeat WHERE id = 1;")[0][0]
+
+    def _bump_occupancy_version(self, cursor, occupied_change=0):
+        self._execute(cursor, self.occupancy_version_bump_query, [occupied_change])
+        return cursor.lastrowid >> 32, cursor.lastrowid & 0xFFFFFFFF
+
+    def _update_occupancy_rollup(self, cursor, occupied_before, events):
+        # Runs after _bump_occupancy_version, so the version row lock keeps concurrent writers from racing on the
+        # peak and closing occupancy or on inserting the same hour.
+        insert_query = f"INSERT INTO occupancy_rollup (hour_start, {', '.join(rollup_columns)}) VALUES " \
+                       f"(%s, %s, %s, %s, %s, %s, %s);"
+        for hour, changes in rollup_events(events, occupied_before).items():
+            hour = hour.strftime("%Y-%m-%d %H:%M:%S")
+            self._execute(cursor, self.occupancy_rollup_update_query,
+                          [changes["arrivals"], changes["departures"], changes["peak_occupancy"],
+                           changes["peak_occupancy"], changes["closing_occupancy"], changes["stay_seconds"],
+                           changes["overstays"], hour])
+            if self._rowcount(cursor) == 0:
+                self._execute(cursor, insert_query, [hour] + [changes[column] for column in rollup_columns])
+
+    def _get_departure_events(self, cursor, license_plates, actual_departure_time):
+        query = f"SELECT arrival_time, expected_departure_time FROM parked_vehicles_data WHERE vehicle_number IN " \
+                f"({self._placeholders(license_plates)}) AND has_left = 0;"
+        return [departure_event(arrival_time, expected_departure_time, actual_departure_time)
+                for arrival_time, expected_departure_time in self._selection_query(cursor, query, license_plates)]
+
+    def get_occupancy_stats(self, start, end):
+        with self.read_cnx.cursor() as cursor:
+            query = f"SELECT hour_start, {', '.join(rollup_columns)} FROM occupancy_rollup WHERE hour_start >= %s " \
+                    f"AND hour_start < %s ORDER BY hour_start;"
+            return self._selection_query(cursor, query, [hour_start(start).strftime("%Y-%m-%d %H:%M:%S"),
+                                                         end.strftime("%Y-%m-%d %H:%M:%S")])
+
+    def rebuild_occupancy_rollup(self):
+        events = []
+        try:
+            with self.cnx.cursor() as cursor:
+                self._selection_query(cursor, "SELECT version FROM occupancy_version WHERE id = 1 FOR UPDATE;")
+                for row in self._iter_parking_history(self.cnx):
+                    events.append(arrival_event(row[3]))
+                    if row[6] and row[7] is not None:
+                        events.append(departure_event(row[3], row[5], row[7]))
+                occupied = self._selection_query(cursor, "SELECT COUNT(*) FROM parking_spot_data "
+                                                         "WHERE vehicle_number IS NOT NULL;")[0][0]
+                self._execute(cursor, "DELETE FROM occupancy_rollup;")
+                insert_query = f"INSERT INTO occupancy_rollup (hour_start, {', '.join(rollup_columns)}) VALUES " \
+                               f"(%s, %s, %s, %s, %s, %s, %s);"
+                self._execute_many(cursor, insert_query, [[hour.strftime("%Y-%m-%d %H:%M:%S")] +
+                                                          [changes[column] for column in rollup_columns]
+                                                          for hour, changes in rollup_events(events, 0).items()])
+                self._execute(cursor, "UPDATE occupancy_version SET occupied = %s WHERE id = 1;", [occupied])
+            self.cnx.commit()
+        except Exception:
+            self.cnx.rollback()
+            raise
 
-    def check_incoming_values_before_parking(self, spot, plate, length_of_stay):
+    def load_occupancy(self, version=None):
+        if version is None:
+            version = self.get_occupancy_version()
+        self.occupancy.ensure_current(version, lambda: (self.get_spots_and_plates(), self.get_expected_departures()))
+        return version
+
+    def check_incoming_values_before_parking(self, plate, length_of_stay):
         if not self.checker.check_if_length_of_stay_valid(length_of_stay):
             raise InvalidLengthOfStay
         if not self.checker.check_if_length_of_stay_over_a_year(length_of_stay):
             raise TooLong
-        elif not self._check_if_spot_exists(spot):
-            raise InvalidSpotNumber
-        elif not self._check_if_spot_available(spot):
-            raise SpotNotAvailable
         elif not self.checker.check_if_license_plate_valid(plate):
             raise InvalidPlateNumber
-        try:
-            self.get_spot_from_plate(plate)
-            raise VehicleAlreadyInOtherSpot
-        except LicensePlateNotFound:
-            pass
+
+    def check_spot_constraints(self, constraints):
+        constraints = {attribute: value for attribute, value in (constraints or {}).items() if value is not None}
+        if not self.checker.check_if_spot_constraints_valid(constraints):
+            raise InvalidSpotConstraints
+        return constraints
+
+    @staticmethod
+    def _constraint_filter(constraints, table=""):
+        return "".join(f" AND {table}{attribute} = %s" for attribute in constraints)
+
+    def _raise_spot_not_claimed(self, cursor, parking_spot):
+        query = "SELECT vehicle_number FROM parking_spot_data WHERE spot_id = %s;"
+        matches = self._selection_query(cursor, query, [parking_spot])
+        if not matches:
+            raise InvalidSpotNumber
+        raise SpotNotAvailable
+
+    def get_spots(self):
+        if self.occupancy is not None:
+            return self.occupancy.get_spots()
+        with self.read_cnx.cursor() as cursor:
+            query = "SELECT spot_id FROM parking_spot_data ORDER BY spot_id;"
+            return [spot for spot, in self._selection_query(cursor, query)]
 
     def get_vacant_spots(self):
-        with self.cnx.cursor() as cursor:
+        if self.occupancy is not None:
+            return self.occupancy.get_vacant_spots()
+        with self.read_cnx.cursor() as cursor:
             query = "SELECT spot_id FROM parking_spot_data WHERE vehicle_number IS NULL ORDER BY spot_id;"
             matches = self._selection_query(cursor, query)
             if matches:
@@ -143,13 +398,29 @@ class DBData(DBClient):
             raise NoSpotsAvailable
 
     def get_vacant_spots_count(self):
-        vacant_spots_count = str(len(self.get_vacant_spots()))
-        return vacant_spots_count
+        if self.occupancy is not None:
+            vacant_spots_count = self.occupancy.get_vacant_spots_count()
+        else:
+            with self.read_cnx.cursor() as cursor:
+                query = "SELECT COUNT(*) FROM parking_spot_data WHERE vehicle_number IS NULL;"
+                vacant_spots_count = self._selection_query(cursor, query)[0][0]
+        if not vacant_spots_count:
+            raise NoSpotsAvailable
+        return str(vacant_spots_count)
 
     def get_spot_from_plate(self, license_plate):
-        with self.cnx.cursor() as cursor:
-            query = "SELECT spot_id FROM parking_spot_data WHERE vehicle_number = %s;"
-            matches = self._selection_query(cursor, query, [license_plate])
+        return self._get_spot_from_plate(self.read_cnx, license_plate)
+
+    def _get_spot_from_plate(self, cnx, license_plate):
+        if self.occupancy is not None:
+            try:
+                return self.occupancy.get_spot_from_plate(license_plate)
+            except LicensePlateNotFound:
+                if not self.checker.check_if_license_plate_valid(license_plate):
+                    raise InvalidPlateNumber
+                raise
+        with self._cursor(cnx) as cursor:
+            matches = self._selection_query(cursor, self.spot_from_plate_query, [license_plate])
             if matches:
                 return "".join([parking_spot for parking_spot in list(sum(matches, ()))])
             elif not self.checker.check_if_license_plate_valid(license_plate):
@@ -157,7 +428,9 @@ class DBData(DBClient):
             raise LicensePlateNotFound
 
     def get_unavailable_spots_and_plates(self):
-        with self.cnx.cursor() as cursor:
+        if self.occupancy is not None:
+            return self.occupancy.get_unavailable_spots_and_plates()
+        with self.read_cnx.cursor() as cursor:
             query = "SELECT spot_id, vehicle_number FROM parking_spot_data WHERE vehicle_number IS NOT NULL " \
                     "ORDER BY spot_id;"
             matches = self._selection_query(cursor, query)
@@ -166,63 +439,370 @@ class DBData(DBClient):
                 return unavailable_spots_and_plates
             raise AllSpotsAvailable
 
-    def park_car(self, parking_spot, license_plate):
-        with self.cnx.cursor() as cursor:
-            query = "UPDATE parking_spot_data SET vehicle_number = %s WHERE spot_id = %s;"
+    def _record_occupancy_change(self, version, parked=(), left=()):
+        if self.occupancy is not None:
+            self.occupancy.apply(version, [(parking_spot, license_plate, departure_time)
+                                           for parking_spot, license_plate, departure_time, log_id in parked], left)
+        if self.expirations is not None:
+            for parking_spot, license_plate, departure_time, log_id in parked:
+                if log_id is not None:
+                    self.expirations.schedule(log_id, departure_time)
+
+    def _reserve_history(self, license_plates):
+        if self.history_buffer is None:
+            return nullcontext()
+        return self.history_buffer.reserve(len(license_plates), license_plates)
+
+    def _buffer_parking_times(self, stays):
+        # With write-behind the history rows are only written once the transaction that claimed the spots has been
+        # committed; their expirations are scheduled by store_parking_times when the rows get a log_id.
+        if self.history_buffer is not None:
+            for parking_spot, license_plate, arrival_time, length_of_stay, departure_time in stays:
+                self.history_buffer.add(license_plate, self._parking_time_values(
+                    parking_spot, license_plate, arrival_time, length_of_stay, departure_time, 0, None, 0))
+
+    def _flush_history(self, license_plates):
+        if self.history_buffer is not None and self.history_buffer.is_pending(license_plates):
+            self.history_buffer.flush(license_plates)
+
+    def _occupy_spot(self, cursor, parking_spot, license_plate, only_if_vacant):
+        query = self.vacant_spot_occupation_query if only_if_vacant else \
+            "UPDATE parking_spot_data SET vehicle_number = %s WHERE spot_id = %s;"
+        try:
             self._insertion_query(cursor, query, [license_plate], [parking_spot])
-            self.cnx.commit()
+        except IntegrityError:
+            raise VehicleAlreadyInOtherSpot
+
+    def park_car(self, parking_spot, license_plate, length_of_stay):
+        self.check_incoming_values_before_parking(license_plate, length_of_stay)
+        arrival_time, departure_time = self.checker.calculate_arrival_and_departure_time(length_of_stay)
+        with self._reserve_history([license_plate]):
+            try:
+                with self._cursor(self.cnx) as cursor:
+                    self._occupy_spot(cursor, parking_spot, license_plate, only_if_vacant=True)
+                    if cursor.rowcount != 1:
+                        self._raise_spot_not_claimed(cursor, parking_spot)
+                    log_id = None
+                    if self.history_buffer is None:
+                        log_id = self._insert_parking_time(cursor, parking_spot, license_plate, arrival_time,
+                                                           length_of_stay, departure_time, 0, None, 0)
+                    version, occupied = self._bump_occupancy_version(cursor, 1)
+                    self._update_occupancy_rollup(cursor, occupied - 1, [arrival_event(arrival_time)])
+                self.cnx.commit()
+            except Exception:
+                self.cnx.rollback()
+                raise
+            self._buffer_parking_times([(parking_spot, license_plate, arrival_time, length_of_stay, departure_time)])
+        self._record_occupancy_change(version, parked=[(parking_spot, license_plate, departure_time, log_id)])
+        return parking_spot
+
+    def _claim_spot_from_db(self, cursor, license_plate, constraints):
+        query = f"SELECT spot_id FROM parking_spot_data WHERE vehicle_number IS NULL" \
+                f"{self._constraint_filter(constraints)} ORDER BY spot_id LIMIT 1 FOR UPDATE SKIP LOCKED;"
+        matches = self._selection_query(cursor, query, list(constraints.values()) or None)
+        if not matches:
+            raise NoSpotsAvailable
+        parking_spot = matches[0][0]
+        self._occupy_spot(cursor, parking_spot, license_plate, only_if_vacant=False)
+        return parking_spot
+
+    def park_at_next_available_spot(self, license_plate, length_of_stay, constraints=None):
+        self.check_incoming_values_before_parking(license_plate, length_of_stay)
+        constraints = self.check_spot_constraints(constraints)
+        arrival_time, departure_time = self.checker.calculate_arrival_and_departure_time(length_of_stay)
+        with self._reserve_history([license_plate]):
+            try:
+                with self._cursor(self.cnx) as cursor:
+                    # The index only turns away requests when no matching spot is vacant. Claiming the spot it
+                    # would pick first would have every concurrent request queue on that one row, so the claim
+                    # itself skips the rows other transactions have locked.
+                    if self.occupancy is not None:
+                        self.occupancy.get_first_vacant_spot_matching(constraints)
+                    parking_spot = self._claim_spot_from_db(cursor, license_plate, constraints)
+                    log_id = None
+                    if self.history_buffer is None:
+                        log_id = self._insert_parking_time(cursor, parking_spot, license_plate, arrival_time,
+                                                           length_of_stay, departure_time, 0, None, 0)
+                    version, occupied = self._bump_occupancy_version(cursor, 1)
+                    self._update_occupancy_rollup(cursor, occupied - 1, [arrival_event(arrival_time)])
+                self.cnx.commit()
+            except Exception:
+                self.cnx.rollback()
+                raise
+            self._buffer_parking_times([(parking_spot, license_plate, arrival_time, length_of_stay, departure_time)])
+        self._record_occupancy_change(version, parked=[(parking_spot, license_plate, departure_time, log_id)])
+        return parking_spot
+
+    @staticmethod
+    def _parking_time_values(spot_id, license_plate, arrival_time, length_of_stay, expected_departure_time, has_left,
+                             actual_departure_time, has_expired):
+        return [spot_id, license_plate, arrival_time.strftime("%Y-%m-%d %H:%M:%S"), length_of_stay,
+                expected_departure_time.strftime("%Y-%m-%d %H:%M:%S"), int(has_left), actual_departure_time,
+                int(has_expired)]
+
+    def _insert_parking_time(self, cursor, *parking_time):
+        self._insertion_query(cursor, self.parking_time_insertion_query, self._parking_time_values(*parking_time))
+        return cursor.lastrowid
 
     def store_parking_time(self, spot_id, license_plate, arrival_time, length_of_stay, expected_departure_time,
                            has_left, actual_departure_time, has_expired):
-        with self.cnx.cursor() as cursor:
-            query = "INSERT INTO parked_vehicles_data (spot_id, vehicle_number, arrival_time, " \
-                    "selected_length_of_stay, expected_departure_time, has_left, actual_departure_time, has_expired) " \
-                    "VALUES (%s, %s, %s, %s, %s, %s, %s, %s);"
-            incoming_data = [spot_id, license_plate, arrival_time.strftime("%Y-%m-%d %H:%M:%S"), length_of_stay,
-                             expected_departure_time.strftime("%Y-%m-%d %H:%M:%S"), int(has_left),
-                             actual_departure_time, int(has_expired)]
-            self._insertion_query(cursor, query, incoming_data)
+        log_id = None
+        if self.history_buffer is not None:
+            with self.history_buffer.reserve(1):
+                self.history_buffer.add(license_plate, self._parking_time_values(
+                    spot_id, license_plate, arrival_time, length_of_stay, expected_departure_time, has_left,
+                    actual_departure_time, has_expired))
+        else:
+            with self._cursor(self.cnx) as cursor:
+                log_id = self._insert_parking_time(cursor, spot_id, license_plate, arrival_time, length_of_stay,
+                                                   expected_departure_time, has_left, actual_departure_time,
+                                                   has_expired)
+                self.cnx.commit()
+        if self.occupancy is not None and not has_left:
+            self.occupancy.set_expected_departure(spot_id, expected_departure_time)
+        if self.expirations is not None and not has_expired and log_id is not None:
+            self.expirations.schedule(log_id, expected_departure_time)
+        return log_id
+
+    def store_parking_times(self, parking_times):
+        try:
+            with self.cnx.cursor() as cursor:
+                self._execute_many(cursor, self.parking_time_insertion_query, parking_times)
+                staying_plates = [values[1] for values in parking_times if not values[5] and not values[7]]
+                stays = []
+                if staying_plates:
+                    query = f"SELECT log_id, expected_departure_time FROM parked_vehicles_data WHERE vehicle_number " \
+                            f"IN ({self._placeholders(staying_plates)}) AND has_left = 0 AND has_expired = 0;"
+                    stays = self._selection_query(cursor, query, staying_plates)
             self.cnx.commit()
+        except Exception:
+            self.cnx.rollback()
+            raise
+        if self.expirations is not None:
+            for log_id, expected_departure_time in stays:
+                self.expirations.schedule(log_id, expected_departure_time)
 
     def leave_parking_spot(self, license_plate):
-        with self.cnx.cursor() as cursor:
-            if not self.checker.check_if_license_plate_valid(license_plate):
-                raise InvalidPlateNumber
-            parking_spot = self.get_spot_from_plate(license_plate)
-            update_parking_spot_data_query = "UPDATE parking_spot_data SET vehicle_number = NULL WHERE spot_id = %s;"
-            actual_departure_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            update_parked_vehicles_data_query = "UPDATE parked_vehicles_data SET has_left = 1, actual_departure_time " \
-                                                "= %s  WHERE vehicle_number = %s and has_left = 0;"
-            self._insertion_query(cursor, update_parking_spot_data_query, filter_values=[parking_spot])
-            self._insertion_query(cursor, update_parked_vehicles_data_query, [actual_departure_time], [license_plate])
+        self._flush_history([license_plate])
+        if not self.checker.check_if_license_plate_valid(license_plate):
+            raise InvalidPlateNumber
+        parking_spot = self._get_spot_from_plate(self.cnx, license_plate)
+        try:
+            with self._cursor(self.cnx) as cursor:
+                # The spot is only vacated if the vehicle is still in it: a concurrent leave of the same plate waits
+                # on the row lock and then finds nothing to vacate, so the departure is only counted once.
+                self._insertion_query(cursor, self.occupied_spot_vacation_query,
+                                      filter_values=[parking_spot, license_plate])
+                if cursor.rowcount != 1:
+                    raise LicensePlateNotFound
+                actual_departure_time = datetime.now().replace(microsecond=0)
+                departures = self._get_departure_events(cursor, [license_plate], actual_departure_time)
+                self._insertion_query(cursor, self.departure_query,
+                                      [actual_departure_time.strftime("%Y-%m-%d %H:%M:%S")], [license_plate])
+                version, occupied = self._bump_occupancy_version(cursor, -1)
+                self._update_occupancy_rollup(cursor, occupied + 1, departures)
             self.cnx.commit()
+        except Exception:
+            self.cnx.rollback()
+            raise
+        self._record_occupancy_change(version, left=[license_plate])
 
-    def get_next_available_spot(self):
-        with self.cnx.cursor() as cursor:
+    def park_cars(self, parking_requests):
+        results = [None] * len(parking_requests)
+        claims = []
+        plates_valid = self.checker.check_license_plates(
+            [parking_request.get("license_plate") if isinstance(parking_request, dict) else None
+             for parking_request in parking_requests])
+        lengths_of_stay_valid = self.checker.check_lengths_of_stay(
+            [parking_request.get("length_of_stay") if isinstance(parking_request, dict) else None
+             for parking_request in parking_requests])
+        for index, parking_request in enumerate(parking_requests):
+            try:
+                parking_spot = parking_request["parking_spot"]
+                license_plate = parking_request["license_plate"]
+                length_of_stay = parking_request["length_of_stay"]
+                if not isinstance(parking_spot, str):
+                    raise InvalidSpotNumber
+                if not plates_valid[index] or not lengths_of_stay_valid[index]:
+                    self.check_incoming_values_before_parking(license_plate, length_of_stay)
+                arrival_time, departure_time = self.checker.calculate_arrival_and_departure_time(length_of_stay)
+                claims.append((index, parking_spot, license_plate, arrival_time, length_of_stay, departure_time))
+            except (KeyError, TypeError, InvalidSpotNumber, InvalidPlateNumber, InvalidLengthOfStay, TooLong) as error:
+                results[index] = error
+        if not claims:
+            return results
+        spots = [claim[1] for claim in claims]
+        plates = [claim[2] for claim in claims]
+        accepted = []
+        with self._reserve_history([claim[2] for claim in claims]):
+            try:
+                with self._cursor(self.cnx) as cursor:
+                    query = f"SELECT spot_id, vehicle_number FROM parking_spot_data WHERE spot_id IN " \
+                            f"({self._placeholders(spots)}) OR vehicle_number IN ({self._placeholders(plates)}) " \
+                            f"FOR UPDATE;"
+                    matches = self._selection_query(cursor, query, spots + plates)
+                    plates_by_spot = {spot: plate for spot, plate in matches}
+                    parked_plates = {plate for spot, plate in matches if plate is not None}
+                    for claim in claims:
+                        index, parking_spot, license_plate = claim[:3]
+                        if parking_spot not in plates_by_spot:
+                            results[index] = InvalidSpotNumber()
+                        elif plates_by_spot[parking_spot] is not None:
+                            results[index] = SpotNotAvailable()
+                        elif license_plate in parked_plates:
+                            results[index] = VehicleAlreadyInOtherSpot()
+                        else:
+                            plates_by_spot[parking_spot] = license_plate
+                            parked_plates.add(license_plate)
+                            accepted.append(claim)
+                    if accepted:
+                        query = "UPDATE parking_spot_data SET vehicle_number = %s WHERE spot_id = %s;"
+                        self._execute_many(cursor, query, [[claim[2], claim[1]] for claim in accepted])
+                        log_ids = {}
+                        if self.history_buffer is None:
+                            self._execute_many(cursor, self.parking_time_insertion_query,
+                                               [self._parking_time_values(*claim[1:], 0, None, 0)
+                                                for claim in accepted])
+                            accepted_plates = [claim[2] for claim in accepted]
+                            query = f"SELECT vehicle_number, log_id FROM parked_vehicles_data WHERE vehicle_number " \
+                                    f"IN ({self._placeholders(accepted_plates)}) AND has_left = 0;"
+                            log_ids = dict(self._selection_query(cursor, query, accepted_plates))
+                        version, occupied = self._bump_occupancy_version(cursor, len(accepted))
+                        self._update_occupancy_rollup(cursor, occupied - len(accepted),
+                                                      [arrival_event(claim[3]) for claim in accepted])
+                self.cnx.commit()
+            except Exception:
+                self.cnx.rollback()
+                raise
+            self._buffer_parking_times([claim[1:] for claim in accepted])
+        if accepted:
+            self._record_occupancy_change(version, parked=[(parking_spot, license_plate, departure_time,
+                                                            log_ids.get(license_plate))
+                                                           for index, parking_spot, license_plate, arrival_time,
+                                                           length_of_stay, departure_time in accepted])
+        for index, parking_spot, license_plate, arrival_time, length_of_stay, departure_time in accepted:
+            results[index] = parking_spot
+        return results
+
+    def leave_parking_spots(self, leaving_requests):
+        results = [None] * len(leaving_requests)
+        departures = []
+        plates_valid = self.checker.check_license_plates(
+            [leaving_request.get("license_plate") if isinstance(leaving_request, dict) else None
+             for leaving_request in leaving_requests])
+        for index, leaving_request in enumerate(leaving_requests):
+            try:
+                license_plate = leaving_request["license_plate"]
+                if not plates_valid[index] and not self.checker.check_if_license_plate_valid(license_plate):
+                    raise InvalidPlateNumber
+                departures.append((index, license_plate))
+            except (KeyError, TypeError, InvalidPlateNumber) as error:
+                results[index] = error
+        if not departures:
+            return results
+        plates = [license_plate for index, license_plate in departures]
+        self._flush_history(plates)
+        leaving = []
+        try:
+            with self._cursor(self.cnx) as cursor:
+                query = f"SELECT vehicle_number, spot_id FROM parking_spot_data WHERE vehicle_number IN " \
+                        f"({self._placeholders(plates)}) FOR UPDATE;"
+                spots_by_plate = dict(self._selection_query(cursor, query, plates))
+                for index, license_plate in departures:
+                    parking_spot = spots_by_plate.pop(license_plate, None)
+                    if parking_spot is None:
+                        results[index] = LicensePlateNotFound()
+                    else:
+                        leaving.append((index, license_plate, parking_spot))
+                if leaving:
+                    actual_departure_time = datetime.now().replace(microsecond=0)
+                    departures = self._get_departure_events(cursor, [license_plate for index, license_plate,
+                                                                     parking_spot in leaving], actual_departure_time)
+                    self._execute_many(cursor, self.spot_vacation_query, [[parking_spot]
+                                                                          for index, license_plate, parking_spot
+                                                                          in leaving])
+                    query = "UPDATE parked_vehicles_data SET has_left = 1, actual_departure_time = %s " \
+                            "WHERE vehicle_number = %s and has_left = 0;"
+                    departed_at = actual_departure_time.strftime("%Y-%m-%d %H:%M:%S")
+                    self._execute_many(cursor, query, [[departed_at, license_plate]
+                                                       for index, license_plate, parking_spot in leaving])
+                    version, occupied = self._bump_occupancy_version(cursor, -len(leaving))
+                    self._update_occupancy_rollup(cursor, occupied + len(leaving), departures)
+            self.cnx.commit()
+        except Exception:
+            self.cnx.rollback()
+            raise
+        if leaving:
+            self._record_occupancy_change(version, left=[license_plate
+                                                         for index, license_plate, parking_spot in leaving])
+        for index, license_plate, parking_spot in leaving:
+            results[index] = parking_spot
+        return results
+
+    def iter_parking_history(self, page_size=10000, chunk_size=500):
+        return self._iter_parking_history(self.read_cnx, page_size, chunk_size)
+
+    def _iter_parking_history(self, cnx, page_size=10000, chunk_size=500):
+        query = "SELECT log_id, spot_id, vehicle_number, arrival_time, selected_length_of_stay, " \
+                "expected_departure_time, has_left, actual_departure_time, has_expired FROM parked_vehicles_data " \
+                "WHERE log_id > %s ORDER BY log_id LIMIT %s;"
+        last_log_id = 0
+        while True:
+            page_rows = 0
+            with cnx.cursor(buffered=False) as cursor:
+                try:
+                    for row in self._streaming_query(cursor, query, [last_log_id, page_size], chunk_size):
+                        page_rows += 1
+                        last_log_id = row[0]
+                        yield row
+                except GeneratorExit:
+                    # Closed early, e.g. by a client leaving mid-export: the rest of the page is read so that the
+                    # cursor closes without an unread result and the connection can be reused.
+                    cursor.fetchall()
+                    raise
+            if page_rows < page_size:
+                return
+
+    def get_next_available_spot(self, constraints=None):
+        constraints = self.check_spot_constraints(constraints)
+        if self.occupancy is not None:
             try:
-                if self.get_vacant_spots():
-                    next_available_spot = self.get_vacant_spots()[0]
-                    return next_available_spot
+                return self.occupancy.get_first_vacant_spot_matching(constraints)
             except NoSpotsAvailable:
-                pass
-            query = "SELECT spot_id, expected_departure_time FROM parked_vehicles_data WHERE has_left = 0;"
-            matches = self._selection_query(cursor, query)
+                next_departure = self.occupancy.get_next_departure_matching(constraints)
+                return next_departure[0] if next_departure else None
+        constraint_values = list(constraints.values())
+        with self.read_cnx.cursor() as cursor:
+            query = f"SELECT spot_id FROM parking_spot_data WHERE vehicle_number IS NULL" \
+                    f"{self._constraint_filter(constraints)} ORDER BY spot_id LIMIT 1;"
+            matches = self._selection_query(cursor, query, constraint_values or None)
             if matches:
-                spots_and_departure_times = {spot_id: expected_departure_time for spot_id, expected_departure_time
-                                             in matches}
-                now = datetime.now()
-                next_available_spot = min(list(spots_and_departure_times.items()), key=lambda x: abs(x[1] - now))[0]
-                return next_available_spot
+                return matches[0][0]
+            if constraints:
+                query = f"SELECT parked_vehicles_data.spot_id FROM parked_vehicles_data JOIN parking_spot_data " \
+                        f"ON parking_spot_data.spot_id = parked_vehicles_data.spot_id WHERE has_left = 0" \
+                        f"{self._constraint_filter(constraints, 'parking_spot_data.')} " \
+                        f"ORDER BY expected_departure_time LIMIT 1;"
+            else:
+                query = "SELECT spot_id FROM parked_vehicles_data WHERE has_left = 0 " \
+                        "ORDER BY expected_departure_time LIMIT 1;"
+            matches = self._selection_query(cursor, query, constraint_values or None)
+            if matches:
+                return matches[0][0]
 
-    def check_if_stay_expired(self):
+    def get_unexpired_stays(self):
         with self.cnx.cursor() as cursor:
-            selection_query = "SELECT spot_id, expected_departure_time FROM parked_vehicles_data WHERE has_expired = 0;"
-            matches = self._selection_query(cursor, selection_query)
-            if matches:
-                now = datetime.now()
-                spots_and_departure_times = {spot_id: expected_departure_time for spot_id, expected_departure_time
-                                             in matches if now > expected_departure_time}
-                for parking_spot in spots_and_departure_times.keys():
-                    insertion_query = "UPDATE parked_vehicles_data SET has_expired = 1 WHERE spot_id = %s;"
-                    self._insertion_query(cursor, insertion_query, filter_values=[parking_spot])
-                self.cnx.commit()
\ No newline at end of file
+            query = "SELECT log_id, expected_departure_time FROM parked_vehicles_data WHERE has_expired = 0;"
+            return self._selection_query(cursor, query)
+
+    def get_parked_vehicles_from_stays(self, log_ids):
+        with self.cnx.cursor() as cursor:
+            query = f"SELECT spot_id, vehicle_number FROM parked_vehicles_data WHERE log_id IN " \
+                    f"({self._placeholders(log_ids)}) AND has_left = 0;"
+            return self._selection_query(cursor, query, list(log_ids))
+
+    def expire_stays(self, log_ids):
+        with self.cnx.cursor() as cursor:
+            query = f"UPDATE parked_vehicles_data SET has_expired = 1 WHERE log_id IN ({self._placeholders(log_ids)});"
+            self._insertion_query(cursor, query, filter_values=list(log_ids))
+            self.cnx.commit()
@@ -0,0 +1,60 @@
+import json
+from collections import deque
+from itertools import islice
+from threading import Condition
+
+
+def format_event(sequence, event, data):
+    return f"id: {sequence}\nevent: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+class OccupancyPublisher:
+
+    def __init__(self, history=1024, heartbeat=15):
+        self.heartbeat = heartbeat
+        self.subscribers = 0
+        self.published_count = 0
+        self._messages = deque(maxlen=history)
+        self._sequence = 0
+        self._condition = Condition()
+
+    def publish(self, event, data):
+        with self._condition:
+            self._sequence += 1
+            self._messages.append(format_event(self._sequence, event, data))
+            self.published_count += 1
+            self._condition.notify_all()
+
+    def _messages_after(self, sequence):
+        # Messages are encoded once when published; subscribers only slice the shared buffer.
+        oldest_sequence = self._sequence - len(self._messages) + 1
+        if sequence < oldest_sequence - 1 or sequence > self._sequence:
+            return None
+        return list(islice(self._messages, sequence - oldest_sequence + 1, None))
+
+    def listen(self, last_event_id=None, get_state=None):
+        with self._condition:
+            self.subscribers += 1
+            sequence = self._sequence if last_event_id is None else last_event_id
+        try:
+            if last_event_id is None and get_state is not None:
+                yield format_event(sequence, "snapshot", get_state())
+            while True:
+                with self._condition:
+                    if sequence == self._sequence:
+                        self._condition.wait(self.heartbeat)
+                    messages = self._messages_after(sequence)
+                    sequence = self._sequence
+                if messages is None:
+                    yield format_event(sequence, "resync", get_state() if get_state is not None else {})
+                elif messages:
+                    yield "".join(messages)
+                else:
+                    yield ": keep-alive\n\n"
+        finally:
+            with self._condition:
+                self.subscribers -= 1
+
+    def stats(self):
+        with self._condition:
+            return {"subscribers": self.subscribers, "published": self.published_count}
@@ -60,3 +60,19 @@ class UsernameAlreadyUsed(Exception):
 
 class EmailAlreadyUsed(Exception):
     pass
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class HashingPoolSaturated(Exception):
+    pass
+
+
+class InvalidSpotConstraints(Exception):
+    pass
+
+
+class HistoryBufferFull(Exception):
+    pass
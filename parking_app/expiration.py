@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+from heapq import heapify, heappush, heappop
+from threading import Lock
+
+
+class ExpirationScheduler:
+
+    def __init__(self, scheduler, expire_stays, retry_delay=timedelta(seconds=60), job_id="stay_expiration"):
+        self.scheduler = scheduler
+        self.expire_stays = expire_stays
+        self.retry_delay = retry_delay
+        self.job_id = job_id
+        self.loaded = False
+        self.expired_count = 0
+        self._lock = Lock()
+        self._departures = []
+        self._next_run_time = None
+
+    def load(self, log_ids_and_departure_times):
+        with self._lock:
+            scheduled = {log_id for departure_time, log_id in self._departures}
+            self._departures.extend((departure_time, log_id) for log_id, departure_time in log_ids_and_departure_times
+                                    if log_id not in scheduled)
+            heapify(self._departures)
+            self.loaded = True
+            self._arm()
+
+    def ensure_loaded(self, load_unexpired_stays):
+        with self._lock:
+            if self.loaded:
+                return
+        self.load(load_unexpired_stays())
+
+    def schedule(self, log_id, departure_time):
+        with self._lock:
+            heappush(self._departures, (departure_time, log_id))
+            if self._next_run_time is None or departure_time < self._next_run_time:
+                self._arm()
+
+    def _arm(self, run_time=None):
+        if run_time is None:
+            if not self._departures:
+                self._next_run_time = None
+                return
+            run_time = self._departures[0][0]
+        self._next_run_time = run_time
+        self.scheduler.add_job(func=self._expire_due_stays, trigger="date", run_date=run_time, id=self.job_id,
+                               replace_existing=True, misfire_grace_time=None, coalesce=True)
+
+    def _expire_due_stays(self):
+        now = datetime.now()
+        due = []
+        with self._lock:
+            while self._departures and self._departures[0][0] <= now:
+                due.append(heappop(self._departures))
+        try:
+            if due:
+                self.expire_stays([log_id for departure_time, log_id in due])
+        except Exception:
+            with self._lock:
+                for entry in due:
+                    heappush(self._departures, entry)
+                self._arm(now + self.retry_delay)
+            raise
+        with self._lock:
+            self.expired_count += len(due)
+            self._arm()
+
+    def stats(self):
+        with self._lock:
+            return {"pending": len(self._departures), "expired": self.expired_count,
+                    "next_run_time": self._next_run_time}
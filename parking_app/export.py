@@ -0,0 +1,41 @@
+import csv
+import io
+import json
+
+parking_history_headers = ["log_id", "spot_id", "vehicle_number", "arrival_time", "selected_length_of_stay",
+                           "expected_departure_time", "has_left", "actual_departure_time", "has_expired"]
+
+
+def _batched(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def to_ndjson(headers, rows, batch_size=500):
+    for batch in _batched(rows, batch_size):
+        yield "".join(json.dumps(dict(zip(headers, row)), default=str) + "\n" for row in batch)
+
+
+def to_csv(headers, rows, batch_size=500):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(headers)
+    for batch in _batched(rows, batch_size):
+        writer.writerows(batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+export_formats = {
+    "ndjson": (to_ndjson, "application/x-ndjson"),
+    "csv": (to_csv, "text/csv")
+}
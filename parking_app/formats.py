@@ -0,0 +1,32 @@
+import gzip
+import json
+
+json_mimetype = "application/json"
+columnar_mimetype = "application/vnd.parking-app.columnar+json"
+bitmap_mimetype = "application/vnd.parking-app.bitmap"
+
+format_names = {
+    json_mimetype: "json",
+    columnar_mimetype: "columnar",
+    bitmap_mimetype: "bitmap"
+}
+
+
+def pack_bitmap(spots, selected_spots):
+    selected_spots = set(selected_spots)
+    bits = bytearray((len(spots) + 7) // 8)
+    for position, spot in enumerate(spots):
+        if spot in selected_spots:
+            bits[position >> 3] |= 0x80 >> (position & 7)
+    return bytes(bits)
+
+
+def to_columnar(spots, plates=None):
+    columns = {"spots": list(spots)}
+    if plates is not None:
+        columns["plates"] = list(plates)
+    return json.dumps(columns, separators=(",", ":"))
+
+
+def compress(body):
+    return gzip.compress(body.encode("utf-8") if isinstance(body, str) else body, mtime=0)
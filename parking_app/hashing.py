@@ -0,0 +1,86 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_all_start_methods, get_context
+from threading import BoundedSemaphore, Lock
+
+import bcrypt
+
+from parking_app.exceptions import HashingPoolSaturated
+
+
+def _hash_password(password, log_rounds):
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(log_rounds)).decode("utf-8")
+
+
+def _check_password(password_hash, password):
+    if isinstance(password_hash, str):
+        password_hash = password_hash.encode("utf-8")
+    return bcrypt.checkpw(password.encode("utf-8"), password_hash)
+
+
+class PasswordHasher:
+
+    def __init__(self, workers, queue_depth, log_rounds=12):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.log_rounds = log_rounds
+        # Forking a process that runs the scheduler and request threads can copy locks held by those threads into
+        # the workers, so they are started from a clean interpreter instead.
+        self._context = get_context("forkserver" if "forkserver" in get_all_start_methods() else "spawn")
+        self.executor = self._create_executor()
+        self._slots = BoundedSemaphore(workers + queue_depth)
+        self._lock = Lock()
+        self.rejected_count = 0
+        self.restarted_count = 0
+
+    def _create_executor(self):
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=self._context)
+
+    def _restart(self, executor):
+        # A worker that died takes the whole pool down with it. The first request to notice replaces the pool, and
+        # the requests that were waiting on it are answered as if the pool was busy.
+        with self._lock:
+            if self.executor is executor:
+                self.executor = self._create_executor()
+                self.restarted_count += 1
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, function, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected_count += 1
+            raise HashingPoolSaturated
+        executor = self.executor
+        try:
+            future = executor.submit(function, *args)
+        except BrokenProcessPool:
+            self._slots.release()
+            self._restart(executor)
+            raise HashingPoolSaturated
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda done: self._slots.release())
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            self._restart(executor)
+            raise HashingPoolSaturated
+
+    def generate_password_hash(self, password):
+        if not isinstance(password, str):
+            raise TypeError
+        return self._run(_hash_password, password, self.log_rounds)
+
+    def check_password_hash(self, password_hash, password):
+        if not isinstance(password, str):
+            raise TypeError
+        return self._run(_check_password, password_hash, password)
+
+    def stats(self):
+        with self._lock:
+            return {"workers": self.workers, "queue_depth": self.queue_depth, "rejected": self.rejected_count,
+                    "restarted": self.restarted_count}
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
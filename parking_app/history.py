@@ -0,0 +1,168 @@
+import logging
+from collections import Counter, deque
+from contextlib import contextmanager
+from threading import Condition, Thread
+from time import monotonic
+
+from parking_app.exceptions import HistoryBufferFull
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryBuffer:
+
+    def __init__(self, write_batch, max_size=10000, flush_interval=0.05, batch_size=500, timeout=1.0,
+                 retry_delay=1.0, max_attempts=3):
+        self.write_batch = write_batch
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.retry_delay = retry_delay
+        self.max_attempts = max_attempts
+        self.written_count = 0
+        self.failed_batches = 0
+        self.rejected_count = 0
+        self.dropped_count = 0
+        self._failed_attempts = 0
+        self._records = deque()
+        self._pending_plates = Counter()
+        self._reserved = 0
+        self._sequence = 0
+        self._written_sequence = 0
+        self._flush_sequence = 0
+        self._closed = False
+        self._condition = Condition()
+        self._flusher = Thread(target=self._run, name="history-flusher", daemon=True)
+        self._flusher.start()
+
+    @contextmanager
+    def reserve(self, count, license_plates=()):
+        # Room is taken before the caller's transaction starts, so a full buffer turns a request away before anything
+        # is committed rather than after. The plates count as pending from then on, so a leave that runs between the
+        # caller's commit and its add waits for the row instead of missing it.
+        deadline = monotonic() + self.timeout
+        with self._condition:
+            while len(self._records) + self._reserved + count > self.max_size:
+                remaining = deadline - monotonic()
+                if self._closed or remaining <= 0 or not self._condition.wait(remaining):
+                    self.rejected_count += 1
+                    raise HistoryBufferFull
+            self._reserved += count
+            self._pending_plates.update(license_plates)
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._reserved -= count
+                self._discard_pending(license_plates)
+                self._condition.notify_all()
+
+    def add(self, license_plate, values):
+        with self._condition:
+            self._sequence += 1
+            self._records.append((self._sequence, monotonic(), license_plate, values))
+            self._pending_plates[license_plate] += 1
+            if len(self._records) == 1 or len(self._records) >= self.batch_size:
+                self._condition.notify_all()
+
+    def _discard_pending(self, license_plates):
+        self._pending_plates.subtract(license_plates)
+        self._pending_plates += Counter()
+
+    def _is_pending(self, license_plates):
+        return any(license_plate in self._pending_plates for license_plate in license_plates)
+
+    def is_pending(self, license_plates):
+        with self._condition:
+            return self._is_pending(license_plates)
+
+    def flush(self, license_plates=None, timeout=None):
+        # Without plates, waits for everything queued so far. With plates, waits until none of them is pending,
+        # including rows that a reservation still open for them has yet to add.
+        deadline = monotonic() + (self.timeout if timeout is None else timeout)
+        with self._condition:
+            target = self._sequence
+            while self._written_sequence < target if license_plates is None else self._is_pending(license_plates):
+                self._flush_sequence = max(self._flush_sequence, self._sequence)
+                self._condition.notify_all()
+                remaining = deadline - monotonic()
+                if remaining <= 0 or not self._condition.wait(remaining):
+                    raise HistoryBufferFull
+
+    def _next_batch(self):
+        with self._condition:
+            while not self._closed:
+                if len(self._records) >= self.batch_size or \
+                        (self._records and self._flush_sequence >= self._records[0][0]):
+                    break
+                if self._records:
+                    remaining = self._records[0][1] + self.flush_interval - monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                else:
+                    self._condition.wait()
+            if self._closed:
+                return None
+            return [self._records.popleft() for record in range(min(self.batch_size, len(self._records)))]
+
+    def _write_rows(self, batch):
+        # The last attempt writes the rows one at a time, so a row the database keeps refusing is dropped without
+        # taking the rest of its batch along.
+        written = []
+        for record in batch:
+            try:
+                self.write_batch([record[3]])
+                written.append(record)
+            except Exception as error:
+                logger.error("Dropping parking history row %r after %d attempts: %r", record[3], self.max_attempts,
+                             error)
+        return written
+
+    def _write(self, batch):
+        try:
+            self.write_batch([values for sequence, enqueued_at, license_plate, values in batch])
+            written = batch
+        except Exception:
+            with self._condition:
+                self.failed_batches += 1
+                self._failed_attempts += 1
+                give_up = self._failed_attempts >= self.max_attempts
+                if not give_up:
+                    self._records.extendleft(reversed(batch))
+                    retry_at = monotonic() + self.retry_delay
+                    while not self._closed and monotonic() < retry_at:
+                        self._condition.wait(retry_at - monotonic())
+                    return False
+            written = self._write_rows(batch)
+        with self._condition:
+            self._failed_attempts = 0
+            self._written_sequence = batch[-1][0]
+            self.written_count += len(written)
+            self.dropped_count += len(batch) - len(written)
+            self._discard_pending([license_plate for sequence, enqueued_at, license_plate, values in batch])
+            self._condition.notify_all()
+        return True
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            self._write(batch)
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._flusher.join()
+        # Whatever is still queued is written from the exiting thread, so a clean shutdown loses nothing the
+        # database accepts.
+        while self._records:
+            self._write([self._records.popleft() for record in range(min(self.batch_size, len(self._records)))])
+
+    def stats(self):
+        with self._condition:
+            return {"queued": len(self._records), "written": self.written_count, "failed_batches": self.failed_batches,
+                    "rejected": self.rejected_count, "dropped": self.dropped_count}
@@ -1,30 +1,243 @@
-from flask import Flask, request, session
+from flask import Flask, Response, request, session, g, stream_with_context
 from functools import wraps
+from datetime import datetime, timedelta
+from time import perf_counter, time
 import os
 import atexit
 from apscheduler.schedulers.background import BackgroundScheduler
-from flask_bcrypt import Bcrypt
-from parking_app.db import DBUsers, DBData
+from parking_app.db import DBUsers, DBData, _connect_to_db, _connect_to_replica
+from parking_app.pool import ConnectionPool
+from parking_app.occupancy import OccupancyIndex
+from parking_app.expiration import ExpirationScheduler
+from parking_app.export import export_formats, parking_history_headers
+from parking_app.hashing import PasswordHasher
+from parking_app.membership import BloomFilter
+from parking_app.cache import TTLCache
+from parking_app.checkers import spot_attributes
+from parking_app.metrics import RequestMetrics, query_recorder, render_samples
+from parking_app.events import OccupancyPublisher
+from parking_app.rollups import summarize
+from parking_app.analytics import build_report, read_report
+from parking_app.history import HistoryBuffer
+from parking_app.replica import ReplicaMonitor
+from parking_app.statements import PreparedStatementCache
+from parking_app.formats import json_mimetype, columnar_mimetype, bitmap_mimetype, format_names, pack_bitmap, \
+    to_columnar, compress
 from parking_app.exceptions import NoSpotsAvailable, InvalidPlateNumber, LicensePlateNotFound, AllSpotsAvailable, \
     InvalidSpotNumber, SpotNotAvailable, VehicleAlreadyInOtherSpot, UserNotFound, InvalidLengthOfStay, \
-    TooLong, MissingData, UsernameAlreadyUsed, EmailAlreadyUsed, InvalidUsername, InvalidEmail, InvalidPassword
+    TooLong, MissingData, UsernameAlreadyUsed, EmailAlreadyUsed, InvalidUsername, InvalidEmail, InvalidPassword, \
+    PoolExhausted, HashingPoolSaturated, InvalidSpotConstraints, HistoryBufferFull
 
 app = Flask(__name__)
 
-bcrypt = Bcrypt(app)
 app.secret_key = os.getenv("SECRET_KEY")
 
+# The password hashing workers are started with forkserver or spawn, which run this module again as __mp_main__ when
+# the application is started as a script, and the debug reloader runs it in a parent process that only watches the
+# source files. Nothing runs in the background in either.
+in_hashing_worker = __name__ == "__mp_main__"
+in_reloader_parent = __name__ == "__main__" and os.getenv("WERKZEUG_RUN_MAIN") != "true"
+runs_background_jobs = not in_hashing_worker and not in_reloader_parent
+
+password_hasher = PasswordHasher(workers=int(os.getenv("PASSWORD_HASHING_WORKERS", str(os.cpu_count() or 1))),
+                                  queue_depth=int(os.getenv("PASSWORD_HASHING_QUEUE_DEPTH", "32")),
+                                  log_rounds=int(os.getenv("BCRYPT_LOG_ROUNDS", "12")))
+
+pool = ConnectionPool(_connect_to_db, size=int(os.getenv("DATABASE_POOL_SIZE", "10")),
+                      timeout=float(os.getenv("DATABASE_POOL_TIMEOUT", "5")))
+replica_pool = None
+if os.getenv("REPLICA_DATABASE_HOST") or os.getenv("REPLICA_DATABASE_PATH"):
+    replica_pool = ConnectionPool(_connect_to_replica, size=int(os.getenv("DATABASE_POOL_SIZE", "10")),
+                                  timeout=float(os.getenv("DATABASE_POOL_TIMEOUT", "5")))
+occupancy = OccupancyIndex()
+occupancy_events = OccupancyPublisher(history=int(os.getenv("OCCUPANCY_STREAM_HISTORY", "1024")),
+                                      heartbeat=float(os.getenv("OCCUPANCY_STREAM_HEARTBEAT", "15")))
+occupancy.add_listener(occupancy_events.publish)
+known_users = BloomFilter(capacity=int(os.getenv("KNOWN_USERS_CAPACITY", "100000")))
+request_metrics = RequestMetrics()
+user_cache = TTLCache(maxsize=int(os.getenv("USER_CACHE_SIZE", "1024")), ttl=float(os.getenv("USER_CACHE_TTL", "300")))
+latest_analytics = {}
+analytics_report_path = os.getenv("ANALYTICS_REPORT_PATH")
+statement_cache = PreparedStatementCache() if os.getenv("DATABASE_PREPARED_STATEMENTS", "1") == "1" else None
+batch_max_size = int(os.getenv("BATCH_MAX_SIZE", "500"))
+
+
+def write_parking_history(parking_times):
+    with pool.connection() as cnx:
+        DBData(cnx, expirations=expirations).store_parking_times(parking_times)
+
+
+history_buffer = None
+if os.getenv("HISTORY_WRITE_BEHIND", "0") == "1" and runs_background_jobs:
+    history_buffer = HistoryBuffer(write_parking_history, max_size=int(os.getenv("HISTORY_BUFFER_SIZE", "10000")),
+                                   flush_interval=float(os.getenv("HISTORY_FLUSH_INTERVAL_MS", "50")) / 1000,
+                                   batch_size=int(os.getenv("HISTORY_FLUSH_ROWS", "500")),
+                                   timeout=float(os.getenv("HISTORY_BUFFER_TIMEOUT", "1")),
+                                   max_attempts=int(os.getenv("HISTORY_MAX_ATTEMPTS", "3")))
+
+
+def write_replication_heartbeat(beat_at):
+    with pool.connection() as cnx:
+        DBData(cnx).write_replication_heartbeat(beat_at)
+
+
+def read_replication_heartbeat():
+    with replica_pool.connection() as replica_cnx:
+        return DBData(replica_cnx).get_replication_heartbeat()
+
+
+replica_monitor = None
+if replica_pool is not None:
+    replica_monitor = ReplicaMonitor(write_replication_heartbeat, read_replication_heartbeat,
+                                     max_lag=float(os.getenv("REPLICA_MAX_LAG", "5")))
+
+
+def get_connection():
+    if "cnx" not in g:
+        g.cnx = pool.get_connection()
+    return g.cnx
+
+
+def get_read_connection():
+    if replica_monitor is None or not replica_monitor.use_replica(session.get("written_at")):
+        return get_connection()
+    if "replica_cnx" not in g:
+        g.replica_cnx = replica_pool.get_connection()
+    return g.replica_cnx
+
+
+def get_db_users():
+    db_users = DBUsers(get_connection(), known_users, user_cache, statement_cache=statement_cache,
+                       get_read_cnx=get_read_connection)
+    db_users.load_known_users()
+    return db_users
+
+
+def get_db_data():
+    db_data = DBData(get_connection(), occupancy, expirations, history_buffer, statement_cache=statement_cache)
+    db_data.load_occupancy()
+    expirations.ensure_loaded(db_data.get_unexpired_stays)
+    return db_data
+
+
+def occupancy_snapshot_response(name, renderers, compressible=True):
+    default_mimetype = next(iter(renderers))
+    mimetype = request.accept_mimetypes.best_match(list(renderers), default=default_mimetype)
+    compressed = compressible and request.accept_encodings.quality("gzip") > 0
+    representation = ("" if mimetype == default_mimetype else "-" + format_names[mimetype]) + \
+                     ("-gzip" if compressed else "")
+    db_data = DBData(get_connection(), occupancy, expirations, statement_cache=statement_cache)
+    version = db_data.get_occupancy_version()
+    # Proxies that compress or otherwise transform the response weaken its ETag, so the comparison is weak.
+    if request.if_none_match.contains_weak(f"{version}{representation}"):
+        response = Response(status=304)
+    else:
+        db_data.load_occupancy(version)
+        render = renderers[mimetype]
+        version, body = occupancy.get_snapshot(name + representation,
+                                               lambda: compress(render(db_data)) if compressed else render(db_data))
+        response = Response(body, mimetype=mimetype)
+        if compressed:
+            response.headers["Content-Encoding"] = "gzip"
+    response.vary.update(["Accept", "Accept-Encoding"])
+    response.set_etag(f"{version}{representation}")
+    return response
+
+
+@app.before_request
+def start_request_timer():
+    query_recorder.reset()
+    g.request_started_at = perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    request_metrics.observe(endpoint, response.status_code, perf_counter() - g.request_started_at, query_recorder)
+    return response
+
 
-def parking_expiration_checker():
-    db_data = DBData()
-    db_data.check_if_stay_expired()
+@app.teardown_appcontext
+def release_connection(exception):
+    cnx = g.pop("cnx", None)
+    if cnx is not None:
+        pool.release(cnx)
+    replica_cnx = g.pop("replica_cnx", None)
+    if replica_cnx is not None:
+        replica_pool.release(replica_cnx)
 
 
-scheduler = BackgroundScheduler()
-scheduler.add_job(func=parking_expiration_checker, trigger="interval", seconds=60)
-scheduler.start()
+@app.errorhandler(PoolExhausted)
+@app.errorhandler(HashingPoolSaturated)
+@app.errorhandler(HistoryBufferFull)
+def handle_busy_service(error):
+    return "The service is busy at the moment. Please try again later.", 503
+
+
+def expire_stays(log_ids):
+    with pool.connection() as cnx:
+        db_data = DBData(cnx)
+        db_data.expire_stays(log_ids)
+        if occupancy_events.subscribers:
+            for parking_spot, license_plate in db_data.get_parked_vehicles_from_stays(log_ids):
+                occupancy.expire(parking_spot, license_plate)
+
+
+def resync_expirations():
+    with pool.connection() as cnx:
+        db_data = DBData(cnx)
+        expirations.ensure_loaded(db_data.get_unexpired_stays)
+
+
+def refresh_analytics():
+    # Scanning the whole history is kept out of the request path: one job builds the report and requests are served
+    # the last one built.
+    read_pool = replica_pool if replica_monitor is not None and replica_monitor.use_replica() else pool
+    with read_pool.connection() as cnx:
+        latest_analytics["report"] = build_report(DBData(cnx).iter_parking_history(),
+                                                  chunk_size=int(os.getenv("ANALYTICS_CHUNK_SIZE", "50000")))
+
+
+def get_analytics_report():
+    if analytics_report_path is None:
+        return latest_analytics.get("report")
+    # Built by a single other process, e.g. python -m parking_app.analytics run on a schedule, and read again
+    # whenever the file changes.
+    try:
+        modified_at = os.stat(analytics_report_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    if latest_analytics.get("modified_at") != modified_at:
+        latest_analytics["report"] = read_report(analytics_report_path)
+        latest_analytics["modified_at"] = modified_at
+    return latest_analytics["report"]
 
-atexit.register(lambda: scheduler.shutdown())
+
+def sync_occupancy():
+    if not occupancy_events.subscribers:
+        return
+    with pool.connection() as cnx:
+        db_data = DBData(cnx, occupancy)
+        db_data.load_occupancy()
+
+
+scheduler = BackgroundScheduler()
+expirations = ExpirationScheduler(scheduler, expire_stays)
+scheduler.add_job(func=resync_expirations)
+scheduler.add_job(func=sync_occupancy, trigger="interval", seconds=float(os.getenv("OCCUPANCY_SYNC_INTERVAL", "5")),
+                  coalesce=True, max_instances=1)
+if replica_monitor is not None:
+    scheduler.add_job(func=replica_monitor.check, trigger="interval", next_run_time=datetime.now(),
+                      seconds=float(os.getenv("REPLICA_CHECK_INTERVAL", "1")), coalesce=True, max_instances=1)
+if analytics_report_path is None:
+    scheduler.add_job(func=refresh_analytics, trigger="interval", next_run_time=datetime.now(),
+                      seconds=float(os.getenv("ANALYTICS_REFRESH_INTERVAL", "300")), coalesce=True, max_instances=1)
+if runs_background_jobs:
+    scheduler.start()
+    atexit.register(lambda: scheduler.shutdown())
+    atexit.register(lambda: password_hasher.shutdown())
+if history_buffer is not None:
+    atexit.register(lambda: history_buffer.close())
 
 
 def check_session(function):
@@ -37,21 +250,34 @@ def check_session(function):
     return wrapper
 
 
+def pin_to_primary(function):
+    # Reads of this session stay on the primary until the replica has caught up with the write.
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        response = function(*args, **kwargs)
+        if replica_monitor is not None:
+            session["written_at"] = time()
+        return response
+
+    return wrapper
+
+
 @app.route('/')
 def index():
     return "Welcome to this parking app!"
 
 
 @app.route('/register', methods=["GET", "POST"])
+@pin_to_primary
 def create_user():
     incoming_data = request.get_json()
-    db_users = DBUsers()
+    db_users = get_db_users()
     try:
         username = incoming_data["username"]
         email_address = incoming_data["email_address"]
         password = incoming_data["password"]
         db_users.check_registration_input(username, email_address, password)
-        db_users.create_user(username, email_address, bcrypt.generate_password_hash(password))
+        db_users.create_user(username, email_address, password_hasher.generate_password_hash(password))
         return "User successfully created.", 200
     except KeyError:
         return "Missing data.", 400
@@ -79,12 +305,12 @@ def create_user():
 @app.route('/log-in', methods=["GET", "POST"])
 def log_in():
     incoming_data = request.get_json()
-    db_users = DBUsers()
+    db_users = get_db_users()
     try:
         username = incoming_data["username"]
         password = incoming_data["password"]
         user_data = db_users.get_user_data_from_username(username)
-        if bcrypt.check_password_hash(user_data["password"], password):
+        if password_hasher.check_password_hash(user_data["password"], password):
             session["login_success"] = True
             session["username"] = username
             return "Successfully logged in.", 200
@@ -103,11 +329,91 @@ def log_out():
     return "Successfully logged out.", 200
 
 
+@app.route('/cache-stats', methods=["GET"])
+@check_session
+def retrieve_cache_stats():
+    return {"user_cache": user_cache.stats()}, 200
+
+
+@app.route('/metrics', methods=["GET"])
+def retrieve_metrics():
+    pool_stats = pool.stats()
+    expiration_stats = expirations.stats()
+    user_cache_stats = user_cache.stats()
+    hashing_stats = password_hasher.stats()
+    occupancy_stream_stats = occupancy_events.stats()
+    lines = request_metrics.render()
+    lines += render_samples("parking_app_db_pool_connections", "Database connections by state.", "gauge",
+                            [({"state": "idle"}, pool_stats["idle"]), ({"state": "in_use"}, pool_stats["in_use"])])
+    lines += render_samples("parking_app_db_pool_size", "Maximum number of database connections.", "gauge",
+                            [({}, pool_stats["size"])])
+    lines += render_samples("parking_app_expirations_pending", "Stays waiting to expire.", "gauge",
+                            [({}, expiration_stats["pending"])])
+    lines += render_samples("parking_app_expirations_total", "Stays marked as expired.", "counter",
+                            [({}, expiration_stats["expired"])])
+    lines += render_samples("parking_app_scheduler_jobs", "Jobs scheduled in the background scheduler.", "gauge",
+                            [({}, len(scheduler.get_jobs()))])
+    if replica_monitor is not None:
+        replica_stats = replica_monitor.stats()
+        if replica_stats["lag"] is not None:
+            lines += render_samples("parking_app_replica_lag_seconds", "Replica lag measured by the last heartbeat.",
+                                    "gauge", [({}, replica_stats["lag"])])
+        lines += render_samples("parking_app_replica_heartbeat_failures_total",
+                                "Replica lag checks that could not write or read the heartbeat.", "counter",
+                                [({}, replica_stats["failed_checks"])])
+        lines += render_samples("parking_app_replica_reads_total", "Reads that could go to the replica by target.",
+                                "counter", [({"target": "replica"}, replica_stats["replica_reads"]),
+                                            ({"target": "primary"}, replica_stats["primary_reads"])])
+    lines += render_samples("parking_app_occupancy_version", "Occupancy version held by the in-process index.",
+                            "gauge", [({}, occupancy.version)])
+    lines += render_samples("parking_app_user_cache_entries", "Entries in the user lookup cache.", "gauge",
+                            [({}, user_cache_stats["size"])])
+    lines += render_samples("parking_app_user_cache_requests_total", "User lookup cache requests by result.",
+                            "counter", [({"result": "hit"}, user_cache_stats["hits"]),
+                                        ({"result": "miss"}, user_cache_stats["misses"])])
+    lines += render_samples("parking_app_password_hashing_workers", "Password hashing worker processes.", "gauge",
+                            [({}, hashing_stats["workers"])])
+    lines += render_samples("parking_app_password_hashing_rejected_total",
+                            "Password hashing requests rejected because the queue was full.", "counter",
+                            [({}, hashing_stats["rejected"])])
+    lines += render_samples("parking_app_password_hashing_restarts_total",
+                            "Password hashing pools replaced after a worker process died.", "counter",
+                            [({}, hashing_stats["restarted"])])
+    lines += render_samples("parking_app_occupancy_stream_subscribers", "Open occupancy stream connections.",
+                            "gauge", [({}, occupancy_stream_stats["subscribers"])])
+    lines += render_samples("parking_app_occupancy_stream_events_total", "Occupancy events published.", "counter",
+                            [({}, occupancy_stream_stats["published"])])
+    if statement_cache is not None:
+        statement_stats = statement_cache.stats()
+        lines += render_samples("parking_app_prepared_statements", "Statements prepared on pooled connections.",
+                                "gauge", [({}, statement_stats["statements"])])
+        lines += render_samples("parking_app_prepared_statement_requests_total",
+                                "Hot statements run on an already prepared cursor (hit) or prepared first (miss).",
+                                "counter", [({"result": "hit"}, statement_stats["hits"]),
+                                            ({"result": "miss"}, statement_stats["misses"])])
+    if history_buffer is not None:
+        history_stats = history_buffer.stats()
+        lines += render_samples("parking_app_history_buffer_queued", "Parking history rows waiting to be written.",
+                                "gauge", [({}, history_stats["queued"])])
+        lines += render_samples("parking_app_history_buffer_written_total", "Parking history rows written behind.",
+                                "counter", [({}, history_stats["written"])])
+        lines += render_samples("parking_app_history_buffer_failed_batches_total",
+                                "Parking history batches that failed and were retried.", "counter",
+                                [({}, history_stats["failed_batches"])])
+        lines += render_samples("parking_app_history_buffer_rejected_total",
+                                "Requests rejected because the parking history buffer was full.", "counter",
+                                [({}, history_stats["rejected"])])
+        lines += render_samples("parking_app_history_buffer_dropped_total",
+                                "Parking history rows dropped after failing to be written.", "counter",
+                                [({}, history_stats["dropped"])])
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+
 @app.route('/search-license-plate', methods=["POST"])
 @check_session
 def search_license_plate():
     incoming_data = request.get_json()
-    db_data = DBData()
+    db_data = get_db_data()
     try:
         parking_spot = db_data.get_spot_from_plate(incoming_data["license_plate"])
         return parking_spot, 200
@@ -117,13 +423,32 @@ def search_license_plate():
         return "There are no vehicles with this license plate number currently parked in the parking lot.", 404
 
 
+@app.route('/spots', methods=["GET"])
+@check_session
+def retrieve_spots():
+    return occupancy_snapshot_response("spots", {json_mimetype: lambda db_data: app.json.dumps(db_data.get_spots())})
+
+
+def bitmap_renderer(get_selected_spots, nothing_selected):
+    # A bitmap has a bit for every spot, so a full or an empty lot is still a bitmap rather than a 404.
+    def render(db_data):
+        try:
+            selected_spots = get_selected_spots(db_data)
+        except nothing_selected:
+            selected_spots = ()
+        return pack_bitmap(db_data.get_spots(), selected_spots)
+
+    return render
+
+
 @app.route('/vacant-spots', methods=["GET"])
 @check_session
 def retrieve_vacant_spots():
-    db_data = DBData()
     try:
-        vacant_spots = db_data.get_vacant_spots()
-        return vacant_spots, 200
+        return occupancy_snapshot_response("vacant-spots", {
+            json_mimetype: lambda db_data: app.json.dumps(db_data.get_vacant_spots()),
+            columnar_mimetype: lambda db_data: to_columnar(db_data.get_vacant_spots()),
+            bitmap_mimetype: bitmap_renderer(DBData.get_vacant_spots, NoSpotsAvailable)})
     except NoSpotsAvailable:
         return "There are no spots available at the moment.", 404
 
@@ -131,10 +456,10 @@ def retrieve_vacant_spots():
 @app.route('/vacant-spots-count', methods=["GET"])
 @check_session
 def retrieve_vacant_spots_count():
-    db_data = DBData()
     try:
-        vacant_spots_count = db_data.get_vacant_spots_count()
-        return vacant_spots_count, 200
+        return occupancy_snapshot_response("vacant-spots-count",
+                                           {"text/html": lambda db_data: db_data.get_vacant_spots_count()},
+                                           compressible=False)
     except NoSpotsAvailable:
         return "There are no spots available at the moment.", 404
 
@@ -142,85 +467,199 @@ def retrieve_vacant_spots_count():
 @app.route('/unavailable-spots', methods=["GET"])
 @check_session
 def retrieve_unavailable_spots_and_plates():
-    db_data = DBData()
     try:
-        unavailable_spots_and_plates = db_data.get_unavailable_spots_and_plates()
-        return unavailable_spots_and_plates, 200
+        return occupancy_snapshot_response("unavailable-spots", {
+            json_mimetype: lambda db_data: app.json.dumps(db_data.get_unavailable_spots_and_plates()),
+            columnar_mimetype: lambda db_data: to_columnar(*zip(*db_data.get_unavailable_spots_and_plates().items())),
+            bitmap_mimetype: bitmap_renderer(DBData.get_unavailable_spots_and_plates, AllSpotsAvailable)})
     except AllSpotsAvailable:
         return "All parking spots are currently available.", 404
 
 
+@app.route('/occupancy-stream', methods=["GET"])
+@check_session
+def stream_occupancy():
+    last_event_id = request.headers.get("Last-Event-ID", "")
+    get_db_data()
+    events = occupancy_events.listen(int(last_event_id) if last_event_id.isdigit() else None, occupancy.get_state)
+    return Response(events, mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+parking_errors = {
+    TypeError: ("The parking spot and license plate should be a string of text.\n"
+                "The length of stay should be a string of text written in the following format: '0.00'.", 400),
+    KeyError: ("Missing data.", 400),
+    InvalidSpotNumber: ("This is not a valid parking spot number.", 400),
+    SpotNotAvailable: ("The selected spot is currently not available.", 403),
+    InvalidPlateNumber: ("This is not a valid license plate number.", 400),
+    VehicleAlreadyInOtherSpot: ("This license plate is already linked to another parking spot currently in use.", 403),
+    InvalidLengthOfStay: ("Invalid length of stay entered.\n"
+                          "The length of stay should be a string of text written in the following format: '0.00'.",
+                          400),
+    TooLong: ("A vehicle cannot occupy a spot for longer than a year.", 400),
+    InvalidSpotConstraints: ("The zone and size class should be strings of text, the level a whole number and "
+                             "has_ev_charger either true or false.", 400)
+}
+
+
+def parking_error_response(error):
+    for error_type, response in parking_errors.items():
+        if isinstance(error, error_type):
+            return response
+    raise error
+
+
 @app.route('/park-car', methods=["POST"])
 @check_session
+@pin_to_primary
 def park_car():
     incoming_data = request.get_json()
-    db_data = DBData()
+    db_data = get_db_data()
     try:
         parking_spot = incoming_data["parking_spot"]
         license_plate = incoming_data["license_plate"]
         length_of_stay = incoming_data["length_of_stay"]
-        db_data.check_incoming_values_before_parking(parking_spot, license_plate, length_of_stay)
-        arrival_time, departure_time = db_data.checker.calculate_arrival_and_departure_time(length_of_stay)
-        db_data.park_car(parking_spot, license_plate)
-        db_data.store_parking_time(parking_spot, license_plate, arrival_time, length_of_stay, departure_time, 0,
-                                   None, 0)
-        confirmed_spot = db_data.get_spot_from_plate(incoming_data["license_plate"])
+        confirmed_spot = db_data.park_car(parking_spot, license_plate, length_of_stay)
         return confirmed_spot
-    except TypeError:
-        return "The parking spot and license plate should be a string of text.\n" \
-               "The length of stay should be a string of text written in the following format: '0.00'.", 400
-    except KeyError:
-        return "Missing data.", 400
-    except InvalidSpotNumber:
-        return "This is not a valid parking spot number.", 400
-    except SpotNotAvailable:
-        return "The selected spot is currently not available.", 403
-    except InvalidPlateNumber:
-        return "This is not a valid license plate number.", 400
-    except VehicleAlreadyInOtherSpot:
-        return "This license plate is already linked to another parking spot currently in use.", 403
-    except InvalidLengthOfStay:
-        return "Invalid length of stay entered.\n" \
-               "The length of stay should be a string of text written in the following format: '0.00'.", 400
-    except TooLong:
-        return "A vehicle cannot occupy a spot for longer than a year.", 400
+    except tuple(parking_errors) as error:
+        return parking_error_response(error)
+
+
+@app.route('/park-cars', methods=["POST"])
+@check_session
+@pin_to_primary
+def park_cars():
+    incoming_data = request.get_json()
+    if not isinstance(incoming_data, list):
+        return "A list of vehicles to park should be provided.", 400
+    if len(incoming_data) > batch_max_size:
+        return f"At most {batch_max_size} vehicles can be sent at once.", 400
+    db_data = get_db_data()
+    results = db_data.park_cars(incoming_data)
+    return [batch_item_response(result, parking_error_response) for result in results], 200
+
+
+leaving_errors = {
+    TypeError: ("The license plate should be a string of text.", 400),
+    KeyError: ("Missing data.", 400),
+    InvalidPlateNumber: ("This is not a valid license plate number.", 400),
+    LicensePlateNotFound: ("There are no vehicles with this license plate number currently parked in the parking lot.",
+                           404)
+}
+
+
+def leaving_error_response(error):
+    for error_type, response in leaving_errors.items():
+        if isinstance(error, error_type):
+            return response
+    raise error
+
+
+def batch_item_response(result, error_response):
+    if isinstance(result, Exception):
+        message, status = error_response(result)
+        return {"status": status, "message": message}
+    return {"status": 200, "message": result}
 
 
 @app.route('/leave-parking-spot', methods=["POST"])
 @check_session
+@pin_to_primary
 def leave_parking_spot():
     incoming_data = request.get_json()
-    db_data = DBData()
+    db_data = get_db_data()
     try:
         db_data.leave_parking_spot(incoming_data["license_plate"])
         return "Parking spot now available.", 200
-    except InvalidPlateNumber:
-        return "This is not a valid license plate number.", 400
-    except LicensePlateNotFound:
-        return "There are no vehicles with this license plate number currently parked in the parking lot.", 404
+    except tuple(leaving_errors) as error:
+        return leaving_error_response(error)
+
+
+@app.route('/leave-parking-spots', methods=["POST"])
+@check_session
+@pin_to_primary
+def leave_parking_spots():
+    incoming_data = request.get_json()
+    if not isinstance(incoming_data, list):
+        return "A list of vehicles leaving should be provided.", 400
+    if len(incoming_data) > batch_max_size:
+        return f"At most {batch_max_size} vehicles can be sent at once.", 400
+    db_data = get_db_data()
+    results = db_data.leave_parking_spots(incoming_data)
+    return [batch_item_response(result if isinstance(result, Exception) else "Parking spot now available.",
+                                leaving_error_response) for result in results], 200
 
 
 @app.route('/next-available-spot', methods=["GET"])
 @check_session
 def check_next_available_spot():
-    db_data = DBData()
-    db_data.get_next_available_spot()
+    db_data = get_db_data()
     return db_data.get_next_available_spot(), 200
 
 
 @app.route('/park-at-next-available-spot', methods=["GET", "POST"])
 @check_session
+@pin_to_primary
 def park_at_next_available_spot():
-    db_data = DBData()
-    next_available_spot = db_data.get_next_available_spot()
+    incoming_data = request.get_json()
+    db_data = get_db_data()
     try:
-        db_data.get_vacant_spots()
+        license_plate = incoming_data["license_plate"]
+        length_of_stay = incoming_data["length_of_stay"]
+        constraints = {attribute: incoming_data.get(attribute) for attribute in spot_attributes}
+        confirmed_spot = db_data.park_at_next_available_spot(license_plate, length_of_stay, constraints)
+        return confirmed_spot
     except NoSpotsAvailable:
+        next_available_spot = db_data.get_next_available_spot(constraints)
+        if next_available_spot is None:
+            return "There are no spots with the requested characteristics.", 404
         return f"There are currently no spots available. Spot {next_available_spot} will become available soon. " \
                f"Please try again later.", 403
-    incoming_data = request.get_json()
-    incoming_data.update(parking_spot=next_available_spot)
-    return park_car()
+    except tuple(parking_errors) as error:
+        return parking_error_response(error)
+
+
+@app.route('/parking-history/export', methods=["GET"])
+@check_session
+def export_parking_history():
+    export_format = request.args.get("format", "ndjson")
+    if export_format not in export_formats:
+        return "Unsupported export format. Please choose 'ndjson' or 'csv'.", 400
+    serialize, mimetype = export_formats[export_format]
+    db_data = DBData(get_read_connection())
+    history = serialize(parking_history_headers, db_data.iter_parking_history())
+    return Response(stream_with_context(history), mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename=parking_history.{export_format}"})
+
+
+def parse_local_time(value):
+    # The database keeps server local times without an offset, so times given with one are converted to those.
+    moment = datetime.fromisoformat(value)
+    return moment if moment.tzinfo is None else moment.astimezone().replace(tzinfo=None)
+
+
+@app.route('/occupancy-stats', methods=["GET"])
+@check_session
+def retrieve_occupancy_stats():
+    try:
+        end = parse_local_time(request.args["to"]) if "to" in request.args else datetime.now()
+        start = parse_local_time(request.args["from"]) if "from" in request.args else end - timedelta(days=1)
+    except ValueError:
+        return "Please provide 'from' and 'to' as ISO 8601 times, e.g. 2022-11-20T08:00.", 400
+    if start >= end:
+        return "'from' must be earlier than 'to'.", 400
+    db_data = DBData(get_read_connection())
+    return {"from": start.isoformat(), "to": end.isoformat(), **summarize(db_data.get_occupancy_stats(start, end))}
+
+
+@app.route('/analytics', methods=["GET"])
+@check_session
+def retrieve_analytics():
+    report = get_analytics_report()
+    if report is None:
+        return "The analytics report is being prepared. Please try again shortly.", 503
+    return report, 200
 
 
 if __name__ == '__main__':
@@ -0,0 +1,43 @@
+from hashlib import blake2b
+from math import ceil, log
+from threading import Lock
+
+
+class BloomFilter:
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.size = max(8, ceil(-capacity * log(error_rate) / log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * log(2)))
+        self.loaded = False
+        self._bits = bytearray((self.size + 7) // 8)
+        self._lock = Lock()
+
+    def _positions(self, key):
+        digest = blake2b(key.encode("utf-8"), digest_size=16).digest()
+        first_hash = int.from_bytes(digest[:8], "little")
+        second_hash = int.from_bytes(digest[8:], "little") | 1
+        return [(first_hash + index * second_hash) % self.size for index in range(self.hash_count)]
+
+    def _add(self, key):
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def add(self, key):
+        # Setting a bit reads and writes back its whole byte, so concurrent adds could drop each other's bits.
+        with self._lock:
+            self._add(key)
+
+    def __contains__(self, key):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def load(self, keys):
+        with self._lock:
+            for key in keys:
+                self._add(key)
+            self.loaded = True
+
+    def ensure_loaded(self, load_keys):
+        with self._lock:
+            if self.loaded:
+                return
+        self.load(load_keys())
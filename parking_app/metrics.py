@@ -0,0 +1,100 @@
+from bisect import bisect_left
+from threading import Lock, local
+from time import perf_counter
+
+latency_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+query_buckets = (0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 50)
+row_buckets = (0, 1, 10, 100, 1000, 10000, 100000)
+
+
+class QueryRecorder(local):
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.queries = 0
+        self.rows = 0
+        self.db_time = 0.0
+
+    def record(self, started_at, rows, queries=1):
+        self.queries += queries
+        self.rows += rows
+        self.db_time += perf_counter() - started_at
+
+
+query_recorder = QueryRecorder()
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(int(value))
+
+
+class Histogram:
+
+    def __init__(self, name, documentation, buckets, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.label_names = label_names
+        self._series = {}
+        self._lock = Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((label_values, list(counts), total) for label_values, (counts, total) in
+                            self._series.items())
+        for label_values, counts, total in series:
+            labels = dict(zip(self.label_names, label_values))
+            cumulative = 0
+            for upper_bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels({**labels, 'le': upper_bound})} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+def render_samples(name, documentation, metric_type, samples):
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {metric_type}"]
+    lines.extend(f"{name}{_format_labels(labels)} {_format_value(value)}" for labels, value in samples)
+    return lines
+
+
+class RequestMetrics:
+
+    def __init__(self, prefix="parking_app"):
+        self.duration = Histogram(f"{prefix}_request_duration_seconds", "Time spent handling a request.",
+                                  latency_buckets, ("endpoint", "status"))
+        self.db_duration = Histogram(f"{prefix}_request_db_duration_seconds",
+                                     "Time spent waiting on the database while handling a request.", latency_buckets,
+                                     ("endpoint",))
+        self.queries = Histogram(f"{prefix}_request_queries", "Database queries issued per request.", query_buckets,
+                                 ("endpoint",))
+        self.rows = Histogram(f"{prefix}_request_rows", "Rows read or written per request.", row_buckets,
+                              ("endpoint",))
+
+    def observe(self, endpoint, status, duration, recorder):
+        self.duration.observe(duration, endpoint, str(status))
+        self.db_duration.observe(recorder.db_time, endpoint)
+        self.queries.observe(recorder.queries, endpoint)
+        self.rows.observe(recorder.rows, endpoint)
+
+    def render(self):
+        return self.duration.render() + self.db_duration.render() + self.queries.render() + self.rows.render()
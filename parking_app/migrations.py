@@ -0,0 +1,172 @@
+import os
+import sys
+from datetime import datetime
+
+# Version 0 is the schema the application was first released with: login_data, parking_spot_data and
+# parked_vehicles_data as in the original resources/parking_app.sql. Everything added since is a numbered migration.
+# resources/parking_app.sql and parking_app_sqlite.sql are kept at the schema of the latest migration, so on a
+# database made from them the migrations find nothing to change and are only recorded. A migration is recorded in
+# schema_migrations once applied, and each of its steps checks the schema first, so running the migrations again, or
+# after one was interrupted halfway, is safe.
+migrations_table_statement = "CREATE TABLE IF NOT EXISTS schema_migrations (version INT NOT NULL PRIMARY KEY, " \
+                             "description VARCHAR(255) NOT NULL, applied_at DATETIME NOT NULL);"
+
+
+def _count(cursor, query, values):
+    cursor.execute(query, values)
+    return cursor.fetchall()[0][0]
+
+
+def _table_exists(cursor, backend, table):
+    if backend == "sqlite":
+        query = "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = %s;"
+        return _count(cursor, query, [table]) > 0
+    query = "SELECT COUNT(*) FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s;"
+    return _count(cursor, query, [table]) > 0
+
+
+def _column_exists(cursor, backend, table, column):
+    if backend == "sqlite":
+        return _count(cursor, "SELECT COUNT(*) FROM pragma_table_info(%s) WHERE name = %s;", [table, column]) > 0
+    query = "SELECT COUNT(*) FROM information_schema.columns WHERE table_schema = DATABASE() AND table_name = %s " \
+            "AND column_name = %s;"
+    return _count(cursor, query, [table, column]) > 0
+
+
+def _index_exists(cursor, backend, table, index):
+    if backend == "sqlite":
+        query = "SELECT COUNT(*) FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND name = %s;"
+    else:
+        query = "SELECT COUNT(*) FROM information_schema.statistics WHERE table_schema = DATABASE() " \
+                "AND table_name = %s AND index_name = %s;"
+    return _count(cursor, query, [table, index]) > 0
+
+
+def create_table(table, columns):
+    # Column definitions are written in the subset of SQL that MySQL and SQLite share.
+    def step(cnx, cursor, backend):
+        if not _table_exists(cursor, backend, table):
+            cursor.execute(f"CREATE TABLE {table} ({', '.join(columns)});")
+    return step
+
+
+def add_column(table, column, definition):
+    def step(cnx, cursor, backend):
+        if not _column_exists(cursor, backend, table, column):
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition};")
+    return step
+
+
+def seed_row(table, columns, values):
+    # The first column identifies the row.
+    def step(cnx, cursor, backend):
+        if _count(cursor, f"SELECT COUNT(*) FROM {table} WHERE {columns[0]} = %s;", [values[0]]) == 0:
+            cursor.execute(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(values))});",
+                           values)
+    return step
+
+
+def create_index(table, index, columns):
+    def step(cnx, cursor, backend):
+        if not _index_exists(cursor, backend, table, index):
+            cursor.execute(f"CREATE INDEX {index} ON {table} ({', '.join(columns)});")
+    return step
+
+
+def drop_index(table, index):
+    def step(cnx, cursor, backend):
+        if _index_exists(cursor, backend, table, index):
+            cursor.execute(f"DROP INDEX {index};" if backend == "sqlite" else f"DROP INDEX {index} ON {table};")
+    return step
+
+
+def make_index_visible(table, index, columns):
+    # SQLite has no invisible indexes; its schema never created this one.
+    def step(cnx, cursor, backend):
+        if backend == "sqlite":
+            create_index(table, index, columns)(cnx, cursor, backend)
+        else:
+            cursor.execute(f"ALTER TABLE {table} ALTER INDEX {index} VISIBLE;")
+    return step
+
+
+def create_occupancy_rollup(cnx, cursor, backend):
+    # A rollup created next to existing history is filled from it, which also sets the occupied count.
+    if _table_exists(cursor, backend, "occupancy_rollup"):
+        return
+    create_table("occupancy_rollup", ["hour_start DATETIME NOT NULL PRIMARY KEY", "arrivals INT NOT NULL DEFAULT 0",
+                                      "departures INT NOT NULL DEFAULT 0", "peak_occupancy INT NOT NULL DEFAULT 0",
+                                      "closing_occupancy INT NOT NULL DEFAULT 0",
+                                      "stay_seconds BIGINT NOT NULL DEFAULT 0",
+                                      "overstays INT NOT NULL DEFAULT 0"])(cnx, cursor, backend)
+    from parking_app.db import DBData
+    DBData(cnx).rebuild_occupancy_rollup()
+
+
+migrations = [
+    (1, "Add the occupancy version",
+     [create_table("occupancy_version", ["id TINYINT NOT NULL PRIMARY KEY", "version BIGINT NOT NULL"]),
+      seed_row("occupancy_version", ["id", "version"], [1, 0])]),
+    (2, "Add spot attributes",
+     [add_column("parking_spot_data", "zone", "VARCHAR(45) NOT NULL DEFAULT 'A'"),
+      add_column("parking_spot_data", "level", "INT NOT NULL DEFAULT 0"),
+      add_column("parking_spot_data", "size_class", "VARCHAR(20) NOT NULL DEFAULT 'standard'"),
+      add_column("parking_spot_data", "has_ev_charger", "TINYINT NOT NULL DEFAULT 0")]),
+    (3, "Add the occupied count and hourly occupancy rollups",
+     [add_column("occupancy_version", "occupied", "INT NOT NULL DEFAULT 0"),
+      create_occupancy_rollup]),
+    (4, "Add the replication heartbeat",
+     [create_table("replication_heartbeat", ["id TINYINT NOT NULL PRIMARY KEY", "beat_at DOUBLE NOT NULL"]),
+      seed_row("replication_heartbeat", ["id", "beat_at"], [1, 0])]),
+    (5, "Index stays that have not left by expected departure",
+     [create_index("parked_vehicles_data", "has_left_departure_idx",
+                   ["has_left", "expected_departure_time", "spot_id"])]),
+    (6, "Index unexpired stays by expected departure",
+     [create_index("parked_vehicles_data", "has_expired_departure_idx", ["has_expired", "expected_departure_time"])]),
+    (7, "Index vehicle lookups by whether the vehicle has left",
+     [create_index("parked_vehicles_data", "vehicle_number_has_left_idx", ["vehicle_number", "has_left"]),
+      drop_index("parked_vehicles_data", "vehicle_number_idx")]),
+    (8, "Make spot_id_idx visible",
+     [make_index_visible("parked_vehicles_data", "spot_id_idx", ["spot_id"])]),
+]
+
+
+def get_applied_versions(cnx):
+    with cnx.cursor() as cursor:
+        cursor.execute(migrations_table_statement)
+        cursor.execute("SELECT version FROM schema_migrations ORDER BY version;")
+        return [version for version, in cursor]
+
+
+def migrate(cnx, backend, migrations=migrations):
+    applied_versions = set(get_applied_versions(cnx))
+    newly_applied = []
+    for version, description, steps in sorted(migrations, key=lambda migration: migration[0]):
+        if version in applied_versions:
+            continue
+        with cnx.cursor() as cursor:
+            for step in steps:
+                step(cnx, cursor, backend)
+            cursor.execute("INSERT INTO schema_migrations (version, description, applied_at) VALUES (%s, %s, %s);",
+                           [version, description, datetime.now().replace(microsecond=0)])
+        cnx.commit()
+        newly_applied.append(version)
+    return newly_applied
+
+
+if __name__ == '__main__':
+    from parking_app.db import _connect_to_db
+    if sys.argv[1:] not in ([], ["status"]):
+        sys.exit("usage: python -m parking_app.migrations [status]")
+    cnx = _connect_to_db()
+    backend = os.getenv("DATABASE_BACKEND", "mysql")
+    try:
+        if sys.argv[1:] == ["status"]:
+            applied_versions = get_applied_versions(cnx)
+            for version, description, steps in migrations:
+                print(f"{version:>4} {'applied' if version in applied_versions else 'pending'} {description}")
+        else:
+            for version in migrate(cnx, backend):
+                print(f"applied migration {version}")
+    finally:
+        cnx.close()
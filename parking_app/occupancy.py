@@ -0,0 +1,232 @@
+from bisect import bisect_left, insort
+from heapq import heapify, heappush, heappop
+from threading import RLock
+
+from parking_app.checkers import spot_attributes
+from parking_app.exceptions import NoSpotsAvailable, AllSpotsAvailable, LicensePlateNotFound
+
+
+class OccupancyIndex:
+
+    def __init__(self):
+        self.loaded = False
+        self.version = 0
+        self._snapshots = {}
+        self._lock = RLock()
+        self._spots = set()
+        self._spot_order = []
+        self._positions = {}
+        self._vacant_bits = 0
+        self._attribute_bits = {}
+        self._vacant_spots = []
+        self._occupied_spots = []
+        self._plates_by_spot = {}
+        self._spots_by_plate = {}
+        self._departures_by_spot = {}
+        self._departures = []
+        self._listeners = []
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def _get_next_available_spot(self):
+        if self._vacant_spots:
+            return self._vacant_spots[0]
+        next_departure = self.get_next_departure()
+        return next_departure[0] if next_departure else None
+
+    def get_state(self):
+        with self._lock:
+            return {"vacant_count": len(self._vacant_spots), "next_available_spot": self._get_next_available_spot(),
+                    "version": self.version}
+
+    def _notify(self, event, **data):
+        if not self._listeners:
+            return
+        data.update(self.get_state())
+        for listener in self._listeners:
+            listener(event, data)
+
+    def load(self, spots_and_plates, spots_and_departure_times=(), version=0):
+        with self._lock:
+            self.version = version
+            self._snapshots = {}
+            self._spots = set()
+            self._plates_by_spot = {}
+            self._spots_by_plate = {}
+            attributes_by_spot = {}
+            for spot, plate, *attribute_values in spots_and_plates:
+                self._spots.add(spot)
+                attributes_by_spot[spot] = list(zip(spot_attributes, attribute_values))
+                if plate is not None:
+                    self._plates_by_spot[spot] = plate
+                    self._spots_by_plate[plate] = spot
+            self._spot_order = sorted(self._spots)
+            self._positions = {spot: position for position, spot in enumerate(self._spot_order)}
+            self._attribute_bits = {}
+            for spot, position in self._positions.items():
+                for attribute_and_value in attributes_by_spot[spot]:
+                    self._attribute_bits[attribute_and_value] = \
+                        self._attribute_bits.get(attribute_and_value, 0) | 1 << position
+            self._vacant_spots = sorted(self._spots - self._plates_by_spot.keys())
+            self._vacant_bits = sum(1 << self._positions[spot] for spot in self._vacant_spots)
+            self._occupied_spots = sorted(self._plates_by_spot)
+            self._departures_by_spot = {spot: departure_time for spot, departure_time in spots_and_departure_times
+                                        if spot in self._plates_by_spot}
+            self._departures = [(departure_time, spot) for spot, departure_time in self._departures_by_spot.items()]
+            heapify(self._departures)
+            self.loaded = True
+            self._notify("resync")
+
+    def ensure_current(self, version, load_lot_state):
+        with self._lock:
+            if not self.loaded or self.version < version:
+                self.load(*load_lot_state(), version=version)
+
+    def apply(self, version, parked=(), left=()):
+        # Changes committed by other processes in between show up as a gap in the version sequence.
+        # The index is then reloaded on the next read instead of being patched.
+        with self._lock:
+            if not self.loaded or version <= self.version:
+                return
+            if version > self.version + 1:
+                self.loaded = False
+                return
+            self.version = version
+            for spot, license_plate, departure_time in parked:
+                self.park(spot, license_plate)
+                self.set_expected_departure(spot, departure_time)
+                self._notify("park", spot=spot, old_plate=None, new_plate=license_plate)
+            for license_plate in left:
+                spot = self.leave(license_plate)
+                if spot is not None:
+                    self._notify("leave", spot=spot, old_plate=license_plate, new_plate=None)
+
+    def expire(self, spot, license_plate):
+        with self._lock:
+            if self._plates_by_spot.get(spot) == license_plate:
+                self._notify("expire", spot=spot, old_plate=license_plate, new_plate=license_plate)
+
+    def get_snapshot(self, name, render):
+        with self._lock:
+            body = self._snapshots.get(name)
+            if body is None:
+                body = self._snapshots[name] = render()
+            return self.version, body
+
+    def has_spot(self, spot):
+        return spot in self._spots
+
+    def get_spots(self):
+        with self._lock:
+            return list(self._spot_order)
+
+    def get_vacant_spots(self):
+        with self._lock:
+            if self._vacant_spots:
+                return list(self._vacant_spots)
+            raise NoSpotsAvailable
+
+    def get_first_vacant_spot(self):
+        with self._lock:
+            if self._vacant_spots:
+                return self._vacant_spots[0]
+            raise NoSpotsAvailable
+
+    def _matching_bits(self, constraints):
+        # Spots are numbered in canonical order, so each attribute value is an integer bitset over all spots
+        # and a constrained lookup is a handful of word-wise ANDs.
+        bits = -1
+        for attribute_and_value in constraints.items():
+            bits &= self._attribute_bits.get(attribute_and_value, 0)
+        return bits
+
+    def get_first_vacant_spot_matching(self, constraints):
+        with self._lock:
+            candidates = self._vacant_bits & self._matching_bits(constraints)
+            if not candidates:
+                raise NoSpotsAvailable
+            return self._spot_order[(candidates & -candidates).bit_length() - 1]
+
+    def get_next_departure_matching(self, constraints):
+        # Constrained lookups walk every occupied spot's departure, O(n) in the lot size. They are only made once no
+        # matching spot is vacant, and a heap per combination of attribute values would cost every park and leave.
+        with self._lock:
+            if not constraints:
+                return self.get_next_departure()
+            matching_bits = self._matching_bits(constraints)
+            departures = [(departure_time, spot) for spot, departure_time in self._departures_by_spot.items()
+                          if spot in self._positions and matching_bits >> self._positions[spot] & 1]
+            if not departures:
+                return None
+            departure_time, spot = min(departures)
+            return spot, departure_time
+
+    def get_vacant_spots_count(self):
+        with self._lock:
+            return len(self._vacant_spots)
+
+    def get_unavailable_spots_and_plates(self):
+        with self._lock:
+            if self._occupied_spots:
+                return {spot: self._plates_by_spot[spot] for spot in self._occupied_spots}
+            raise AllSpotsAvailable
+
+    def get_spot_from_plate(self, license_plate):
+        spot = self._spots_by_plate.get(license_plate)
+        if spot is None:
+            raise LicensePlateNotFound
+        return spot
+
+    @staticmethod
+    def _remove_sorted(spots, spot):
+        position = bisect_left(spots, spot)
+        if position < len(spots) and spots[position] == spot:
+            del spots[position]
+
+    def set_expected_departure(self, spot, departure_time):
+        with self._lock:
+            if spot not in self._plates_by_spot:
+                return
+            self._departures_by_spot[spot] = departure_time
+            heappush(self._departures, (departure_time, spot))
+            if len(self._departures) > 2 * len(self._departures_by_spot) + 64:
+                self._departures = [(departure_time, spot) for spot, departure_time
+                                    in self._departures_by_spot.items()]
+                heapify(self._departures)
+
+    def get_next_departure(self):
+        # Overdue stays sort before running ones, so the most overdue vehicle is the next expected to leave.
+        # Heap entries whose spot has since been vacated or re-parked are discarded lazily here.
+        with self._lock:
+            while self._departures:
+                departure_time, spot = self._departures[0]
+                if self._departures_by_spot.get(spot) == departure_time:
+                    return spot, departure_time
+                heappop(self._departures)
+            return None
+
+    def park(self, spot, license_plate):
+        with self._lock:
+            self._snapshots = {}
+            self._remove_sorted(self._vacant_spots, spot)
+            if spot in self._positions:
+                self._vacant_bits &= ~(1 << self._positions[spot])
+            if spot not in self._plates_by_spot:
+                insort(self._occupied_spots, spot)
+            self._plates_by_spot[spot] = license_plate
+            self._spots_by_plate[license_plate] = spot
+
+    def leave(self, license_plate):
+        with self._lock:
+            spot = self._spots_by_plate.pop(license_plate, None)
+            if spot is None:
+                return None
+            self._snapshots = {}
+            del self._plates_by_spot[spot]
+            self._departures_by_spot.pop(spot, None)
+            self._remove_sorted(self._occupied_spots, spot)
+            insort(self._vacant_spots, spot)
+            if spot in self._positions:
+                self._vacant_bits |= 1 << self._positions[spot]
+            return spot
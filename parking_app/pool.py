@@ -0,0 +1,82 @@
+from contextlib import contextmanager
+from queue import LifoQueue, Empty
+from threading import Lock
+
+from parking_app.exceptions import PoolExhausted
+
+
+class ConnectionPool:
+
+    def __init__(self, connect, size, timeout):
+        self.connect = connect
+        self.size = size
+        self.timeout = timeout
+        self._idle = LifoQueue(maxsize=size)
+        self._lock = Lock()
+        self._opened = 0
+
+    def _open_connection(self):
+        with self._lock:
+            if self._opened >= self.size:
+                return None
+            self._opened += 1
+        try:
+            return self.connect()
+        except Exception:
+            with self._lock:
+                self._opened -= 1
+            raise
+
+    def _discard(self, cnx):
+        with self._lock:
+            self._opened -= 1
+        try:
+            cnx.close()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _is_healthy(cnx):
+        try:
+            cnx.ping(reconnect=True, attempts=1)
+            return True
+        except Exception:
+            return False
+
+    def get_connection(self):
+        try:
+            cnx = self._idle.get_nowait()
+        except Empty:
+            cnx = self._open_connection()
+            if cnx is not None:
+                return cnx
+            try:
+                cnx = self._idle.get(timeout=self.timeout)
+            except Empty:
+                raise PoolExhausted
+        if self._is_healthy(cnx):
+            return cnx
+        self._discard(cnx)
+        return self.get_connection()
+
+    def release(self, cnx):
+        try:
+            cnx.rollback()
+        except Exception:
+            self._discard(cnx)
+            return
+        self._idle.put_nowait(cnx)
+
+    @contextmanager
+    def connection(self):
+        cnx = self.get_connection()
+        try:
+            yield cnx
+        finally:
+            self.release(cnx)
+
+    def stats(self):
+        with self._lock:
+            opened = self._opened
+        idle = self._idle.qsize()
+        return {"size": self.size, "opened": opened, "idle": idle, "in_use": opened - idle}
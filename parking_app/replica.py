@@ -0,0 +1,49 @@
+from collections import Counter
+from threading import Lock
+from time import time
+
+
+class ReplicaMonitor:
+
+    def __init__(self, write_heartbeat, read_heartbeat, max_lag):
+        self.write_heartbeat = write_heartbeat
+        self.read_heartbeat = read_heartbeat
+        self.max_lag = max_lag
+        self.failed_checks = 0
+        self._replicated_until = None
+        self._reads = Counter()
+        self._lock = Lock()
+
+    def check(self):
+        # The primary is stamped with the current time and the replica is asked for the latest stamp it has applied:
+        # it holds every change committed on the primary before that time.
+        try:
+            self.write_heartbeat(time())
+            replicated_until = self.read_heartbeat()
+        except Exception:
+            replicated_until = None
+        with self._lock:
+            self._replicated_until = replicated_until
+            if replicated_until is None:
+                self.failed_checks += 1
+
+    def lag(self):
+        with self._lock:
+            replicated_until = self._replicated_until
+        return None if replicated_until is None else max(time() - replicated_until, 0)
+
+    def use_replica(self, written_at=None):
+        # A session that wrote at written_at only reads from the replica once it has applied a later heartbeat, so it
+        # always sees its own parks and leaves.
+        with self._lock:
+            replicated_until = self._replicated_until
+            usable = replicated_until is not None and time() - replicated_until <= self.max_lag and \
+                (written_at is None or written_at < replicated_until)
+            self._reads["replica" if usable else "primary"] += 1
+        return usable
+
+    def stats(self):
+        lag = self.lag()
+        with self._lock:
+            return {"lag": lag, "max_lag": self.max_lag, "failed_checks": self.failed_checks,
+                    "replica_reads": self._reads["replica"], "primary_reads": self._reads["primary"]}
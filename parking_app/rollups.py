@@ -0,0 +1,57 @@
+import sys
+from operator import itemgetter
+
+rollup_columns = ("arrivals", "departures", "peak_occupancy", "closing_occupancy", "stay_seconds", "overstays")
+
+
+def hour_start(timestamp):
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def arrival_event(arrival_time):
+    return arrival_time, 1, 0, 0
+
+
+def departure_event(arrival_time, expected_departure_time, actual_departure_time):
+    return actual_departure_time, -1, int((actual_departure_time - arrival_time).total_seconds()), \
+        int(actual_departure_time > expected_departure_time)
+
+
+def rollup_events(events, occupied):
+    # Replays arrivals (+1) and departures (-1) in time order from the occupancy before the first event. Departures
+    # go first on ties so that a spot handed over within a second does not count twice towards the peak.
+    hours = {}
+    for time, change, stay_seconds, overstay in sorted(events, key=itemgetter(0, 1)):
+        hour = hours.get(hour_start(time))
+        if hour is None:
+            hour = hours[hour_start(time)] = dict.fromkeys(rollup_columns, 0)
+            hour["peak_occupancy"] = occupied
+        occupied += change
+        hour["arrivals" if change > 0 else "departures"] += 1
+        hour["peak_occupancy"] = max(hour["peak_occupancy"], occupied)
+        hour["closing_occupancy"] = occupied
+        hour["stay_seconds"] += stay_seconds
+        hour["overstays"] += overstay
+    return hours
+
+
+def summarize(rows):
+    hours = []
+    totals = dict.fromkeys(("arrivals", "departures", "peak_occupancy", "stay_seconds", "overstays"), 0)
+    for hour, *values in rows:
+        hour_stats = dict(zip(rollup_columns, values), hour=hour.isoformat())
+        hour_stats["average_stay_seconds"] = hour_stats["stay_seconds"] / hour_stats["departures"] \
+            if hour_stats["departures"] else None
+        hours.append(hour_stats)
+        for column in totals:
+            totals[column] = max(totals[column], hour_stats[column]) if column == "peak_occupancy" else \
+                totals[column] + hour_stats[column]
+    totals["average_stay_seconds"] = totals["stay_seconds"] / totals["departures"] if totals["departures"] else None
+    return {"hours": hours, "totals": totals}
+
+
+if __name__ == '__main__':
+    from parking_app.db import DBData
+    if sys.argv[1:] != ["rebuild"]:
+        sys.exit("usage: python -m parking_app.rollups rebuild")
+    DBData().rebuild_occupancy_rollup()
@@ -0,0 +1,158 @@
+import os
+import re
+import sqlite3
+import sys
+from datetime import datetime
+from functools import lru_cache
+
+from mysql.connector import IntegrityError
+
+from parking_app.migrations import migrate
+
+resources_directory = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "resources")
+schema_script_path = os.path.join(resources_directory, "parking_app_sqlite.sql")
+seed_script_path = os.path.join(resources_directory, "parking_app.sql")
+
+row_locking_clause = re.compile(r"\s+FOR\s+UPDATE(\s+SKIP\s+LOCKED)?", re.IGNORECASE)
+write_statement = re.compile(r"^\s*(INSERT|UPDATE|DELETE|REPLACE)\b", re.IGNORECASE)
+unique_violation = re.compile(r"^UNIQUE constraint failed: (\w+\.\w+)$")
+
+sqlite3.register_converter("DATETIME", lambda value: datetime.fromisoformat(value.decode("utf-8")))
+
+
+@lru_cache(maxsize=512)
+def translate(statement):
+    # The queries are written for MySQL. SQLite only differs in its placeholder style and in having no row locks:
+    # statements that would lock rows, or write, start an immediate transaction instead, which takes the
+    # database-wide write lock up front.
+    locks_rows = row_locking_clause.search(statement) is not None or write_statement.match(statement) is not None
+    return row_locking_clause.sub("", statement).replace("%s", "?"), locks_rows
+
+
+class SQLiteCursor:
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.cursor = connection.cnx.cursor()
+        self.insert_id = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self.cursor.lastrowid if self.insert_id is None else self.insert_id
+
+    def _run(self, method, statement, parameters):
+        sqlite_statement, locks_rows = translate(statement)
+        if locks_rows and not self.connection.in_transaction:
+            self.cursor.execute("BEGIN IMMEDIATE")
+        self.connection.insert_id = None
+        try:
+            method(sqlite_statement, parameters)
+            self.insert_id = self.connection.insert_id
+        except sqlite3.IntegrityError as error:
+            # Unique columns are named like their MySQL keys, so callers can tell which one was violated.
+            violation = unique_violation.match(str(error))
+            if violation is not None:
+                raise IntegrityError(msg=f"Duplicate entry for key '{violation.group(1)}_UNIQUE'") from error
+            raise IntegrityError(msg=str(error)) from error
+
+    def execute(self, statement, parameters=()):
+        self._run(self.cursor.execute, statement, parameters)
+
+    def executemany(self, statement, parameters):
+        self._run(self.cursor.executemany, statement, parameters)
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchmany(self, size):
+        return self.cursor.fetchmany(size)
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def close(self):
+        self.cursor.close()
+
+
+class SQLiteConnection:
+
+    def __init__(self, path, timeout=5):
+        self.cnx = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False,
+                                   detect_types=sqlite3.PARSE_DECLTYPES)
+        self.cnx.execute("PRAGMA journal_mode = WAL")
+        self.cnx.execute("PRAGMA synchronous = NORMAL")
+        self.cnx.execute("PRAGMA foreign_keys = ON")
+        # Like MySQL's, LAST_INSERT_ID(expr) returns expr and makes it the statement's lastrowid, so an UPDATE can
+        # hand back a value without a second round trip.
+        self.insert_id = None
+        self.cnx.create_function("LAST_INSERT_ID", 1, self._remember_insert_id)
+
+    def _remember_insert_id(self, value):
+        self.insert_id = value
+        return value
+
+    @property
+    def in_transaction(self):
+        return self.cnx.in_transaction
+
+    def cursor(self, buffered=None, prepared=None):
+        return SQLiteCursor(self)
+
+    def commit(self):
+        if self.cnx.in_transaction:
+            self.cnx.execute("COMMIT")
+
+    def rollback(self):
+        if self.cnx.in_transaction:
+            self.cnx.execute("ROLLBACK")
+
+    def ping(self, reconnect=False, attempts=1):
+        self.cnx.execute("SELECT 1")
+
+    def close(self):
+        self.cnx.close()
+
+
+def connect_to_sqlite(path, timeout=5):
+    return SQLiteConnection(path, timeout)
+
+
+def _seed_statements(script):
+    # The MySQL script quotes strings with double quotes, which SQLite reads as identifiers.
+    insertions = script[script.index("-- Insertions") + len("-- Insertions"):]
+    return insertions.replace('"', "'")
+
+
+def create_database(path, schema_path=schema_script_path, seed_path=seed_script_path):
+    cnx = sqlite3.connect(path)
+    try:
+        with open(schema_path) as schema_file:
+            cnx.executescript(schema_file.read())
+        if seed_path is not None:
+            with open(seed_path) as seed_file:
+                cnx.executescript(_seed_statements(seed_file.read()))
+        cnx.commit()
+    finally:
+        cnx.close()
+    cnx = connect_to_sqlite(path)
+    try:
+        migrate(cnx, "sqlite")
+    finally:
+        cnx.close()
+
+
+if __name__ == '__main__':
+    create_database(sys.argv[1] if len(sys.argv) > 1 else os.getenv("DATABASE_PATH", "parking_app.db"))
@@ -0,0 +1,92 @@
+from threading import Lock
+from weakref import WeakKeyDictionary
+
+
+class PreparedStatementCache:
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._connections = WeakKeyDictionary()
+        self._lock = Lock()
+
+    def _statements(self, cnx):
+        connection_id = getattr(cnx, "connection_id", None)
+        with self._lock:
+            cached = self._connections.get(cnx)
+            if cached is None or cached[0] != connection_id:
+                # A reconnect starts a new server session, which has none of the old session's statements prepared.
+                cached = self._connections[cnx] = (connection_id, {})
+            return cached[1]
+
+    def get(self, cnx, statement):
+        # A connection is only used by one thread at a time, so its own statements need no lock. The prepared cursor
+        # is handed back with the statement object it was prepared with: the connector only skips preparing again
+        # when it is given that very same object.
+        statements = self._statements(cnx)
+        prepared = statements.get(statement)
+        hit = prepared is not None
+        if not hit:
+            prepared = statements[statement] = (cnx.cursor(prepared=True), statement)
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return prepared
+
+    def stats(self):
+        with self._lock:
+            return {"connections": len(self._connections),
+                    "statements": sum(len(statements) for connection_id, statements in self._connections.values()),
+                    "hits": self.hits, "misses": self.misses}
+
+
+class StatementCursor:
+    # Runs the given statements on the connection's prepared cursors and everything else on a plain cursor, so a
+    # transaction can mix both through one cursor.
+
+    def __init__(self, cnx, statement_cache, statements):
+        self.cnx = cnx
+        self.statement_cache = statement_cache
+        self.statements = statements
+        self.cursor = cnx.cursor()
+        self.active = self.cursor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __iter__(self):
+        return iter(self.active)
+
+    @property
+    def rowcount(self):
+        return self.active.rowcount
+
+    @property
+    def lastrowid(self):
+        return self.active.lastrowid
+
+    def execute(self, statement, parameters=None):
+        if statement in self.statements:
+            self.active, statement = self.statement_cache.get(self.cnx, statement)
+        else:
+            self.active = self.cursor
+        if parameters is not None:
+            self.active.execute(statement, parameters)
+        else:
+            self.active.execute(statement)
+
+    def executemany(self, statement, parameters):
+        # Prepared cursors run executemany one row at a time, while a plain cursor batches inserts into one statement.
+        self.active = self.cursor
+        self.cursor.executemany(statement, parameters)
+
+    def fetchmany(self, size):
+        return self.active.fetchmany(size)
+
+    def close(self):
+        self.cursor.close()
@@ -13,6 +13,10 @@ CREATE TABLE `login_data` (
 CREATE TABLE `parking_spot_data` (
     `spot_id` VARCHAR(45) NOT NULL,
     `vehicle_number` VARCHAR(100) DEFAULT NULL,
+    `zone` VARCHAR(45) NOT NULL DEFAULT 'A',
+    `level` INT NOT NULL DEFAULT 0,
+    `size_class` VARCHAR(20) NOT NULL DEFAULT 'standard',
+    `has_ev_charger` TINYINT NOT NULL DEFAULT 0,
     PRIMARY KEY (`spot_id`),
     UNIQUE KEY `spot_id_UNIQUE` (`spot_id`),
     UNIQUE KEY `vehicle_number_UNIQUE` (`vehicle_number`)
@@ -28,119 +32,142 @@ CREATE TABLE `parked_vehicles_data` (
   `actual_departure_time` datetime DEFAULT NULL,
   `has_expired` tinyint NOT NULL,
   PRIMARY KEY (`log_id`),
-  KEY `spot_id_idx` (`spot_id`) /*!80000 INVISIBLE */,
-  KEY `vehicle_number_idx` (`vehicle_number`),
+  KEY `spot_id_idx` (`spot_id`),
+  KEY `vehicle_number_has_left_idx` (`vehicle_number`,`has_left`),
+  KEY `has_left_departure_idx` (`has_left`,`expected_departure_time`,`spot_id`),
+  KEY `has_expired_departure_idx` (`has_expired`,`expected_departure_time`),
   CONSTRAINT `spot_id` FOREIGN KEY (`spot_id`) REFERENCES `parking_spot_data` (`spot_id`)
 ) ENGINE=InnoDB AUTO_INCREMENT=15 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+CREATE TABLE `occupancy_version` (
+  `id` tinyint NOT NULL,
+  `version` bigint NOT NULL,
+  `occupied` int NOT NULL DEFAULT 0,
+  PRIMARY KEY (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+CREATE TABLE `occupancy_rollup` (
+  `hour_start` datetime NOT NULL,
+  `arrivals` int NOT NULL DEFAULT 0,
+  `departures` int NOT NULL DEFAULT 0,
+  `peak_occupancy` int NOT NULL DEFAULT 0,
+  `closing_occupancy` int NOT NULL DEFAULT 0,
+  `stay_seconds` bigint NOT NULL DEFAULT 0,
+  `overstays` int NOT NULL DEFAULT 0,
+  PRIMARY KEY (`hour_start`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
+CREATE TABLE `replication_heartbeat` (
+  `id` tinyint NOT NULL,
+  `beat_at` double NOT NULL,
+  PRIMARY KEY (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci;
 
  -- Insertions
 
 INSERT INTO parking_spot_data 
-(spot_id, vehicle_number) 
+(spot_id, vehicle_number, zone, level, size_class, has_ev_charger) 
 VALUES
-("A01","Z-810-TU"),
-("A02","U-462-HB"),
-("A03",NULL),
-("A04","Q-658-LR"),
-("A05","S-627-JM"),
-("A06","W-267-BX"),
-("A07","Z-601-FR"),
-("A08",NULL),
-("A09","I-703-XD"),
-("A10","J-993-KJ"),
-("A11","A-818-QA"),
-("A12",NULL),
-("A13",NULL),
-("A14",NULL),
-("A15",NULL),
-("A16","L-682-RB"),
-("A17",NULL),
-("A18",NULL),
-("A19","H-762-XC"),
-("A20",NULL),
-("A21",NULL),
-("A22",NULL),
-("A23",NULL),
-("A24",NULL),
-("A25",NULL),
-("A26",NULL),
-("A27",NULL),
-("A28",NULL),
-("A29",NULL),
-("A30","C-193-YB"),
-("A31","O-022-IH"),
-("A32",NULL),
-("A33",NULL),
-("A34","Y-463-JG"),
-("A35",NULL),
-("A36",NULL),
-("A37","J-716-KU"),
-("A38",NULL),
-("A39",NULL),
-("A40",NULL),
-("A41",NULL),
-("A42",NULL),
-("A43",NULL),
-("A44","Y-112-WT"),
-("A45","L-072-OS"),
-("A46","R-482-VR"),
-("A47",NULL),
-("A48",NULL),
-("A49",NULL),
-("A50","I-505-DM"),
-("A51",NULL),
-("A52",NULL),
-("A53",NULL),
-("A54",NULL),
-("A55","K-958-ZT"),
-("A56",NULL),
-("A57",NULL),
-("A58",NULL),
-("A59",NULL),
-("A60","K-452-BM"),
-("A61",NULL),
-("A62","L-110-HM"),
-("A63",NULL),
-("A64","D-699-GO"),
-("A65","F-130-AE"),
-("A66",NULL),
-("A67",NULL),
-("A68",NULL),
-("A69",NULL),
-("A70","Q-944-VI"),
-("A71","M-014-VG"),
-("A72",NULL),
-("A73",NULL),
-("A74","G-659-WF"),
-("A75","Q-523-CX"),
-("A76",NULL),
-("A77",NULL),
-("A78",NULL),
-("A79","H-608-SX"),
-("A80",NULL),
-("A81",NULL),
-("A82","K-104-EA"),
-("A83","Z-436-JD"),
-("A84",NULL),
-("A85","F-613-WZ"),
-("A86",NULL),
-("A87",NULL),
-("A88","V-711-IR"),
-("A89","J-611-SI"),
-("A90",NULL),
-("A91",NULL),
-("A92",NULL),
-("A93","A-113-HG"),
-("A94",NULL),
-("A95",NULL),
-("A96",NULL),
-("A97",NULL),
-("A98",NULL),
-("A99","P-333-MW"),
-("A100",NULL),
-("A101",NULL),
-("A102",NULL),
-("A103",NULL);
+("A01","Z-810-TU","A",1,"compact",0),
+("A02","U-462-HB","A",1,"compact",0),
+("A03",NULL,"A",1,"standard",0),
+("A04","Q-658-LR","A",1,"standard",0),
+("A05","S-627-JM","A",1,"standard",0),
+("A06","W-267-BX","A",1,"standard",0),
+("A07","Z-601-FR","A",1,"standard",0),
+("A08",NULL,"A",1,"standard",0),
+("A09","I-703-XD","A",1,"standard",0),
+("A10","J-993-KJ","A",1,"standard",0),
+("A11","A-818-QA","A",1,"compact",0),
+("A12",NULL,"A",1,"compact",0),
+("A13",NULL,"A",1,"standard",0),
+("A14",NULL,"A",1,"standard",0),
+("A15",NULL,"A",1,"standard",0),
+("A16","L-682-RB","A",1,"standard",0),
+("A17",NULL,"A",1,"standard",0),
+("A18",NULL,"A",1,"standard",0),
+("A19","H-762-XC","A",1,"standard",0),
+("A20",NULL,"A",1,"standard",0),
+("A21",NULL,"A",1,"compact",0),
+("A22",NULL,"A",1,"compact",0),
+("A23",NULL,"A",1,"standard",0),
+("A24",NULL,"A",1,"standard",0),
+("A25",NULL,"A",1,"standard",1),
+("A26",NULL,"A",1,"standard",0),
+("A27",NULL,"A",1,"standard",0),
+("A28",NULL,"A",1,"standard",0),
+("A29",NULL,"A",1,"standard",0),
+("A30","C-193-YB","A",1,"standard",0),
+("A31","O-022-IH","A",1,"compact",0),
+("A32",NULL,"A",1,"compact",0),
+("A33",NULL,"A",1,"standard",0),
+("A34","Y-463-JG","A",1,"standard",0),
+("A35",NULL,"A",1,"standard",0),
+("A36",NULL,"A",1,"standard",0),
+("A37","J-716-KU","A",1,"standard",0),
+("A38",NULL,"A",1,"standard",0),
+("A39",NULL,"A",1,"standard",0),
+("A40",NULL,"A",1,"standard",0),
+("A41",NULL,"A",1,"compact",0),
+("A42",NULL,"A",1,"compact",0),
+("A43",NULL,"A",1,"standard",0),
+("A44","Y-112-WT","A",1,"standard",0),
+("A45","L-072-OS","A",1,"standard",0),
+("A46","R-482-VR","A",1,"standard",0),
+("A47",NULL,"A",1,"standard",0),
+("A48",NULL,"A",1,"standard",0),
+("A49",NULL,"A",1,"standard",0),
+("A50","I-505-DM","A",1,"standard",1),
+("A51",NULL,"A",2,"compact",0),
+("A52",NULL,"A",2,"compact",0),
+("A53",NULL,"A",2,"standard",0),
+("A54",NULL,"A",2,"standard",0),
+("A55","K-958-ZT","A",2,"standard",0),
+("A56",NULL,"A",2,"standard",0),
+("A57",NULL,"A",2,"standard",0),
+("A58",NULL,"A",2,"standard",0),
+("A59",NULL,"A",2,"standard",0),
+("A60","K-452-BM","A",2,"standard",0),
+("A61",NULL,"A",2,"compact",0),
+("A62","L-110-HM","A",2,"compact",0),
+("A63",NULL,"A",2,"standard",0),
+("A64","D-699-GO","A",2,"standard",0),
+("A65","F-130-AE","A",2,"standard",0),
+("A66",NULL,"A",2,"standard",0),
+("A67",NULL,"A",2,"standard",0),
+("A68",NULL,"A",2,"standard",0),
+("A69",NULL,"A",2,"standard",0),
+("A70","Q-944-VI","A",2,"standard",0),
+("A71","M-014-VG","A",2,"compact",0),
+("A72",NULL,"A",2,"compact",0),
+("A73",NULL,"A",2,"standard",0),
+("A74","G-659-WF","A",2,"standard",0),
+("A75","Q-523-CX","A",2,"standard",1),
+("A76",NULL,"A",2,"standard",0),
+("A77",NULL,"A",2,"standard",0),
+("A78",NULL,"A",2,"standard",0),
+("A79","H-608-SX","A",2,"standard",0),
+("A80",NULL,"A",2,"standard",0),
+("A81",NULL,"A",2,"compact",0),
+("A82","K-104-EA","A",2,"compact",0),
+("A83","Z-436-JD","A",2,"standard",0),
+("A84",NULL,"A",2,"standard",0),
+("A85","F-613-WZ","A",2,"standard",0),
+("A86",NULL,"A",2,"standard",0),
+("A87",NULL,"A",2,"standard",0),
+("A88","V-711-IR","A",2,"standard",0),
+("A89","J-611-SI","A",2,"standard",0),
+("A90",NULL,"A",2,"standard",0),
+("A91",NULL,"A",2,"compact",0),
+("A92",NULL,"A",2,"compact",0),
+("A93","A-113-HG","A",2,"standard",0),
+("A94",NULL,"A",2,"standard",0),
+("A95",NULL,"A",2,"standard",0),
+("A96",NULL,"A",2,"standard",0),
+("A97",NULL,"A",2,"standard",0),
+("A98",NULL,"A",2,"standard",0),
+("A99","P-333-MW","A",2,"standard",0),
+("A100",NULL,"A",2,"standard",1),
+("A101",NULL,"A",2,"compact",0),
+("A102",NULL,"A",2,"compact",0),
+("A103",NULL,"A",2,"standard",0);
 
 INSERT INTO parked_vehicles_data 
 (spot_id, vehicle_number, arrival_time, selected_length_of_stay, expected_departure_time, has_left, actual_departure_time, has_expired)
@@ -185,4 +212,49 @@ VALUES
 INSERT INTO login_data
 (username, email_address, password)
 VALUES
-("testuser", "testuser@test.dummy.com", "$2b$12$sT7kaXPkYI7YFVxkdworCORaZAI1xLa.3p30VIodr8K/FkeZ17HEi");
\ No newline at end of file
+("testuser", "testuser@test.dummy.com", "$2b$12$sT7kaXPkYI7YFVxkdworCORaZAI1xLa.3p30VIodr8K/FkeZ17HEi");
+
+INSERT INTO occupancy_version
+(id, version, occupied)
+VALUES
+(1, 0, 36);
+
+INSERT INTO replication_heartbeat
+(id, beat_at)
+VALUES
+(1, 0);
+
+INSERT INTO occupancy_rollup
+(hour_start, arrivals, departures, peak_occupancy, closing_occupancy, stay_seconds, overstays)
+VALUES
+("2022-11-18 00:00:00",1,0,1,1,0,0),
+("2022-11-18 01:00:00",1,0,2,2,0,0),
+("2022-11-18 05:00:00",1,0,3,3,0,0),
+("2022-11-18 06:00:00",1,0,4,4,0,0),
+("2022-11-18 08:00:00",1,0,5,5,0,0),
+("2022-11-18 09:00:00",1,0,6,6,0,0),
+("2022-11-18 15:00:00",2,0,8,8,0,0),
+("2022-11-18 17:00:00",2,0,10,10,0,0),
+("2022-11-18 18:00:00",1,0,11,11,0,0),
+("2022-11-18 19:00:00",1,0,12,12,0,0),
+("2022-11-19 00:00:00",1,0,13,13,0,0),
+("2022-11-19 01:00:00",1,0,14,14,0,0),
+("2022-11-19 07:00:00",1,0,15,15,0,0),
+("2022-11-19 10:00:00",1,0,16,16,0,0),
+("2022-11-19 13:00:00",1,0,17,17,0,0),
+("2022-11-19 17:00:00",1,0,18,18,0,0),
+("2022-11-19 18:00:00",1,0,19,19,0,0),
+("2022-11-19 20:00:00",1,0,20,20,0,0),
+("2022-11-19 22:00:00",1,0,21,21,0,0),
+("2022-11-20 01:00:00",1,0,22,22,0,0),
+("2022-11-20 02:00:00",1,0,23,23,0,0),
+("2022-11-20 03:00:00",1,0,24,24,0,0),
+("2022-11-20 05:00:00",2,0,26,26,0,0),
+("2022-11-20 06:00:00",1,0,27,27,0,0),
+("2022-11-20 07:00:00",2,0,29,29,0,0),
+("2022-11-20 08:00:00",1,0,30,30,0,0),
+("2022-11-20 10:00:00",1,0,31,31,0,0),
+("2022-11-20 11:00:00",1,0,32,32,0,0),
+("2022-11-20 13:00:00",1,0,33,33,0,0),
+("2022-11-20 16:00:00",1,0,34,34,0,0),
+("2022-11-20 22:00:00",2,0,36,36,0,0);
@@ -0,0 +1,48 @@
+PRAGMA journal_mode = WAL;
+CREATE TABLE login_data (
+  user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+  username VARCHAR(255) NOT NULL COLLATE NOCASE UNIQUE,
+  email_address VARCHAR(255) NOT NULL COLLATE NOCASE UNIQUE,
+  password VARCHAR(255) NOT NULL
+);
+CREATE TABLE parking_spot_data (
+  spot_id VARCHAR(45) NOT NULL PRIMARY KEY,
+  vehicle_number VARCHAR(100) DEFAULT NULL UNIQUE,
+  zone VARCHAR(45) NOT NULL DEFAULT 'A',
+  level INT NOT NULL DEFAULT 0,
+  size_class VARCHAR(20) NOT NULL DEFAULT 'standard',
+  has_ev_charger TINYINT NOT NULL DEFAULT 0
+);
+CREATE TABLE parked_vehicles_data (
+  log_id INTEGER PRIMARY KEY AUTOINCREMENT,
+  spot_id VARCHAR(45) NOT NULL REFERENCES parking_spot_data (spot_id),
+  vehicle_number VARCHAR(100) NOT NULL,
+  arrival_time DATETIME NOT NULL,
+  selected_length_of_stay FLOAT NOT NULL,
+  expected_departure_time DATETIME NOT NULL,
+  has_left TINYINT NOT NULL,
+  actual_departure_time DATETIME DEFAULT NULL,
+  has_expired TINYINT NOT NULL
+);
+CREATE INDEX spot_id_idx ON parked_vehicles_data (spot_id);
+CREATE INDEX vehicle_number_has_left_idx ON parked_vehicles_data (vehicle_number, has_left);
+CREATE INDEX has_left_departure_idx ON parked_vehicles_data (has_left, expected_departure_time, spot_id);
+CREATE INDEX has_expired_departure_idx ON parked_vehicles_data (has_expired, expected_departure_time);
+CREATE TABLE occupancy_version (
+  id TINYINT NOT NULL PRIMARY KEY,
+  version BIGINT NOT NULL,
+  occupied INT NOT NULL DEFAULT 0
+);
+CREATE TABLE occupancy_rollup (
+  hour_start DATETIME NOT NULL PRIMARY KEY,
+  arrivals INT NOT NULL DEFAULT 0,
+  departures INT NOT NULL DEFAULT 0,
+  peak_occupancy INT NOT NULL DEFAULT 0,
+  closing_occupancy INT NOT NULL DEFAULT 0,
+  stay_seconds BIGINT NOT NULL DEFAULT 0,
+  overstays INT NOT NULL DEFAULT 0
+);
+CREATE TABLE replication_heartbeat (
+  id TINYINT NOT NULL PRIMARY KEY,
+  beat_at DOUBLE NOT NULL
+);
@@ -0,0 +1,60 @@
+import os
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+
+from parking_app.analytics import ParkingAnalytics, build_report, compute_analytics, read_report, write_report
+
+history = [
+    (1, "A01", "Z-810-TU", datetime(2022, 11, 21, 8, 0), 2.0, datetime(2022, 11, 21, 10, 0), 1,
+     datetime(2022, 11, 21, 10, 30), 1),
+    (2, "A02", "U-462-HB", datetime(2022, 11, 21, 8, 30), 1.0, datetime(2022, 11, 21, 9, 30), 1,
+     datetime(2022, 11, 21, 9, 0), 0),
+    (3, "A01", "Q-658-LR", datetime(2022, 11, 23, 17, 0), 1.0, datetime(2022, 11, 23, 18, 0), 0, None, 0)
+]
+
+
+class TestAnalytics(TestCase):
+
+    def test_overall_metrics(self):
+        report = compute_analytics(history)
+        self.assertEqual(3, report["stays"])
+        self.assertEqual(2, report["completed_stays"])
+        self.assertEqual(1.5, report["average_stay_hours"])
+        self.assertAlmostEqual(1 / 3, report["overstay_rate"])
+        self.assertEqual(0, report["average_lateness_minutes"])
+        self.assertEqual(0.5, report["late_departure_rate"])
+        self.assertEqual("2022-11-21T08:00:00", report["first_arrival"])
+
+    def test_grouped_metrics(self):
+        report = compute_analytics(history)
+        self.assertEqual(["A01", "A02"], list(report["by_spot"]))
+        self.assertEqual(2, report["by_spot"]["A01"]["stays"])
+        self.assertEqual(2.5, report["by_spot"]["A01"]["average_stay_hours"])
+        self.assertEqual(30, report["by_spot"]["A01"]["average_lateness_minutes"])
+        self.assertAlmostEqual(2 / (2 + 9 / 24), report["by_spot"]["A01"]["turnover_per_day"])
+        self.assertEqual(2, report["by_hour"][8]["stays"])
+        self.assertEqual(0, report["by_hour"][8]["average_lateness_minutes"])
+        self.assertIsNone(report["by_hour"][17]["average_stay_hours"])
+        self.assertIsNone(report["by_hour"][0]["overstay_rate"])
+        self.assertEqual({"Monday": 2, "Wednesday": 1},
+                         {day["weekday"]: day["stays"] for day in report["by_weekday"] if day["stays"]})
+
+    def test_chunking_does_not_change_the_result(self):
+        self.assertEqual(compute_analytics(history), compute_analytics(history, chunk_size=1))
+
+    def test_empty_history(self):
+        report = ParkingAnalytics().result()
+        self.assertEqual(0, report["stays"])
+        self.assertIsNone(report["average_stay_hours"])
+        self.assertEqual({}, report["by_spot"])
+
+    def test_written_report_is_read_back(self):
+        report = build_report(history)
+        self.assertEqual(datetime.fromisoformat(report["generated_at"]).date(), datetime.now().date())
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "analytics.json")
+            write_report(report, path)
+            write_report(report, path)
+            self.assertEqual(report, read_report(path))
+            self.assertEqual(["analytics.json"], os.listdir(directory))
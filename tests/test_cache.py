@@ -0,0 +1,39 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from parking_app.cache import TTLCache
+
+
+class TestTTLCache(TestCase):
+
+    def test_hits_and_misses_are_counted(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        self.assertIsNone(cache.get("beethoven01"))
+        cache.set("beethoven01", {"user_id": 1})
+        self.assertEqual({"user_id": 1}, cache.get("beethoven01"))
+        self.assertEqual({"size": 1, "hits": 1, "misses": 1}, cache.stats())
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("beethoven01", 1)
+        cache.set("mozart02", 2)
+        cache.get("beethoven01")
+        cache.set("bach03", 3)
+        self.assertIsNone(cache.get("mozart02"))
+        self.assertEqual(1, cache.get("beethoven01"))
+        self.assertEqual(3, cache.get("bach03"))
+
+    def test_entries_expire(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        with patch("parking_app.cache.monotonic", return_value=1000):
+            cache.set("beethoven01", 1)
+        with patch("parking_app.cache.monotonic", return_value=1061):
+            self.assertIsNone(cache.get("beethoven01"))
+        self.assertEqual(0, cache.stats()["size"])
+
+    def test_invalidate(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("beethoven01", 1)
+        cache.invalidate("beethoven01")
+        cache.invalidate("mozart02")
+        self.assertIsNone(cache.get("beethoven01"))
@@ -124,6 +124,11 @@ class TestCheckers(TestCase):
         expected = True
         self.assertEqual(expected, result)
 
+    def test_license_plate_trailing_newline(self):
+        result = self.checker.check_if_license_plate_valid("S-627-JM\n")
+        expected = False
+        self.assertEqual(expected, result)
+
     def test_length_of_stay_over_4_integers(self):
         result = self.checker.check_if_length_of_stay_valid("11111.22")
         expected = False
@@ -186,3 +191,27 @@ class TestCheckers(TestCase):
         expected = True
         self.assertEqual(expected, result)
 
+    def test_license_plates_in_bulk(self):
+        result = self.checker.check_license_plates(["S-627-JM", "S627JM", 123, None, "S-627-JMM", "AB-1-CDE",
+                                                    "S-627-JM\n"])
+        expected = [True, False, False, False, False, True, False]
+        self.assertEqual(expected, result)
+
+    def test_license_plates_in_bulk_match_single_check(self):
+        plates = ["S-627-JM", "s-627-jm", "SSS-6-JM", "S-627-J", "S-627-JM ", "S--627JM"]
+        result = self.checker.check_license_plates(plates)
+        expected = [self.checker.check_if_license_plate_valid(plate) for plate in plates]
+        self.assertEqual(expected, result)
+
+    def test_lengths_of_stay_in_bulk(self):
+        result = self.checker.check_lengths_of_stay(["1.23", "1.233", 1.23, "9111.22", "8765.49", None])
+        expected = [True, False, False, False, True, False]
+        self.assertEqual(expected, result)
+
+    def test_spot_constraints(self):
+        self.assertTrue(self.checker.check_if_spot_constraints_valid({}))
+        self.assertTrue(self.checker.check_if_spot_constraints_valid({"zone": "A", "level": 2, "size_class": "compact",
+                                                                      "has_ev_charger": True}))
+        self.assertFalse(self.checker.check_if_spot_constraints_valid({"level": True}))
+        self.assertFalse(self.checker.check_if_spot_constraints_valid({"has_ev_charger": "yes"}))
+        self.assertFalse(self.checker.check_if_spot_constraints_valid({"colour": "red"}))
@@ -1,9 +1,14 @@
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import parking_app.db
 from parking_app.db import DBClient, DBUsers, DBData
+from parking_app.occupancy import OccupancyIndex
+from parking_app.membership import BloomFilter
+from parking_app.cache import TTLCache
+from parking_app.metrics import query_recorder
+from parking_app.statements import PreparedStatementCache
 import parking_app.exceptions
 
 
@@ -30,8 +35,21 @@ class TestDBClient(TestCase):
         self.cursor.execute.assert_called_with("INSERT INTO table (column) VALUES (%s)", ["A01"])
         db_client._insertion_query(self.cursor, "UPDATE table SET column=NULL where id=%s", [None], ["A01"])
         self.cursor.execute.assert_called_with("UPDATE table SET column=NULL where id=%s", [None, "A01"])
+        self.cursor.execute.reset_mock()
         db_client._insertion_query(self.cursor, "UPDATE table SET column=NULL")
-        self.cursor.execute.assert_called_with("UPDATE table SET column=NULL", None)
+        self.cursor.execute.assert_called_once_with("UPDATE table SET column=NULL")
+
+    def test_queries_are_recorded(self, db_connector_function):
+        db_client = DBClient()
+        self.cursor.__iter__.return_value = [("A01",), ("A02",)]
+        self.cursor.rowcount = 3
+        query_recorder.reset()
+        db_client._selection_query(self.cursor, "SELECT * FROM table;")
+        db_client._insertion_query(self.cursor, "UPDATE table SET column=%s", ["A01"])
+        db_client._execute_many(self.cursor, "UPDATE table SET column=%s", [["A01"], ["A02"], ["A03"]])
+        self.assertEqual(3, query_recorder.queries)
+        self.assertEqual(8, query_recorder.rows)
+        self.assertGreater(query_recorder.db_time, 0)
 
 
 @patch("parking_app.db._connect_to_db")
@@ -45,37 +63,87 @@ class TestDBUsers(TestCase):
         cursor.execute.assert_called_with("INSERT INTO login_data (username, email_address, password) VALUES "
                                           "(%s, %s, %s);", ["Beethoven01", "address@email.com", "Pa55wor!"])
 
-    def test_check_for_existing_user_negative(self, db_connector_function):
+    def test_user_creation_duplicate_username(self, db_connector_function):
+        db_user = DBUsers()
+        cursor = MagicMock()
+        cursor.execute.side_effect = parking_app.db.IntegrityError(
+            msg="Duplicate entry 'Beethoven01' for key 'login_data.username_UNIQUE'", errno=1062)
+        db_user.cnx.cursor.return_value.__enter__.return_value = cursor
+        with self.assertRaises(parking_app.exceptions.UsernameAlreadyUsed):
+            db_user.create_user("Beethoven01", "address@email.com", "Pa55wor!")
+        db_user.cnx.rollback.assert_called_once()
+
+    def test_user_creation_duplicate_email_address(self, db_connector_function):
         db_user = DBUsers()
         cursor = MagicMock()
-        cursor.__iter__.return_value = [()]
+        cursor.execute.side_effect = parking_app.db.IntegrityError(
+            msg="Duplicate entry 'address@email.com' for key 'login_data.email_address_UNIQUE'", errno=1062)
         db_user.cnx.cursor.return_value.__enter__.return_value = cursor
-        result = db_user.check_if_username_already_exists("a_username")
-        self.assertEqual(False, result)
+        with self.assertRaises(parking_app.exceptions.EmailAlreadyUsed):
+            db_user.create_user("Beethoven01", "address@email.com", "Pa55wor!")
 
-    def test_check_for_existing_user_positive(self, db_connector_function):
+    def test_user_creation_duplicate_username_mentioning_email_address(self, db_connector_function):
         db_user = DBUsers()
         cursor = MagicMock()
-        cursor.__iter__.return_value = [(1,)]
+        cursor.execute.side_effect = parking_app.db.IntegrityError(
+            msg="Duplicate entry 'email_address' for key 'login_data.username_UNIQUE'", errno=1062)
         db_user.cnx.cursor.return_value.__enter__.return_value = cursor
-        result = db_user.check_if_username_already_exists("a_username")
-        self.assertEqual(True, result)
+        with self.assertRaises(parking_app.exceptions.UsernameAlreadyUsed):
+            db_user.create_user("email_address", "address@email.com", "Pa55wor!")
+
+    def test_check_for_existing_user_negative(self, db_connector_function):
+        db_user = DBUsers()
+        cursor = MagicMock()
+        cursor.__iter__.return_value = []
+        db_user.cnx.cursor.return_value.__enter__.return_value = cursor
+        result = db_user.check_if_already_registered("a_username", "address@email.com")
+        cursor.execute.assert_called_once_with("SELECT username = %s, email_address = %s FROM login_data WHERE "
+                                               "username = %s OR email_address = %s;",
+                                               ["a_username", "address@email.com", "a_username",
+                                                "address@email.com"])
+        self.assertEqual((False, False), result)
 
-    def test_check_for_existing_address_negative(self, db_connector_function):
+    def test_check_for_existing_user_positive(self, db_connector_function):
         db_user = DBUsers()
         cursor = MagicMock()
-        cursor.__iter__.return_value = [()]
+        cursor.__iter__.return_value = [(1, 0)]
         db_user.cnx.cursor.return_value.__enter__.return_value = cursor
-        result = db_user.check_if_email_address_already_exists("address@email.com")
-        self.assertEqual(False, result)
+        result = db_user.check_if_already_registered("a_username", "address@email.com")
+        self.assertEqual((True, False), result)
 
     def test_check_for_existing_address_positive(self, db_connector_function):
         db_user = DBUsers()
         cursor = MagicMock()
-        cursor.__iter__.return_value = [(1,)]
+        cursor.__iter__.return_value = [(0, 1), (1, 0)]
         db_user.cnx.cursor.return_value.__enter__.return_value = cursor
-        result = db_user.check_if_email_address_already_exists("address@email.com")
-        self.assertEqual(True, result)
+        result = db_user.check_if_already_registered("a_username", "address@email.com")
+        self.assertEqual((True, True), result)
+
+    def test_check_for_existing_user_skips_query_for_unknown_names(self, db_connector_function):
+        known_users = BloomFilter(capacity=100)
+        known_users.load(["username:beethoven01", "email_address:address@email.com"])
+        db_user = DBUsers(known_users=known_users)
+        result = db_user.check_if_already_registered("Mozart02", "mozart@email.com")
+        self.assertEqual((False, False), result)
+        db_user.cnx.cursor.assert_not_called()
+
+    def test_check_for_existing_user_queries_for_known_names(self, db_connector_function):
+        known_users = BloomFilter(capacity=100)
+        known_users.load(["username:beethoven01", "email_address:address@email.com"])
+        db_user = DBUsers(known_users=known_users)
+        cursor = MagicMock()
+        cursor.__iter__.return_value = [(1, 0)]
+        db_user.cnx.cursor.return_value.__enter__.return_value = cursor
+        result = db_user.check_if_already_registered("BEETHOVEN01", "mozart@email.com")
+        self.assertEqual((True, False), result)
+
+    def test_created_user_is_known(self, db_connector_function):
+        known_users = BloomFilter(capacity=100)
+        db_user = DBUsers(known_users=known_users)
+        db_user.cnx.cursor.return_value.__enter__.return_value = MagicMock()
+        db_user.create_user("Beethoven01", "Address@email.com", "Pa55wor!")
+        self.assertIn("username:beethoven01", known_users)
+        self.assertIn("email_address:address@email.com", known_users)
 
     def test_getting_user_data_from_username_negative(self, db_connector_function):
         db_user = DBUsers()
@@ -95,6 +163,75 @@ class TestDBUsers(TestCase):
             {"user_id": 1, "username": "Beethoven01", "email_address": "address@email.com", "password": "Pa55wor!"},
             result)
 
+    def test_getting_user_data_from_replica(self, db_connector_function):
+        replica_cnx = MagicMock()
+        db_user = DBUsers(read_cnx=replica_cnx)
+        cursor = MagicMock()
+        cursor.__iter__.return_value = [(1, "Beethoven01", "address@email.com", "Pa55wor!",)]
+        replica_cnx.cursor.return_value.__enter__.return_value = cursor
+        result = db_user.get_user_data_from_username("Beethoven01")
+        self.assertEqual(1, result["user_id"])
+        db_user.cnx.cursor.assert_not_called()
+
+    def test_read_connection_is_only_taken_for_a_query(self, db_connector_function):
+        known_users = BloomFilter(capacity=100)
+        known_users.load(["username:beethoven01", "email_address:address@email.com"])
+        replica_cnx = MagicMock()
+        get_read_cnx = MagicMock(return_value=replica_cnx)
+        db_user = DBUsers(known_users=known_users, user_cache=TTLCache(maxsize=10, ttl=60),
+                          get_read_cnx=get_read_cnx)
+        db_user.user_cache.set("beethoven01", {"user_id": 1, "username": "Beethoven01"})
+        self.assertEqual(1, db_user.get_user_data_from_username("Beethoven01")["user_id"])
+        self.assertEqual((False, False), db_user.check_if_already_registered("Mozart02", "mozart@email.com"))
+        get_read_cnx.assert_not_called()
+        cursor = MagicMock()
+        cursor.__iter__.return_value = [(1, 0)]
+        replica_cnx.cursor.return_value.__enter__.return_value = cursor
+        self.assertEqual((True, False), db_user.check_if_already_registered("Beethoven01", "mozart@email.com"))
+        self.assertEqual((True, False), db_user.check_if_already_registered("Beethoven01", "mozart@email.com"))
+        get_read_cnx.assert_called_once_with()
+        db_user.cnx.cursor.assert_not_called()
+
+    def test_user_missing_from_replica_is_looked_up_on_primary(self, db_connector_function):
+        replica_cnx = MagicMock()
+        db_user = DBUsers(user_cache=TTLCache(maxsize=10, ttl=60), read_cnx=replica_cnx)
+        replica_cursor = MagicMock()
+        replica_cursor.__iter__.return_value = []
+        replica_cnx.cursor.return_value.__enter__.return_value = replica_cursor
+        cursor = MagicMock()
+        cursor.__iter__.return_value = [(1, "Beethoven01", "address@email.com", "Pa55wor!",)]
+        db_user.cnx.cursor.return_value.__enter__.return_value = cursor
+        result = db_user.get_user_data_from_username("Beethoven01")
+        self.assertEqual(1, result["user_id"])
+        self.assertEqual(1, replica_cursor.execute.call_count)
+        self.assertEqual(1, cursor.execute.call_count)
+
+    def test_getting_user_data_from_cache(self, db_connector_function):
+        db_user = DBUsers(user_cache=TTLCache(maxsize=10, ttl=60))
+        cursor = MagicMock()
+        cursor.__iter__.return_value = [(1, "Beethoven01", "address@email.com", "Pa55wor!",)]
+        db_user.cnx.cursor.return_value.__enter__.return_value = cursor
+        db_user.get_user_data_from_username("Beethoven01")
+        result = db_user.get_user_data_from_username("beethoven01")
+        self.assertEqual(1, cursor.execute.call_count)
+        self.assertEqual("Beethoven01", result["username"])
+        self.assertEqual({"size": 1, "hits": 1, "misses": 1}, db_user.user_cache.stats())
+
+    def test_unknown_user_is_not_cached(self, db_connector_function):
+        db_user = DBUsers(user_cache=TTLCache(maxsize=10, ttl=60))
+        cursor = MagicMock()
+        cursor.__iter__.return_value = []
+        db_user.cnx.cursor.return_value.__enter__.return_value = cursor
+        for attempt in range(2):
+            with self.assertRaises(parking_app.exceptions.UserNotFound):
+                db_user.get_user_data_from_username("Beethoven01")
+        self.assertEqual(2, cursor.execute.call_count)
+        self.assertEqual(0, db_user.user_cache.stats()["size"])
+        db_user.create_user("Beethoven01", "address@email.com", "Pa55wor!")
+        cursor.__iter__.return_value = [(1, "Beethoven01", "address@email.com", "Pa55wor!",)]
+        result = db_user.get_user_data_from_username("Beethoven01")
+        self.assertEqual(1, result["user_id"])
+
     def test_registration_input_missing_data(self, db_connector_function):
         db_user = DBUsers()
         cursor = MagicMock()
@@ -105,7 +242,7 @@ class TestDBUsers(TestCase):
     def test_registration_input_same_username(self, db_connector_function):
         db_user = DBUsers()
         cursor = MagicMock()
-        cursor.__iter__.return_value = [("Beethoven01", "address@email.com", "Pa55wor!")]
+        cursor.__iter__.return_value = [(1, 1)]
         db_user.cnx.cursor.return_value.__enter__.return_value = cursor
         with self.assertRaises(parking_app.exceptions.UsernameAlreadyUsed):
             db_user.check_registration_input("Beethoven01", "address@email.com", "Pa55wor!")
@@ -113,9 +250,9 @@ class TestDBUsers(TestCase):
     def test_registration_input_same_email(self, db_connector_function):
         db_user = DBUsers()
         cursor = MagicMock()
-        cursor.__iter__.return_value = [("Beethoven01", "address@email.com", "Pa55wor!")]
+        cursor.__iter__.return_value = [(0, 1)]
         db_user.cnx.cursor.return_value.__enter__.return_value = cursor
-        with self.assertRaises(parking_app.exceptions.UsernameAlreadyUsed):
+        with self.assertRaises(parking_app.exceptions.EmailAlreadyUsed):
             db_user.check_registration_input("Beethoven01", "address@email.com", "Pa55wor!")
 
     def test_registration_input_invalid_username(self, db_connector_function):
@@ -163,73 +300,65 @@ class TestDBUsers(TestCase):
 @patch("parking_app.db._connect_to_db")
 class TestDBData(TestCase):
 
-    def test_check_for_existing_spot_negative(self, db_connector_function):
-        db_data = DBData()
-        cursor = MagicMock()
-        cursor.__iter__.return_value = [()]
-        db_data.cnx.cursor.return_value.__enter__.return_value = cursor
-        result = db_data._check_if_spot_exists("A48")
-        self.assertEqual(False, result)
-
-    def test_check_for_existing_spot_positive(self, db_connector_function):
+    def test_parking_data_checks_invalid_length_of_stay_type(self, db_connector_function):
         db_data = DBData()
-        cursor = MagicMock()
-        cursor.__iter__.return_value = [(1,)]
-        db_data.cnx.cursor.return_value.__enter__.return_value = cursor
-        result = db_data._check_if_spot_exists("A48")
-        self.assertEqual(True, result)
+        with self.assertRaises(TypeError):
+            db_data.check_incoming_values_before_parking("S-627-JM", 11111.22)
 
-    def test_spot_availability_unavailable(self, db_connector_function):
+    def test_parking_data_checks_invalid_length_of_stay(self, db_connector_function):
         db_data = DBData()
-        cursor = MagicMock()
-        cursor.__iter__.return_value = [("S-627-JM",)]
-        db_data.cnx.cursor.return_value.__enter__.return_value = cursor
-        result = db_data._check_if_spot_available("A48")
-        self.assertEqual(False, result)
+        with self.assertRaises(parking_app.exceptions.InvalidLengthOfStay):
+            db_data.check_incoming_values_before_parking("S-627-JM", "1111.22m")
 
-    def test_spot_availability_available(self, db_connector_function):
+    def test_parking_data_checks_length_of_stay_over_a_year(self, db_connector_function):
         db_data = DBData()
-        cursor = MagicMock()
-        cursor.__iter__.return_value = [()]
-        db_data.cnx.cursor.return_value.__enter__.return_value = cursor
-        result = db_data._check_if_spot_available("A48")
-        self.assertEqual(True, result)
+        with self.assertRaises(parking_app.exceptions.TooLong):
+            db_data.check_incoming_values_before_parking("S-627-JM", "9111.22")
 
-    def test_parking_data_checks_invalid_length_of_stay_type(self, db_connector_function):
+    def test_parking_data_checks_invalid_license_plate(self, db_connector_function):
         db_data = DBData()
-        cursor = MagicMock()
-        db_data.cnx.cursor.return_value.__enter__.return_value = cursor
-        with self.assertRaises(TypeError):
-            db_data.check_incoming_values_before_parking("A48", "S-627-JM", 11111.22)
+        with self.assertRaises(parking_app.exceptions.InvalidPlateNumber):
+            db_data.check_incoming_values_before_parking("S627JM", "1111.22")
 
-    def test_parking_data_checks_invalid_length_of_stay(self, db_connector_function):
+    def test_parking_invalid_spot_number(self, db_connector_function):
         db_data = DBData()
         cursor = MagicMock()
+        cursor.rowcount = 0
+        cursor.__iter__.return_value = []
         db_data.cnx.cursor.return_value.__enter__.return_value = cursor
-        with self.assertRaises(parking_app.exceptions.InvalidLengthOfStay):
-            db_data.check_incoming_values_before_parking("A48", "S-627-JM", "1111.22m")
+        with self.assertRaises(parking_app.exceptions.InvalidSpotNumber):
+            db_data.park_car("48", "S-627-JM", "1111.22")
+        db_data.cnx.rollback.assert_called_once()
+        db_data.cnx.commit.assert_not_called()
 
-    def test_parking_data_checks_length_of_stay_over_a_year(self, db_connector_function):
+    def test_parking_spot_unavailable(self, db_connector_function):
         db_data = DBData()
         cursor = MagicMock()
+        cursor.rowcount = 0
+        cursor.__iter__.return_value = [("K-267-MJ",)]
         db_data.cnx.cursor.return_value.__enter__.return_value = cursor
-        with self.assertRaises(parking_app.exceptions.TooLong):
-            db_data.check_incoming_values_before_parking("A48", "S-627-JM", "9111.22")
+        with self.assertRaises(parking_app.exceptions.SpotNotAvailable):
+            db_data.park_car("A48", "S-627-JM", "1111.22")
+        cursor.execute.assert_called_with("SELECT vehicle_number FROM parking_spot_data WHERE spot_id = %s;", ["A48"])
+        db_data.cnx.rollback.assert_called_once()
 
-    def test_parking_data_checks_invalid_spot_number(self, db_connector_function):
+    def test_parking_vehicle_already_in_other_spot(self, db_connector_function):
         db_data = DBData()
         cursor = MagicMock()
+        cursor.execute.side_effect = parking_app.db.IntegrityError(errno=1062)
         db_data.cnx.cursor.return_value.__enter__.return_value = cursor
-        with self.assertRaises(parking_app.exceptions.InvalidSpotNumber):
-            db_data.check_incoming_values_before_parking("48", "S-627-JM", "1111.22")
+        with self.assertRaises(parking_app.exceptions.VehicleAlreadyInOtherSpot):
+            db_data.park_car("A48", "S-627-JM", "1111.22")
+        db_data.cnx.rollback.assert_called_once()
 
-    def test_parking_data_checks_spot_unavailable(self, db_connector_function):
+    def test_get_spots(self, db_connector_function):
         db_data = DBData()
         cursor = MagicMock()
-        cursor.__iter__.return_value = [("K-267-MJ",)]
+        cursor.__iter__.return_value = [("A01",), ("A02",)]
         db_data.cnx.cursor.return_value.__enter__.return_value = cursor
-        with self.assertRaises(parking_app.exceptions.SpotNotAvailable):
-            db_data.check_incoming_values_before_parking("A48", "S-627-JM", "1111.22")
+        result = db_data.get_spots()
+        cursor.execute.assert_called_once_with("SELECT spot_id FROM parking_spot_data ORDER BY spot_id;")
+        self.assertEqual(["A01", "A02"], result)
 
     def test_no_vacant_spots(self, db_connector_function):
         db_data = DBData()
@@ -250,7 +379,7 @@ class TestDBData(TestCase):
     def test_no_vacant_spots_count(self, db_connector_function):
         db_data = DBData()
         cursor = MagicMock()
-        cursor.__iter__.return_value = []
+        cursor.__iter__.return_value = [(0,)]
         db_data.cnx.cursor.return_value.__enter__.return_value = cursor
         with self.assertRaises(parking_app.exceptions.NoSpotsAvailable):
             db_data.get_vacant_spots_count()
@@ -258,11 +387,58 @@ class TestDBData(TestCase):
     def test_get_vacant_spots_count(self, db_connector_function):
         db_data = DBData()
         cursor = MagicMock()
-        cursor.__iter__.return_value = [("A48", "A01",)]
+        cursor.__iter__.return_value = [(2,)]
         db_data.cnx.cursor.return_value.__enter__.return_value = cursor
         result = db_data.get_vacant_spots_count()
+        cursor.execute.assert_called_with("SELECT COUNT(*) FROM parking_spot_data WHERE vehicle_number IS NULL;")
         self.assertEqual("2", result)
 
+    def test_get_vacant_spots_count_from_occupancy_index(self, db_connector_function):
+        occupancy = OccupancyIndex()
+        occupancy.load([("A01", None), ("A48", None), ("A02", "S-627-JM")])
+        db_data = DBData(occupancy=occupancy)
+        result = db_data.get_vacant_spots_count()
+        db_data.cnx.cursor.assert_not_called()
+        self.assertEqual("2", result)
+
+    def test_parking_updates_occupancy_index(self, db_connector_function):
+        occupancy = OccupancyIndex()
+        occupancy.load([("A01", None), ("A48", None)])
+        db_data = DBData(occupancy=occupancy)
+        cursor = MagicMock()
+        cursor.rowcount = 1
+        cursor.lastrowid = (1 << 32) | 1
+        db_data.cnx.cursor.return_value.__enter__.return_value = cursor
+        db_data.park_car("A48", "S-627-JM", "1.00")
+        self.assertEqual(["A01"], db_data.get_vacant_spots())
+        self.assertEqual("A48", db_data.get_spot_from_plate("S-627-JM"))
+        self.assertEqual(1, occupancy.version)
+
+    def test_parking_elsewhere_marks_occupancy_index_stale(self, db_connector_function):
+        occupancy = OccupancyIndex()
+        occupancy.load([("A01", None), ("A48", None)])
+        db_data = DBData(occupancy=occupancy)
+        cursor = MagicMock()
+        cursor.rowcount = 1
+        cursor.lastrowid = (3 << 32) | 1
+        db_data.cnx.cursor.return_value.__enter__.return_value = cursor
+        db_data.park_car("A48", "S-627-JM", "1.00")
+        self.assertFalse(occupancy.loaded)
+        db_data._selection_query = MagicMock(side_effect=[[(3,)], [("A01", "Z-810-TU"), ("A48", "S-627-JM")], []])
+        self.assertEqual(3, db_data.load_occupancy())
+        self.assertEqual(3, occupancy.version)
+        self.assertEqual({"A01": "Z-810-TU", "A48": "S-627-JM"}, db_data.get_unavailable_spots_and_plates())
+
+    def test_current_occupancy_index_is_not_reloaded(self, db_connector_function):
+        occupancy = OccupancyIndex()
+        occupancy.load([("A01", None), ("A48", None)], version=5)
+        db_data = DBData(occupancy=occupancy)
+        cursor = MagicMock()
+        cursor.__iter__.return_value = [(5,)]
+        db_data.cnx.cursor.return_value.__enter__.return_value = cursor
+        self.assertEqual(5, db_data.load_occupancy())
+        cursor.execute.assert_called_once_with("SELECT version FROM occupancy_version WHERE id = 1;")
+
     def test_get_spot_from_plate_plate_not_in_db(self, db_connector_function):
         db_data = DBData()
         cursor = MagicMock()
@@ -305,10 +481,184 @@ class TestDBData(TestCase):
     def test_parking(self, db_connector_function):
         db_data = DBData()
         cursor = MagicMock()
+        cursor.rowcount = 1
+        cursor.lastrowid = (1 << 32) | 37
+        db_data.cnx.cursor.return_value.__enter__.return_value = cursor
+        result = db_data.park_car("A48", "S-627-JM", "0.01")
+        self.assertEqual("A48", result)
+        self.assertEqual(4, cursor.execute.call_count)
+        cursor.execute.assert_any_call("UPDATE parking_spot_data SET vehicle_number = %s WHERE spot_id = %s "
+                                       "AND vehicle_number IS NULL;", ["S-627-JM", "A48"])
+        self.assertTrue(cursor.execute.call_args_list[1].args[0].startswith("INSERT INTO parked_vehicles_data"))
+        cursor.execute.assert_any_call("UPDATE occupancy_version SET occupied = LAST_INSERT_ID(((version + 1) << 32) | "
+                                       "(occupied + %s)) & 4294967295, version = version + 1 WHERE id = 1;", [1])
+        rollup_update = cursor.execute.call_args_list[3].args
+        self.assertTrue(rollup_update[0].startswith("UPDATE occupancy_rollup"))
+        self.assertEqual([1, 0, 37, 37, 37, 0, 0], rollup_update[1][:7])
+        db_data.cnx.commit.assert_called_once()
+
+    def test_parking_with_prepared_statements(self, db_connector_function):
+        db_data = DBData(statement_cache=PreparedStatementCache())
+        cursor = MagicMock()
+        prepared_cursor = MagicMock()
+        prepared_cursor.rowcount = 1
+        prepared_cursor.lastrowid = (1 << 32) | 37
+        db_data.cnx.cursor.side_effect = lambda prepared=False: prepared_cursor if prepared else cursor
+        db_data.park_car("A48", "S-627-JM", "0.01")
+        db_data.park_car("A49", "K-452-BM", "0.01")
+        self.assertEqual(8, prepared_cursor.execute.call_count)
+        prepared_cursor.execute.assert_any_call("UPDATE parking_spot_data SET vehicle_number = %s WHERE spot_id = %s "
+                                                "AND vehicle_number IS NULL;", ["K-452-BM", "A49"])
+        cursor.execute.assert_not_called()
+        self.assertEqual({"connections": 1, "statements": 4, "hits": 4, "misses": 4},
+                         db_data.statement_cache.stats())
+
+    def test_parking_at_next_available_spot(self, db_connector_function):
+        db_data = DBData()
+        cursor = MagicMock()
+        cursor.__iter__.return_value = [("A03", 1)]
+        cursor.lastrowid = (1 << 32) | 1
+        db_data.cnx.cursor.return_value.__enter__.return_value = cursor
+        result = db_data.park_at_next_available_spot("S-627-JM", "0.01")
+        self.assertEqual("A03", result)
+        cursor.execute.assert_any_call("SELECT spot_id FROM parking_spot_data WHERE vehicle_number IS NULL "
+                                       "ORDER BY spot_id LIMIT 1 FOR UPDATE SKIP LOCKED;")
+        cursor.execute.assert_any_call("UPDATE parking_spot_data SET vehicle_number = %s WHERE spot_id = %s;",
+                                       ["S-627-JM", "A03"])
+        db_data.cnx.commit.assert_called_once()
+
+    def test_parking_at_next_available_spot_with_constraints(self, db_connector_function):
+        db_data = DBData()
+        cursor = MagicMock()
+        cursor.__iter__.return_value = [("A25", 1)]
+        cursor.lastrowid = (1 << 32) | 1
+        db_data.cnx.cursor.return_value.__enter__.return_value = cursor
+        result = db_data.park_at_next_available_spot("S-627-JM", "0.01",
+                                                     {"level": 1, "has_ev_charger": True, "zone": None})
+        self.assertEqual("A25", result)
+        cursor.execute.assert_any_call("SELECT spot_id FROM parking_spot_data WHERE vehicle_number IS NULL "
+                                       "AND level = %s AND has_ev_charger = %s ORDER BY spot_id "
+                                       "LIMIT 1 FOR UPDATE SKIP LOCKED;", [1, True])
+
+    def test_parking_at_next_available_spot_with_occupancy_index_skips_locked_spots(self, db_connector_function):
+        occupancy = OccupancyIndex()
+        occupancy.load([("A01", None, "A", 1, "standard", 0), ("A02", None, "A", 1, "compact", 0),
+                        ("A03", None, "A", 1, "compact", 0)])
+        db_data = DBData(occupancy=occupancy)
+        cursor = MagicMock()
+        # A02 is being claimed by another request, so the database hands out A03.
+        db_data._selection_query = MagicMock(return_value=[("A03",)])
+        cursor.lastrowid = (1 << 32) | 1
         db_data.cnx.cursor.return_value.__enter__.return_value = cursor
-        db_data.park_car("A48", "S-627-JM")
-        cursor.execute.assert_called_with("UPDATE parking_spot_data SET vehicle_number = %s WHERE spot_id = %s;",
-                                          ["S-627-JM", "A48"])
+        result = db_data.park_at_next_available_spot("S-627-JM", "0.01", {"size_class": "compact"})
+        self.assertEqual("A03", result)
+        db_data._selection_query.assert_any_call(cursor, "SELECT spot_id FROM parking_spot_data WHERE vehicle_number "
+                                                         "IS NULL AND size_class = %s ORDER BY spot_id LIMIT 1 FOR "
+                                                         "UPDATE SKIP LOCKED;", ["compact"])
+        cursor.execute.assert_any_call("UPDATE parking_spot_data SET vehicle_number = %s WHERE spot_id = %s;",
+                                       ["S-627-JM", "A03"])
+        self.assertEqual(["A01", "A02"], occupancy.get_vacant_spots())
+
+    def test_parking_at_next_available_spot_full_according_to_occupancy_index(self, db_connector_function):
+        occupancy = OccupancyIndex()
+        occupancy.load([("A01", "K-452-BM", "A", 1, "standard", 0), ("A02", None, "A", 1, "compact", 0)])
+        db_data = DBData(occupancy=occupancy)
+        with self.assertRaises(parking_app.exceptions.NoSpotsAvailable):
+            db_data.park_at_next_available_spot("S-627-JM", "0.01", {"size_class": "standard"})
+        db_data.cnx.cursor.return_value.__enter__.return_value.execute.assert_not_called()
+
+    def test_parking_at_next_available_spot_invalid_constraints(self, db_connector_function):
+        db_data = DBData()
+        with self.assertRaises(parking_app.exceptions.InvalidSpotConstraints):
+            db_data.park_at_next_available_spot("S-627-JM", "0.01", {"level": "2"})
+        with self.assertRaises(parking_app.exceptions.InvalidSpotConstraints):
+            db_data.park_at_next_available_spot("S-627-JM", "0.01", {"has_ev_charger": 1})
+
+    def test_parking_at_next_available_spot_lot_full(self, db_connector_function):
+        db_data = DBData()
+        cursor = MagicMock()
+        cursor.__iter__.return_value = []
+        db_data.cnx.cursor.return_value.__enter__.return_value = cursor
+        with self.assertRaises(parking_app.exceptions.NoSpotsAvailable):
+            db_data.park_at_next_available_spot("S-627-JM", "0.01")
+        db_data.cnx.rollback.assert_called_once()
+
+    def test_parking_cars_in_bulk(self, db_connector_function):
+        db_data = DBData()
+        cursor = MagicMock()
+        db_data._selection_query = MagicMock(side_effect=[
+            [("A01", None), ("A02", "Z-810-TU"), ("A03", None), ("A04", "K-452-BM")],
+            [("S-627-JM", 16)]])
+        cursor.lastrowid = (2 << 32) | 1
+        db_data.cnx.cursor.return_value.__enter__.return_value = cursor
+        results = db_data.park_cars([
+            {"parking_spot": "A01", "license_plate": "S-627-JM", "length_of_stay": "1.00"},
+            {"parking_spot": "A02", "license_plate": "N-713-KQ", "length_of_stay": "1.00"},
+            {"parking_spot": "A03", "license_plate": "K-452-BM", "length_of_stay": "1.00"},
+            {"parking_spot": "A99", "license_plate": "Q-495-DL", "length_of_stay": "1.00"},
+            {"parking_spot": "A01", "license_plate": "L-713-KQ", "length_of_stay": "1.00"},
+            {"parking_spot": "A03", "license_plate": "L713KQ", "length_of_stay": "1.00"},
+            {"license_plate": "L-713-KQ", "length_of_stay": "1.00"}])
+        self.assertEqual("A01", results[0])
+        self.assertIsInstance(results[1], parking_app.exceptions.SpotNotAvailable)
+        self.assertIsInstance(results[2], parking_app.exceptions.VehicleAlreadyInOtherSpot)
+        self.assertIsInstance(results[3], parking_app.exceptions.InvalidSpotNumber)
+        self.assertIsInstance(results[4], parking_app.exceptions.SpotNotAvailable)
+        self.assertIsInstance(results[5], parking_app.exceptions.InvalidPlateNumber)
+        self.assertIsInstance(results[6], KeyError)
+        spot_update, history_insertion = cursor.executemany.call_args_list
+        self.assertEqual([["S-627-JM", "A01"]], spot_update.args[1])
+        self.assertEqual(["A01", "S-627-JM"], history_insertion.args[1][0][:2])
+        db_data.cnx.commit.assert_called_once()
+
+    def test_leaving_parking_spots_in_bulk(self, db_connector_function):
+        db_data = DBData()
+        cursor = MagicMock()
+        cursor.rowcount = 1
+        db_data._selection_query = MagicMock(side_effect=[
+            [("S-627-JM", "A05"), ("K-452-BM", "A60")],
+            [(datetime(2022, 11, 18, 0, 2, 45), datetime(2022, 11, 24, 11, 43, 45)),
+             (datetime(2022, 11, 18, 6, 40), datetime(2022, 11, 21, 15, 56))]])
+        cursor.lastrowid = (3 << 32) | 34
+        db_data.cnx.cursor.return_value.__enter__.return_value = cursor
+        results = db_data.leave_parking_spots([{"license_plate": "S-627-JM"}, {"license_plate": "S627JM"},
+                                               {"license_plate": "N-713-KQ"}, {"license_plate": "K-452-BM"}])
+        self.assertEqual("A05", results[0])
+        self.assertIsInstance(results[1], parking_app.exceptions.InvalidPlateNumber)
+        self.assertIsInstance(results[2], parking_app.exceptions.LicensePlateNotFound)
+        self.assertEqual("A60", results[3])
+        spot_update, history_update = cursor.executemany.call_args_list
+        self.assertEqual([["A05"], ["A60"]], spot_update.args[1])
+        self.assertEqual(["S-627-JM", "K-452-BM"], [values[1] for values in history_update.args[1]])
+        rollup_update = cursor.execute.call_args_list[-1].args
+        self.assertTrue(rollup_update[0].startswith("UPDATE occupancy_rollup"))
+        self.assertEqual([0, 2, 36, 36, 34], rollup_update[1][:5])
+        self.assertEqual(2, rollup_update[1][6])
+        db_data.cnx.commit.assert_called_once()
+
+    def test_iterating_parking_history_by_pages(self, db_connector_function):
+        db_data = DBData()
+        cursor = MagicMock()
+        cursor.fetchmany.side_effect = [[(1,), (2,)], [(3,)], [], [(4,)], []]
+        db_data.cnx.cursor.return_value.__enter__.return_value = cursor
+        result = list(db_data.iter_parking_history(page_size=3, chunk_size=2))
+        self.assertEqual([(1,), (2,), (3,), (4,)], result)
+        db_data.cnx.cursor.assert_called_with(buffered=False)
+        self.assertEqual([0, 3], cursor.execute.call_args_list[0].args[1])
+        self.assertEqual([3, 3], cursor.execute.call_args_list[1].args[1])
+        self.assertEqual(2, cursor.execute.call_count)
+
+    def test_closing_parking_history_early_reads_the_rest_of_the_page(self, db_connector_function):
+        db_data = DBData()
+        cursor = MagicMock()
+        cursor.fetchmany.side_effect = [[(1,), (2,)], [(3,)], []]
+        db_data.cnx.cursor.return_value.__enter__.return_value = cursor
+        history = db_data.iter_parking_history(page_size=3, chunk_size=2)
+        self.assertEqual((1,), next(history))
+        cursor.fetchall.assert_not_called()
+        history.close()
+        cursor.fetchall.assert_called_once_with()
+        db_data.cnx.cursor.return_value.__exit__.assert_called_once()
 
     def test_storing_parking_time(self, db_connector_function):
         db_data = DBData()
@@ -318,7 +668,8 @@ class TestDBData(TestCase):
                                    datetime(2022, 11, 22, 11, 52, 19), 0, None, 0)
         cursor.execute.assert_called_with("INSERT INTO parked_vehicles_data (spot_id, vehicle_number, arrival_time, "
                                           "selected_length_of_stay, expected_departure_time, has_left, "
-                                          "actual_departure_time, has_expired) VALUES (%s, %s, %s, %s, %s, %s, %s, %s);",
+                                          "actual_departure_time, has_expired) VALUES "
+                                          "(%s, %s, %s, %s, %s, %s, %s, %s);",
                                           ["A48", "S-627-JM", "2022-11-22 11:51:19", "00.01",
                                            "2022-11-22 11:52:19", 0, None, 0])
 
@@ -341,29 +692,227 @@ class TestDBData(TestCase):
     def test_leaving_parking_spot(self, db_connector_function):
         db_data = DBData()
         cursor = MagicMock()
-        cursor.__iter__.return_value = [("S-627-JM",)]
+        cursor.rowcount = 1
+        arrival_time = datetime.now().replace(microsecond=0) - timedelta(hours=2)
+        db_data._selection_query = MagicMock(side_effect=[[("A05",)], [(arrival_time, arrival_time +
+                                                                           timedelta(hours=1))]])
+        cursor.lastrowid = (2 << 32) | 35
         db_data.cnx.cursor.return_value.__enter__.return_value = cursor
         db_data.leave_parking_spot("S-627-JM")
-        cursor.execute.assert_called_with("UPDATE parked_vehicles_data SET has_left = 1, actual_departure_time = %s  "
-                                          "WHERE vehicle_number = %s and has_left = 0;",
-                                          [datetime.now().strftime('%Y-%m-%d %H:%M:%S'), "S-627-JM"])
+        cursor.execute.assert_any_call("UPDATE parked_vehicles_data SET has_left = 1, actual_departure_time = %s  "
+                                       "WHERE vehicle_number = %s and has_left = 0;",
+                                       [datetime.now().strftime('%Y-%m-%d %H:%M:%S'), "S-627-JM"])
+        cursor.execute.assert_any_call("UPDATE occupancy_version SET occupied = LAST_INSERT_ID(((version + 1) << 32) | "
+                                       "(occupied + %s)) & 4294967295, version = version + 1 WHERE id = 1;", [-1])
+        rollup_update = cursor.execute.call_args_list[-1].args
+        self.assertEqual([0, 1, 36, 36, 35], rollup_update[1][:5])
+        self.assertAlmostEqual(7200, rollup_update[1][5], delta=2)
+        self.assertEqual(1, rollup_update[1][6])
+
+    def test_leaving_parking_spot_already_vacated_concurrently(self, db_connector_function):
+        db_data = DBData()
+        cursor = MagicMock()
+        cursor.rowcount = 0
+        db_data._selection_query = MagicMock(return_value=[("A05",)])
+        db_data.cnx.cursor.return_value.__enter__.return_value = cursor
+        with self.assertRaises(parking_app.exceptions.LicensePlateNotFound):
+            db_data.leave_parking_spot("S-627-JM")
+        cursor.execute.assert_called_once_with("UPDATE parking_spot_data SET vehicle_number = NULL WHERE spot_id = %s "
+                                               "AND vehicle_number = %s;", ["A05", "S-627-JM"])
+        db_data.cnx.rollback.assert_called_once()
+        db_data.cnx.commit.assert_not_called()
+
+    def test_leaving_parking_spot_looks_up_plate_on_primary(self, db_connector_function):
+        replica_cnx = MagicMock()
+        db_data = DBData(read_cnx=replica_cnx)
+        cursor = MagicMock()
+        cursor.rowcount = 1
+        arrival_time = datetime.now().replace(microsecond=0) - timedelta(hours=2)
+        db_data._selection_query = MagicMock(side_effect=[[("A05",)], [(arrival_time, arrival_time +
+                                                                           timedelta(hours=1))]])
+        cursor.lastrowid = (2 << 32) | 35
+        db_data.cnx.cursor.return_value.__enter__.return_value = cursor
+        db_data.leave_parking_spot("S-627-JM")
+        replica_cnx.cursor.assert_not_called()
+
+    def test_occupancy_rollup_hour_is_inserted_when_missing(self, db_connector_function):
+        db_data = DBData()
+        cursor = MagicMock()
+        cursor.rowcount = 0
+        db_data._update_occupancy_rollup(cursor, 4, [(datetime(2022, 11, 20, 8, 15), 1, 0, 0)])
+        cursor.execute.assert_called_with("INSERT INTO occupancy_rollup (hour_start, arrivals, departures, "
+                                          "peak_occupancy, closing_occupancy, stay_seconds, overstays) VALUES "
+                                          "(%s, %s, %s, %s, %s, %s, %s);", ["2022-11-20 08:00:00", 1, 0, 5, 5, 0, 0])
+
+    def test_get_occupancy_stats(self, db_connector_function):
+        db_data = DBData()
+        cursor = MagicMock()
+        cursor.__iter__.return_value = [(datetime(2022, 11, 20, 8), 2, 1, 36, 35, 3600, 0)]
+        db_data.cnx.cursor.return_value.__enter__.return_value = cursor
+        result = db_data.get_occupancy_stats(datetime(2022, 11, 20, 8, 30), datetime(2022, 11, 20, 10))
+        self.assertEqual([(datetime(2022, 11, 20, 8), 2, 1, 36, 35, 3600, 0)], result)
+        cursor.execute.assert_called_once_with("SELECT hour_start, arrivals, departures, peak_occupancy, "
+                                               "closing_occupancy, stay_seconds, overstays FROM occupancy_rollup "
+                                               "WHERE hour_start >= %s AND hour_start < %s ORDER BY hour_start;",
+                                               ["2022-11-20 08:00:00", "2022-11-20 10:00:00"])
+
+    def test_reads_go_to_replica(self, db_connector_function):
+        replica_cnx = MagicMock()
+        db_data = DBData(read_cnx=replica_cnx)
+        cursor = MagicMock()
+        cursor.__iter__.return_value = [("A48", "S-627-JM")]
+        replica_cnx.cursor.return_value.__enter__.return_value = cursor
+        self.assertEqual({"A48": "S-627-JM"}, db_data.get_unavailable_spots_and_plates())
+        db_data.get_occupancy_stats(datetime(2022, 11, 20, 8, 30), datetime(2022, 11, 20, 10))
+        self.assertEqual(2, cursor.execute.call_count)
+        db_data.cnx.cursor.assert_not_called()
+
+    def test_occupancy_index_is_loaded_from_primary(self, db_connector_function):
+        replica_cnx = MagicMock()
+        db_data = DBData(occupancy=OccupancyIndex(), read_cnx=replica_cnx)
+        cursor = MagicMock()
+        cursor.__iter__.return_value = [(3,)]
+        db_data.cnx.cursor.return_value.__enter__.return_value = cursor
+        self.assertEqual(3, db_data.get_occupancy_version())
+        replica_cnx.cursor.assert_not_called()
+
+    def test_replication_heartbeat(self, db_connector_function):
+        replica_cnx = MagicMock()
+        db_data = DBData(read_cnx=replica_cnx)
+        cursor = MagicMock()
+        db_data.cnx.cursor.return_value.__enter__.return_value = cursor
+        replica_cursor = MagicMock()
+        replica_cursor.__iter__.return_value = [(1669110000.5,)]
+        replica_cnx.cursor.return_value.__enter__.return_value = replica_cursor
+        db_data.write_replication_heartbeat(1669110001.5)
+        cursor.execute.assert_called_once_with("UPDATE replication_heartbeat SET beat_at = %s WHERE id = 1;",
+                                               [1669110001.5])
+        db_data.cnx.commit.assert_called_once()
+        self.assertEqual(1669110000.5, db_data.get_replication_heartbeat())
 
     def test_getting_next_available_spot(self, db_connector_function):
         db_data = DBData()
         cursor = MagicMock()
-        db_data._selection_query = MagicMock(side_effect=[[], [("A48", datetime.strptime("2022-11-28 08:25:46", "%Y-%m-%d %H:%M:%S")),
-                                        ("A100", datetime.strptime("2022-11-27 17:46:00", "%Y-%m-%d %H:%M:%S"))]])
-        cursor.__iter__.return_value = [("A48", datetime.strptime("2022-11-28 08:25:46", "%Y-%m-%d %H:%M:%S")),
-                                        ("A100", datetime.strptime("2022-11-27 17:46:00", "%Y-%m-%d %H:%M:%S"))]
+        db_data._selection_query = MagicMock(side_effect=[[], [("A100",)]])
+        db_data.cnx.cursor.return_value.__enter__.return_value = cursor
+        result = db_data.get_next_available_spot()
+        db_data._selection_query.assert_called_with(cursor, "SELECT spot_id FROM parked_vehicles_data WHERE "
+                                                            "has_left = 0 ORDER BY expected_departure_time LIMIT 1;",
+                                                    None)
+        self.assertEqual("A100", result)
+
+    def test_getting_next_available_spot_with_constraints(self, db_connector_function):
+        db_data = DBData()
+        cursor = MagicMock()
+        db_data._selection_query = MagicMock(side_effect=[[], [("A50",)]])
+        db_data.cnx.cursor.return_value.__enter__.return_value = cursor
+        result = db_data.get_next_available_spot({"has_ev_charger": True})
+        db_data._selection_query.assert_called_with(cursor, "SELECT parked_vehicles_data.spot_id FROM "
+                                                            "parked_vehicles_data JOIN parking_spot_data ON "
+                                                            "parking_spot_data.spot_id = parked_vehicles_data.spot_id "
+                                                            "WHERE has_left = 0 AND "
+                                                            "parking_spot_data.has_ev_charger = %s "
+                                                            "ORDER BY expected_departure_time LIMIT 1;", [True])
+        self.assertEqual("A50", result)
+
+    def test_getting_next_available_vacant_spot(self, db_connector_function):
+        db_data = DBData()
+        cursor = MagicMock()
+        cursor.__iter__.return_value = [("A03",)]
         db_data.cnx.cursor.return_value.__enter__.return_value = cursor
         result = db_data.get_next_available_spot()
+        self.assertEqual("A03", result)
+        self.assertEqual(1, cursor.execute.call_count)
+
+    def test_getting_next_available_spot_from_occupancy_index(self, db_connector_function):
+        occupancy = OccupancyIndex()
+        occupancy.load([("A48", "S-627-JM"), ("A100", "Z-810-TU")],
+                       [("A48", datetime(2022, 11, 28, 8, 25, 46)), ("A100", datetime(2022, 11, 27, 17, 46))])
+        db_data = DBData(occupancy=occupancy)
+        result = db_data.get_next_available_spot()
+        db_data.cnx.cursor.assert_not_called()
         self.assertEqual("A100", result)
 
-    def test_check_if_stay_expired(self, db_connector_function):
+    def test_storing_parking_time_schedules_expiration(self, db_connector_function):
+        expirations = MagicMock()
+        db_data = DBData(expirations=expirations)
+        cursor = MagicMock()
+        cursor.lastrowid = 15
+        db_data.cnx.cursor.return_value.__enter__.return_value = cursor
+        result = db_data.store_parking_time("A48", "S-627-JM", datetime(2022, 11, 22, 11, 51, 19), "00.01",
+                                            datetime(2022, 11, 22, 11, 52, 19), 0, None, 0)
+        self.assertEqual(15, result)
+        expirations.schedule.assert_called_with(15, datetime(2022, 11, 22, 11, 52, 19))
+
+    def test_parking_with_write_behind_history(self, db_connector_function):
+        history_buffer = MagicMock()
+        expirations = MagicMock()
+        db_data = DBData(expirations=expirations, history_buffer=history_buffer)
+        cursor = MagicMock()
+        cursor.rowcount = 1
+        cursor.lastrowid = (1 << 32) | 37
+        db_data.cnx.cursor.return_value.__enter__.return_value = cursor
+        self.assertEqual("A48", db_data.park_car("A48", "S-627-JM", "0.01"))
+        history_buffer.reserve.assert_called_once_with(1, ["S-627-JM"])
+        self.assertNotIn("INSERT INTO parked_vehicles_data", " ".join(call.args[0] for call in
+                                                                      cursor.execute.call_args_list))
+        license_plate, values = history_buffer.add.call_args.args
+        self.assertEqual("S-627-JM", license_plate)
+        self.assertEqual(["A48", "S-627-JM"], values[:2])
+        expirations.schedule.assert_not_called()
+
+    def test_leaving_flushes_pending_history(self, db_connector_function):
+        history_buffer = MagicMock()
+        history_buffer.is_pending.return_value = True
+        db_data = DBData(history_buffer=history_buffer)
+        db_data.cnx.cursor.return_value.__enter__.return_value.rowcount = 1
+        db_data._selection_query = MagicMock(side_effect=[[("A05",)], [], [(2, 35)]])
+        db_data.leave_parking_spot("S-627-JM")
+        history_buffer.is_pending.assert_called_once_with(["S-627-JM"])
+        history_buffer.flush.assert_called_once()
+
+    def test_storing_parking_times_in_bulk(self, db_connector_function):
+        expirations = MagicMock()
+        db_data = DBData(expirations=expirations)
+        cursor = MagicMock()
+        cursor.__iter__.return_value = [(15, datetime(2022, 11, 22, 11, 52, 19))]
+        db_data.cnx.cursor.return_value.__enter__.return_value = cursor
+        db_data.store_parking_times([["A48", "S-627-JM", "2022-11-22 11:51:19", "00.01", "2022-11-22 11:52:19", 0,
+                                      None, 0],
+                                     ["A01", "Z-810-TU", "2022-11-22 10:51:19", "00.50", "2022-11-22 11:21:19", 1,
+                                      "2022-11-22 11:01:19", 0]])
+        self.assertEqual(2, len(cursor.executemany.call_args.args[1]))
+        cursor.execute.assert_called_once_with("SELECT log_id, expected_departure_time FROM parked_vehicles_data "
+                                               "WHERE vehicle_number IN (%s) AND has_left = 0 AND has_expired = 0;",
+                                               ["S-627-JM"])
+        db_data.cnx.commit.assert_called_once()
+        expirations.schedule.assert_called_once_with(15, datetime(2022, 11, 22, 11, 52, 19))
+
+    def test_get_unexpired_stays(self, db_connector_function):
+        db_data = DBData()
+        cursor = MagicMock()
+        cursor.__iter__.return_value = [(15, datetime(2022, 11, 22, 11, 52, 19))]
+        db_data.cnx.cursor.return_value.__enter__.return_value = cursor
+        result = db_data.get_unexpired_stays()
+        cursor.execute.assert_called_with("SELECT log_id, expected_departure_time FROM parked_vehicles_data "
+                                          "WHERE has_expired = 0;")
+        self.assertEqual([(15, datetime(2022, 11, 22, 11, 52, 19))], result)
+
+    def test_get_parked_vehicles_from_stays(self, db_connector_function):
+        db_data = DBData()
+        cursor = MagicMock()
+        cursor.__iter__.return_value = [("A48", "S-627-JM")]
+        db_data.cnx.cursor.return_value.__enter__.return_value = cursor
+        result = db_data.get_parked_vehicles_from_stays([3, 7])
+        cursor.execute.assert_called_once_with("SELECT spot_id, vehicle_number FROM parked_vehicles_data WHERE log_id "
+                                               "IN (%s, %s) AND has_left = 0;", [3, 7])
+        self.assertEqual([("A48", "S-627-JM")], result)
+
+    def test_expire_stays(self, db_connector_function):
         db_data = DBData()
         cursor = MagicMock()
-        cursor.__iter__.return_value = [("A48", datetime.strptime("2022-11-21 08:25:46", "%Y-%m-%d %H:%M:%S"))]
         db_data.cnx.cursor.return_value.__enter__.return_value = cursor
-        db_data.check_if_stay_expired()
-        cursor.execute.assert_called_with("UPDATE parked_vehicles_data SET has_expired = 1 WHERE spot_id = %s;",
-                                          ["A48"])
+        db_data.expire_stays([3, 7, 15])
+        cursor.execute.assert_called_once_with("UPDATE parked_vehicles_data SET has_expired = 1 "
+                                               "WHERE log_id IN (%s, %s, %s);", [3, 7, 15])
+        db_data.cnx.commit.assert_called_once()
@@ -0,0 +1,50 @@
+from unittest import TestCase
+from threading import Thread
+
+from parking_app.events import OccupancyPublisher, format_event
+
+
+class TestOccupancyPublisher(TestCase):
+
+    def setUp(self):
+        self.publisher = OccupancyPublisher(history=2, heartbeat=0.01)
+
+    def test_event_format(self):
+        self.assertEqual('id: 3\nevent: leave\ndata: {"spot":"A48","vacant_count":2}\n\n',
+                         format_event(3, "leave", {"spot": "A48", "vacant_count": 2}))
+
+    def test_new_subscriber_receives_snapshot_then_deltas(self):
+        self.publisher.publish("park", {"spot": "A01"})
+        events = self.publisher.listen(get_state=lambda: {"vacant_count": 2})
+        self.assertEqual(format_event(1, "snapshot", {"vacant_count": 2}), next(events))
+        self.assertEqual(1, self.publisher.subscribers)
+        self.publisher.publish("leave", {"spot": "A02"})
+        self.publisher.publish("park", {"spot": "A03"})
+        self.assertEqual(format_event(2, "leave", {"spot": "A02"}) + format_event(3, "park", {"spot": "A03"}),
+                         next(events))
+        events.close()
+        self.assertEqual(0, self.publisher.subscribers)
+
+    def test_heartbeat_when_nothing_happens(self):
+        events = self.publisher.listen()
+        self.assertEqual(": keep-alive\n\n", next(events))
+
+    def test_subscriber_is_woken_up_by_publish(self):
+        events = self.publisher.listen(get_state=dict)
+        next(events)
+        self.publisher.heartbeat = 5
+        Thread(target=self.publisher.publish, args=("park", {"spot": "A01"})).start()
+        self.assertEqual(format_event(1, "park", {"spot": "A01"}), next(events))
+
+    def test_reconnecting_subscriber_resumes_after_last_event_id(self):
+        self.publisher.publish("park", {"spot": "A01"})
+        self.publisher.publish("park", {"spot": "A02"})
+        events = self.publisher.listen(last_event_id=1)
+        self.assertEqual(format_event(2, "park", {"spot": "A02"}), next(events))
+
+    def test_subscriber_missing_dropped_events_is_told_to_resync(self):
+        for spot in ["A01", "A02", "A03"]:
+            self.publisher.publish("park", {"spot": spot})
+        events = self.publisher.listen(last_event_id=0, get_state=lambda: {"vacant_count": 0})
+        self.assertEqual(format_event(3, "resync", {"vacant_count": 0}), next(events))
+        self.assertEqual({"subscribers": 1, "published": 3}, self.publisher.stats())
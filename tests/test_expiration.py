@@ -0,0 +1,50 @@
+from unittest import TestCase
+from unittest.mock import MagicMock
+from datetime import datetime, timedelta
+
+from parking_app.expiration import ExpirationScheduler
+
+
+class TestExpirationScheduler(TestCase):
+
+    def setUp(self):
+        self.scheduler = MagicMock()
+        self.expire_stays = MagicMock()
+        self.expirations = ExpirationScheduler(self.scheduler, self.expire_stays)
+        self.now = datetime.now()
+
+    def test_wakes_up_at_earliest_departure(self):
+        self.expirations.load([(1, self.now + timedelta(hours=2)), (2, self.now + timedelta(hours=1))])
+        self.assertEqual(self.now + timedelta(hours=1), self.scheduler.add_job.call_args.kwargs["run_date"])
+
+    def test_earlier_stay_rearms_timer(self):
+        self.expirations.load([(1, self.now + timedelta(hours=2))])
+        self.expirations.schedule(2, self.now + timedelta(minutes=5))
+        self.assertEqual(self.now + timedelta(minutes=5), self.scheduler.add_job.call_args.kwargs["run_date"])
+        self.scheduler.add_job.reset_mock()
+        self.expirations.schedule(3, self.now + timedelta(hours=3))
+        self.scheduler.add_job.assert_not_called()
+
+    def test_due_stays_are_expired_in_one_batch(self):
+        self.expirations.load([(1, self.now - timedelta(days=1)), (2, self.now - timedelta(minutes=1)),
+                               (3, self.now + timedelta(hours=1))])
+        self.expirations._expire_due_stays()
+        self.expire_stays.assert_called_once_with([1, 2])
+        self.assertEqual(self.now + timedelta(hours=1), self.scheduler.add_job.call_args.kwargs["run_date"])
+        self.assertEqual({"pending": 1, "expired": 2, "next_run_time": self.now + timedelta(hours=1)},
+                         self.expirations.stats())
+
+    def test_failed_expiry_is_retried(self):
+        self.expire_stays.side_effect = Exception("database unavailable")
+        self.expirations.load([(1, self.now - timedelta(minutes=1))])
+        with self.assertRaises(Exception):
+            self.expirations._expire_due_stays()
+        self.assertEqual(1, self.expirations.stats()["pending"])
+        self.assertLess(self.now, self.scheduler.add_job.call_args.kwargs["run_date"])
+
+    def test_resync_keeps_already_scheduled_stays(self):
+        self.expirations.schedule(15, self.now + timedelta(hours=1))
+        self.expirations.ensure_loaded(lambda: [(14, self.now + timedelta(hours=2)),
+                                                (15, self.now + timedelta(hours=1))])
+        self.expirations.ensure_loaded(lambda: [(99, self.now)])
+        self.assertEqual(2, self.expirations.stats()["pending"])
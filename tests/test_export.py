@@ -0,0 +1,34 @@
+from unittest import TestCase
+from datetime import datetime
+import json
+
+from parking_app.export import to_ndjson, to_csv
+
+
+class TestExport(TestCase):
+
+    def setUp(self):
+        self.headers = ["log_id", "spot_id", "arrival_time"]
+        self.rows = [(1, "A01", datetime(2022, 11, 20, 2, 51, 23)), (2, "A02", datetime(2022, 11, 19, 17, 8, 45)),
+                     (3, "A04", datetime(2022, 11, 18, 17, 22, 21))]
+
+    def test_ndjson(self):
+        result = "".join(to_ndjson(self.headers, iter(self.rows), batch_size=2))
+        lines = [json.loads(line) for line in result.splitlines()]
+        self.assertEqual({"log_id": 1, "spot_id": "A01", "arrival_time": "2022-11-20 02:51:23"}, lines[0])
+        self.assertEqual(3, len(lines))
+
+    def test_ndjson_is_written_in_batches(self):
+        result = list(to_ndjson(self.headers, iter(self.rows), batch_size=2))
+        self.assertEqual(2, len(result))
+
+    def test_csv(self):
+        result = list(to_csv(self.headers, iter(self.rows), batch_size=2))
+        self.assertEqual(2, len(result))
+        lines = "".join(result).splitlines()
+        self.assertEqual("log_id,spot_id,arrival_time", lines[0])
+        self.assertEqual("3,A04,2022-11-18 17:22:21", lines[3])
+
+    def test_csv_without_rows_still_has_headers(self):
+        result = "".join(to_csv(self.headers, iter([])))
+        self.assertEqual("log_id,spot_id,arrival_time\r\n", result)
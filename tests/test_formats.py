@@ -0,0 +1,24 @@
+import gzip
+from unittest import TestCase
+
+from parking_app.formats import pack_bitmap, to_columnar, compress
+
+
+class TestFormats(TestCase):
+
+    def test_bitmap_follows_spot_order(self):
+        spots = ["A01", "A02", "A03", "A04", "A05", "A06", "A07", "A08", "A09", "A10"]
+        self.assertEqual(bytes([0b10100000, 0b01000000]), pack_bitmap(spots, ["A10", "A01", "A03"]))
+
+    def test_empty_bitmap(self):
+        self.assertEqual(bytes(2), pack_bitmap(["A01", "A02", "A03", "A04", "A05", "A06", "A07", "A08", "A09"], []))
+        self.assertEqual(b"", pack_bitmap([], []))
+
+    def test_columnar(self):
+        self.assertEqual('{"spots":["A03","A48"]}', to_columnar(["A03", "A48"]))
+        self.assertEqual('{"spots":["A03","A48"],"plates":["Z-810-TU","S-627-JM"]}',
+                         to_columnar(("A03", "A48"), ("Z-810-TU", "S-627-JM")))
+
+    def test_compression_is_deterministic(self):
+        self.assertEqual(compress('["A03", "A48"]'), compress(b'["A03", "A48"]'))
+        self.assertEqual(b'["A03", "A48"]', gzip.decompress(compress('["A03", "A48"]')))
@@ -0,0 +1,56 @@
+import os
+from unittest import TestCase
+
+from parking_app.hashing import PasswordHasher
+import parking_app.exceptions
+
+
+class TestPasswordHasher(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.hasher = PasswordHasher(workers=1, queue_depth=1, log_rounds=4)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.hasher.shutdown()
+
+    def test_hash_and_check_password(self):
+        password_hash = self.hasher.generate_password_hash("Pa55wor!")
+        self.assertTrue(password_hash.startswith("$2b$04$"))
+        self.assertTrue(self.hasher.check_password_hash(password_hash, "Pa55wor!"))
+        self.assertFalse(self.hasher.check_password_hash(password_hash, "Pa55wor?"))
+
+    def test_check_password_against_stored_bytes(self):
+        password_hash = self.hasher.generate_password_hash("Pa55wor!").encode("utf-8")
+        self.assertTrue(self.hasher.check_password_hash(password_hash, "Pa55wor!"))
+
+    def test_invalid_password_type(self):
+        with self.assertRaises(TypeError):
+            self.hasher.generate_password_hash(12345678)
+
+    def test_saturated_pool_rejects_work(self):
+        self.hasher._slots.acquire()
+        self.hasher._slots.acquire()
+        try:
+            with self.assertRaises(parking_app.exceptions.HashingPoolSaturated):
+                self.hasher.generate_password_hash("Pa55wor!")
+        finally:
+            self.hasher._slots.release()
+            self.hasher._slots.release()
+        self.assertEqual(1, self.hasher.rejected_count)
+        self.assertTrue(self.hasher.generate_password_hash("Pa55wor!"))
+
+    def test_workers_are_not_forked_from_the_application(self):
+        self.assertIn(self.hasher.executor._mp_context.get_start_method(), ("forkserver", "spawn"))
+
+    def test_broken_pool_is_replaced(self):
+        hasher = PasswordHasher(workers=1, queue_depth=1, log_rounds=4)
+        try:
+            with self.assertRaises(parking_app.exceptions.HashingPoolSaturated):
+                hasher._run(os._exit, 1)
+            self.assertEqual(1, hasher.stats()["restarted"])
+            password_hash = hasher.generate_password_hash("Pa55wor!")
+            self.assertTrue(hasher.check_password_hash(password_hash, "Pa55wor!"))
+        finally:
+            hasher.shutdown()
@@ -0,0 +1,115 @@
+from threading import Event, Thread
+from unittest import TestCase
+
+from parking_app.history import HistoryBuffer
+from parking_app.exceptions import HistoryBufferFull
+
+
+class TestHistoryBuffer(TestCase):
+
+    def setUp(self):
+        self.batches = []
+        self.written = Event()
+
+    def write_batch(self, rows):
+        self.batches.append(rows)
+        self.written.set()
+
+    def test_full_batch_is_written_at_once(self):
+        history_buffer = HistoryBuffer(self.write_batch, flush_interval=60, batch_size=2)
+        history_buffer.add("S-627-JM", ["A05", "S-627-JM"])
+        history_buffer.add("K-452-BM", ["A60", "K-452-BM"])
+        self.assertTrue(self.written.wait(5))
+        self.assertEqual([[["A05", "S-627-JM"], ["A60", "K-452-BM"]]], self.batches)
+        history_buffer.close()
+
+    def test_rows_are_written_after_the_flush_interval(self):
+        history_buffer = HistoryBuffer(self.write_batch, flush_interval=0.01, batch_size=100)
+        history_buffer.add("S-627-JM", ["A05", "S-627-JM"])
+        self.assertTrue(self.written.wait(5))
+        self.assertEqual(1, history_buffer.stats()["written"])
+        history_buffer.close()
+
+    def test_flush_waits_for_pending_rows(self):
+        history_buffer = HistoryBuffer(self.write_batch, flush_interval=60, batch_size=100)
+        history_buffer.add("S-627-JM", ["A05", "S-627-JM"])
+        self.assertTrue(history_buffer.is_pending(["N-713-KQ", "S-627-JM"]))
+        history_buffer.flush()
+        self.assertFalse(history_buffer.is_pending(["S-627-JM"]))
+        self.assertEqual([[["A05", "S-627-JM"]]], self.batches)
+        history_buffer.close()
+
+    def test_full_buffer_rejects_new_rows(self):
+        history_buffer = HistoryBuffer(self.write_batch, max_size=1, flush_interval=60, batch_size=100, timeout=0.01)
+        with history_buffer.reserve(1):
+            history_buffer.add("S-627-JM", ["A05", "S-627-JM"])
+        with self.assertRaises(HistoryBufferFull):
+            with history_buffer.reserve(1):
+                pass
+        self.assertEqual(1, history_buffer.stats()["rejected"])
+        history_buffer.flush()
+        with history_buffer.reserve(1):
+            history_buffer.add("K-452-BM", ["A60", "K-452-BM"])
+        history_buffer.close()
+
+    def test_failed_batch_is_retried(self):
+        failures = [ConnectionError()]
+
+        def write_batch(rows):
+            if failures:
+                raise failures.pop()
+            self.write_batch(rows)
+
+        history_buffer = HistoryBuffer(write_batch, flush_interval=0.01, batch_size=100, retry_delay=0.01)
+        history_buffer.add("S-627-JM", ["A05", "S-627-JM"])
+        self.assertTrue(self.written.wait(5))
+        self.assertEqual([[["A05", "S-627-JM"]]], self.batches)
+        self.assertEqual(1, history_buffer.stats()["failed_batches"])
+        history_buffer.close()
+
+    def test_batch_that_keeps_failing_is_dropped_row_by_row(self):
+        def write_batch(rows):
+            if ["A13", "BAD"] in rows:
+                raise ValueError
+            self.write_batch(rows)
+
+        history_buffer = HistoryBuffer(write_batch, flush_interval=60, batch_size=100, retry_delay=0.01,
+                                       max_attempts=2)
+        history_buffer.add("S-627-JM", ["A05", "S-627-JM"])
+        history_buffer.add("BAD", ["A13", "BAD"])
+        with self.assertLogs("parking_app.history", "ERROR"):
+            history_buffer.flush(timeout=5)
+        self.assertEqual([[["A05", "S-627-JM"]]], self.batches)
+        self.assertFalse(history_buffer.is_pending(["S-627-JM", "BAD"]))
+        self.assertEqual({"queued": 0, "written": 1, "failed_batches": 2, "rejected": 0, "dropped": 1},
+                         history_buffer.stats())
+        history_buffer.add("K-452-BM", ["A60", "K-452-BM"])
+        history_buffer.flush()
+        self.assertEqual(2, history_buffer.stats()["written"])
+        history_buffer.close()
+
+    def test_reserved_plates_are_pending_until_written(self):
+        history_buffer = HistoryBuffer(self.write_batch, flush_interval=60, batch_size=100)
+        with history_buffer.reserve(1, ["S-627-JM"]):
+            self.assertTrue(history_buffer.is_pending(["S-627-JM"]))
+        self.assertFalse(history_buffer.is_pending(["S-627-JM"]))
+        flushed = Event()
+        with history_buffer.reserve(1, ["S-627-JM"]):
+            # A leave arriving after the park committed, but before its row was added, waits for that row.
+            leave = Thread(target=lambda: (history_buffer.flush(["S-627-JM"], timeout=5), flushed.set()))
+            leave.start()
+            self.assertFalse(flushed.wait(0.05))
+            history_buffer.add("S-627-JM", ["A05", "S-627-JM"])
+        leave.join()
+        self.assertTrue(flushed.is_set())
+        self.assertEqual([[["A05", "S-627-JM"]]], self.batches)
+        history_buffer.close()
+
+    def test_closing_drains_the_buffer(self):
+        history_buffer = HistoryBuffer(self.write_batch, flush_interval=60, batch_size=2)
+        for number in range(3):
+            history_buffer.add(f"S-627-J{number}", [number])
+        history_buffer.close()
+        self.assertEqual([[0], [1], [2]], [row for batch in self.batches for row in batch])
+        self.assertEqual({"queued": 0, "written": 3, "failed_batches": 0, "rejected": 0, "dropped": 0},
+                         history_buffer.stats())
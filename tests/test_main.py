@@ -0,0 +1,302 @@
+import csv
+import gzip
+import json
+import os
+import re
+import sqlite3
+import tempfile
+from datetime import datetime, timezone, timedelta
+from unittest import TestCase
+from unittest.mock import patch
+
+from parking_app.analytics import write_report
+from parking_app.db import DBData
+from parking_app.export import parking_history_headers
+from parking_app.formats import columnar_mimetype, bitmap_mimetype
+from parking_app.sqlite_backend import SQLiteCursor, connect_to_sqlite, create_database
+
+directory = tempfile.TemporaryDirectory()
+database_path = os.path.join(directory.name, "parking_app.db")
+seeded_database_path = os.path.join(directory.name, "seeded.db")
+create_database(seeded_database_path)
+
+
+def restore_seeded_database():
+    seeded = sqlite3.connect(seeded_database_path)
+    target = sqlite3.connect(database_path)
+    seeded.backup(target)
+    seeded.close()
+    target.close()
+
+
+restore_seeded_database()
+analytics_report_path = os.path.join(directory.name, "analytics.json")
+os.environ.update(DATABASE_BACKEND="sqlite", DATABASE_PATH=database_path, SECRET_KEY="test", BCRYPT_LOG_ROUNDS="4",
+                  PASSWORD_HASHING_WORKERS="1", ANALYTICS_REPORT_PATH=analytics_report_path)
+
+from parking_app import main  # noqa: E402
+
+
+def tearDownModule():
+    directory.cleanup()
+
+
+class TestRoutes(TestCase):
+
+    def setUp(self):
+        # Every test starts from the seeded lot; the application reloads its occupancy index from it.
+        restore_seeded_database()
+        main.occupancy.loaded = False
+        self.client = main.app.test_client()
+        with self.client.session_transaction() as session:
+            session["login_success"] = True
+            session["username"] = "testuser"
+
+    def park_from_another_process(self, spot, license_plate):
+        cnx = connect_to_sqlite(database_path)
+        try:
+            DBData(cnx).park_car(spot, license_plate, "1.00")
+        finally:
+            cnx.close()
+
+    def test_unchanged_snapshot_is_not_modified(self):
+        result = self.client.get("/vacant-spots")
+        self.assertEqual(200, result.status_code)
+        etag, weak = result.get_etag()
+        self.assertFalse(weak)
+        self.assertEqual(304, self.client.get("/vacant-spots", headers={"If-None-Match": f'"{etag}"'}).status_code)
+        self.assertEqual(304, self.client.get("/vacant-spots", headers={"If-None-Match": f'W/"{etag}"'}).status_code)
+        self.assertEqual(304, self.client.get("/vacant-spots",
+                                              headers={"If-None-Match": f'"other", "{etag}"'}).status_code)
+        self.assertEqual(200, self.client.get("/vacant-spots", headers={"If-None-Match": '"other"'}).status_code)
+
+    def test_snapshot_changes_after_a_park(self):
+        etag = self.client.get("/vacant-spots").get_etag()[0]
+        self.assertEqual(200, self.client.post("/park-car", json={"parking_spot": "A03", "license_plate": "N-713-KQ",
+                                                                  "length_of_stay": "1.00"}).status_code)
+        result = self.client.get("/vacant-spots", headers={"If-None-Match": f'"{etag}"'})
+        self.assertEqual(200, result.status_code)
+        self.assertNotEqual(etag, result.get_etag()[0])
+        self.assertNotIn("A03", result.json)
+
+    def test_snapshot_changes_after_a_park_by_another_process(self):
+        etag = self.client.get("/vacant-spots").get_etag()[0]
+        self.park_from_another_process("A03", "N-713-KQ")
+        result = self.client.get("/vacant-spots", headers={"If-None-Match": f'"{etag}"'})
+        self.assertEqual(200, result.status_code)
+        self.assertNotEqual(etag, result.get_etag()[0])
+        self.assertNotIn("A03", result.json)
+
+    def test_snapshot_etag_depends_on_format_and_encoding(self):
+        representations = [{}, {"Accept": columnar_mimetype}, {"Accept-Encoding": "gzip"},
+                           {"Accept": columnar_mimetype, "Accept-Encoding": "gzip"}]
+        etags = [self.client.get("/vacant-spots", headers=headers).get_etag()[0] for headers in representations]
+        self.assertEqual(len(representations), len(set(etags)))
+        result = self.client.get("/vacant-spots", headers={"Accept": columnar_mimetype,
+                                                           "If-None-Match": f'"{etags[0]}"'})
+        self.assertEqual(200, result.status_code)
+
+    def set_all_plates(self, plate):
+        cnx = sqlite3.connect(database_path)
+        cnx.execute(f"UPDATE parking_spot_data SET vehicle_number = {plate};")
+        cnx.commit()
+        cnx.close()
+
+    def get_bitmap_spots(self, route):
+        result = self.client.get(route, headers={"Accept": bitmap_mimetype})
+        self.assertEqual(200, result.status_code)
+        self.assertEqual(bitmap_mimetype, result.mimetype)
+        spots = self.client.get("/spots").json
+        self.assertEqual((len(spots) + 7) // 8, len(result.data))
+        return [spot for position, spot in enumerate(spots) if result.data[position >> 3] & 0x80 >> (position & 7)]
+
+    def test_vacant_spots_formats(self):
+        vacant_spots = self.client.get("/vacant-spots").json
+        self.assertIn("A03", vacant_spots)
+        result = self.client.get("/vacant-spots", headers={"Accept": columnar_mimetype})
+        self.assertEqual(columnar_mimetype, result.mimetype)
+        self.assertEqual({"spots": vacant_spots}, json.loads(result.data))
+        self.assertEqual(vacant_spots, self.get_bitmap_spots("/vacant-spots"))
+
+    def test_unavailable_spots_formats(self):
+        unavailable_spots = self.client.get("/unavailable-spots").json
+        self.assertEqual("S-627-JM", unavailable_spots["A05"])
+        result = self.client.get("/unavailable-spots", headers={"Accept": columnar_mimetype})
+        columns = json.loads(result.data)
+        self.assertEqual(unavailable_spots, dict(zip(columns["spots"], columns["plates"])))
+        self.assertEqual(sorted(unavailable_spots), self.get_bitmap_spots("/unavailable-spots"))
+
+    def test_compressed_formats(self):
+        for accept in ("application/json", columnar_mimetype, bitmap_mimetype):
+            plain = self.client.get("/unavailable-spots", headers={"Accept": accept})
+            result = self.client.get("/unavailable-spots", headers={"Accept": accept, "Accept-Encoding": "gzip"})
+            self.assertEqual("gzip", result.headers["Content-Encoding"])
+            self.assertLessEqual({"accept", "accept-encoding"}, {value.lower() for value in result.vary})
+            self.assertEqual(plain.data, gzip.decompress(result.data))
+            self.assertNotIn("Content-Encoding", plain.headers)
+
+    def test_bitmaps_of_a_full_lot(self):
+        self.set_all_plates("'P-' || spot_id")
+        self.assertEqual(404, self.client.get("/vacant-spots").status_code)
+        self.assertEqual([], self.get_bitmap_spots("/vacant-spots"))
+        self.assertEqual(self.client.get("/spots").json, self.get_bitmap_spots("/unavailable-spots"))
+
+    def test_bitmaps_of_an_empty_lot(self):
+        self.set_all_plates("NULL")
+        self.assertEqual(404, self.client.get("/unavailable-spots").status_code)
+        self.assertEqual([], self.get_bitmap_spots("/unavailable-spots"))
+        self.assertEqual(self.client.get("/spots").json, self.get_bitmap_spots("/vacant-spots"))
+
+    def test_parking_a_mixed_batch(self):
+        result = self.client.post("/park-cars", json=[
+            {"parking_spot": "A03", "license_plate": "N-713-KQ", "length_of_stay": "1.00"},
+            {"parking_spot": "A08", "license_plate": "N-713-KQ", "length_of_stay": "1.00"},
+            {"parking_spot": "A05", "license_plate": "Q-495-DL", "length_of_stay": "1.00"},
+            {"parking_spot": "A12", "license_plate": "Q495DL", "length_of_stay": "1.00"},
+            {"parking_spot": "A08", "license_plate": "Q-495-DL"},
+            {"parking_spot": "A08", "license_plate": "Q-495-DL", "length_of_stay": "1.00"}])
+        self.assertEqual(200, result.status_code)
+        self.assertEqual([
+            {"status": 200, "message": "A03"},
+            {"status": 403, "message": "This license plate is already linked to another parking spot currently in "
+                                       "use."},
+            {"status": 403, "message": "The selected spot is currently not available."},
+            {"status": 400, "message": "This is not a valid license plate number."},
+            {"status": 400, "message": "Missing data."},
+            {"status": 200, "message": "A08"}], result.json)
+        unavailable_spots = self.client.get("/unavailable-spots").json
+        self.assertEqual(("N-713-KQ", "Q-495-DL", "S-627-JM"),
+                         (unavailable_spots["A03"], unavailable_spots["A08"], unavailable_spots["A05"]))
+        self.assertNotIn("A12", unavailable_spots)
+
+    def test_leaving_a_mixed_batch(self):
+        self.client.post("/park-car", json={"parking_spot": "A03", "license_plate": "N-713-KQ",
+                                            "length_of_stay": "1.00"})
+        result = self.client.post("/leave-parking-spots", json=[
+            {"license_plate": "N-713-KQ"}, {"license_plate": "N-713-KQ"}, {"license_plate": "Q-495-DL"},
+            {"license_plate": "Q495DL"}, {}, {"license_plate": "S-627-JM"}])
+        self.assertEqual(200, result.status_code)
+        not_parked = "There are no vehicles with this license plate number currently parked in the parking lot."
+        self.assertEqual([
+            {"status": 200, "message": "Parking spot now available."},
+            {"status": 404, "message": not_parked},
+            {"status": 404, "message": not_parked},
+            {"status": 400, "message": "This is not a valid license plate number."},
+            {"status": 400, "message": "Missing data."},
+            {"status": 200, "message": "Parking spot now available."}], result.json)
+        vacant_spots = self.client.get("/vacant-spots").json
+        self.assertIn("A03", vacant_spots)
+        self.assertIn("A05", vacant_spots)
+        for license_plate in ("N-713-KQ", "S-627-JM"):
+            self.assertEqual(404, self.client.post("/search-license-plate",
+                                                   json={"license_plate": license_plate}).status_code)
+
+    def add_history(self, count):
+        cnx = sqlite3.connect(database_path)
+        cnx.executemany("INSERT INTO parked_vehicles_data (spot_id, vehicle_number, arrival_time, "
+                        "selected_length_of_stay, expected_departure_time, has_left, actual_departure_time, "
+                        "has_expired) VALUES ('A03', 'N-713-KQ', '2022-11-20 08:00:00', 1.0, '2022-11-20 09:00:00', 1, "
+                        "'2022-11-20 08:30:00', 0);", [()] * count)
+        cnx.commit()
+        cnx.close()
+
+    def test_exporting_history_as_ndjson_across_pages(self):
+        self.add_history(20)
+        with patch.object(DBData.iter_parking_history, "__defaults__", (10, 3)):
+            result = self.client.get("/parking-history/export")
+        self.assertEqual(200, result.status_code)
+        self.assertEqual("application/x-ndjson", result.mimetype)
+        self.assertEqual("attachment; filename=parking_history.ndjson", result.headers["Content-Disposition"])
+        rows = [json.loads(line) for line in result.data.decode().splitlines()]
+        self.assertEqual(list(range(1, 57)), [row["log_id"] for row in rows])
+        self.assertEqual(parking_history_headers, list(rows[0]))
+        self.assertEqual(("N-713-KQ", "2022-11-20 08:30:00", 1),
+                         (rows[-1]["vehicle_number"], rows[-1]["actual_departure_time"], rows[-1]["has_left"]))
+
+    def test_exporting_history_as_csv_across_pages(self):
+        self.add_history(20)
+        with patch.object(DBData.iter_parking_history, "__defaults__", (10, 3)):
+            result = self.client.get("/parking-history/export", query_string={"format": "csv"})
+        self.assertEqual(200, result.status_code)
+        self.assertEqual("text/csv", result.mimetype)
+        rows = list(csv.reader(result.data.decode().splitlines()))
+        self.assertEqual(parking_history_headers, rows[0])
+        self.assertEqual([str(log_id) for log_id in range(1, 57)], [row[0] for row in rows[1:]])
+        self.assertEqual(["A03", "N-713-KQ", "2022-11-20 08:00:00"], rows[-1][1:4])
+
+    def test_exporting_history_in_an_unknown_format(self):
+        result = self.client.get("/parking-history/export", query_string={"format": "xml"})
+        self.assertEqual(400, result.status_code)
+
+    def test_closing_an_export_early_keeps_the_connection(self):
+        self.add_history(2000)
+        opened = main.pool.stats()["opened"]
+        with patch.object(SQLiteCursor, "fetchall", autospec=True, side_effect=SQLiteCursor.fetchall) as fetchall:
+            result = self.client.get("/parking-history/export", buffered=False)
+            self.assertEqual(500, next(iter(result.response)).count(b"\n"))
+            result.close()
+        fetchall.assert_called_once()
+        self.assertEqual({"opened": opened, "in_use": 0},
+                         {name: main.pool.stats()[name] for name in ("opened", "in_use")})
+        self.assertEqual(200, self.client.get("/parking-history/export").status_code)
+
+    def test_analytics_report_is_read_from_its_file(self):
+        if os.path.exists(analytics_report_path):
+            os.remove(analytics_report_path)
+        self.assertEqual(503, self.client.get("/analytics").status_code)
+        write_report({"stays": 1, "generated_at": "2022-11-20T08:00:00"}, analytics_report_path)
+        self.assertEqual({"stays": 1, "generated_at": "2022-11-20T08:00:00"}, self.client.get("/analytics").json)
+        write_report({"stays": 2, "generated_at": "2022-11-20T08:05:00"}, analytics_report_path)
+        os.utime(analytics_report_path, ns=(0, 10 ** 18))
+        self.assertEqual(2, self.client.get("/analytics").json["stays"])
+        self.assertEqual(403, main.app.test_client().get("/analytics").status_code)
+
+    def test_analytics_report_is_built_in_process_without_a_file(self):
+        with patch.object(main, "analytics_report_path", None), patch.dict(main.latest_analytics, clear=True):
+            self.assertEqual(503, self.client.get("/analytics").status_code)
+            main.refresh_analytics()
+            report = self.client.get("/analytics").json
+        self.assertEqual(36, report["stays"])
+        self.assertIn("A05", report["by_spot"])
+        self.assertIn("generated_at", report)
+
+    def test_metrics_are_scraped_without_logging_in(self):
+        self.assertEqual(200, self.client.get("/vacant-spots").status_code)
+        result = main.app.test_client().get("/metrics")
+        self.assertEqual(200, result.status_code)
+        self.assertEqual("text/plain; version=0.0.4; charset=utf-8", result.content_type)
+        sample_format = re.compile(r'^([a-zA-Z_:][\w:]*)(?:\{((?:\w+="(?:[^"\\]|\\.)*",?)*)\})? (\S+)$')
+        types = {}
+        samples = {}
+        for line in result.data.decode().splitlines():
+            if line.startswith("# HELP "):
+                continue
+            if line.startswith("# TYPE "):
+                name, metric_type = line[len("# TYPE "):].split(" ")
+                self.assertIn(metric_type, ("counter", "gauge", "histogram"))
+                types[name] = metric_type
+                continue
+            name, labels, value = sample_format.match(line).groups()
+            family = re.sub(r"_(bucket|sum|count)$", "", name) if name not in types else name
+            self.assertIn(family, types)
+            samples[name, labels] = float(value)
+        self.assertEqual("histogram", types["parking_app_request_duration_seconds"])
+        self.assertGreaterEqual(samples["parking_app_request_duration_seconds_count",
+                                        'endpoint="/vacant-spots",status="200"'], 1)
+        self.assertEqual(samples["parking_app_request_queries_count", 'endpoint="/vacant-spots"'],
+                         samples["parking_app_request_queries_bucket", 'endpoint="/vacant-spots",le="+Inf"'])
+
+    def test_occupancy_stats_with_an_offset_and_a_default_end(self):
+        result = self.client.get("/occupancy-stats", query_string={"from": "2022-11-20T08:00:00Z"})
+        self.assertEqual(200, result.status_code)
+        start = datetime(2022, 11, 20, 8, tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+        self.assertEqual(start.isoformat(), result.json["from"])
+
+    def test_occupancy_stats_with_offsets_are_in_local_time(self):
+        result = self.client.get("/occupancy-stats", query_string={"from": "2022-11-20T08:00:00+05:00",
+                                                                   "to": "2022-11-20T10:00:00+05:00"})
+        self.assertEqual(200, result.status_code)
+        offset = timezone(timedelta(hours=5))
+        for name, hour in (("from", 8), ("to", 10)):
+            moment = datetime(2022, 11, 20, hour, tzinfo=offset).astimezone().replace(tzinfo=None)
+            self.assertEqual(moment.isoformat(), result.json[name])
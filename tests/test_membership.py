@@ -0,0 +1,45 @@
+from threading import Event, Thread
+from unittest import TestCase
+
+from parking_app.membership import BloomFilter
+
+
+class TestBloomFilter(TestCase):
+
+    def test_added_keys_are_members(self):
+        bloom_filter = BloomFilter(capacity=1000)
+        keys = [f"username:user{index}" for index in range(1000)]
+        bloom_filter.load(keys)
+        self.assertTrue(all(key in bloom_filter for key in keys))
+
+    def test_false_positive_rate_is_bounded(self):
+        bloom_filter = BloomFilter(capacity=1000, error_rate=0.01)
+        bloom_filter.load(f"username:user{index}" for index in range(1000))
+        false_positives = sum(f"username:other{index}" in bloom_filter for index in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_empty_filter(self):
+        bloom_filter = BloomFilter(capacity=10)
+        self.assertNotIn("username:beethoven01", bloom_filter)
+
+    def test_ensure_loaded_only_loads_once(self):
+        bloom_filter = BloomFilter(capacity=10)
+        bloom_filter.ensure_loaded(lambda: ["username:beethoven01"])
+        bloom_filter.ensure_loaded(lambda: ["username:mozart02"])
+        self.assertIn("username:beethoven01", bloom_filter)
+        self.assertNotIn("username:mozart02", bloom_filter)
+
+    def test_add_waits_for_a_load_in_progress(self):
+        bloom_filter = BloomFilter(capacity=10)
+        added = Event()
+        adder = Thread(target=lambda: (bloom_filter.add("username:mozart02"), added.set()))
+
+        def load_keys():
+            yield "username:beethoven01"
+            adder.start()
+            self.assertFalse(added.wait(0.05))
+
+        bloom_filter.load(load_keys())
+        adder.join()
+        self.assertIn("username:beethoven01", bloom_filter)
+        self.assertIn("username:mozart02", bloom_filter)
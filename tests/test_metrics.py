@@ -0,0 +1,42 @@
+from unittest import TestCase
+from time import perf_counter
+
+from parking_app.metrics import Histogram, QueryRecorder, RequestMetrics, render_samples
+
+
+class TestMetrics(TestCase):
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram("queries", "Queries per request.", (1, 5), ("endpoint",))
+        for value in [0, 1, 3, 7]:
+            histogram.observe(value, "/park-car")
+        self.assertEqual(["# HELP queries Queries per request.",
+                          "# TYPE queries histogram",
+                          'queries_bucket{endpoint="/park-car",le="1"} 2',
+                          'queries_bucket{endpoint="/park-car",le="5"} 3',
+                          'queries_bucket{endpoint="/park-car",le="+Inf"} 4',
+                          'queries_sum{endpoint="/park-car"} 11',
+                          'queries_count{endpoint="/park-car"} 4'], histogram.render())
+
+    def test_samples_escape_label_values(self):
+        result = render_samples("requests", "Requests.", "counter", [({"path": 'say "hi"\\'}, 2), ({}, 0.5)])
+        self.assertEqual(['# HELP requests Requests.', '# TYPE requests counter',
+                          'requests{path="say \\"hi\\"\\\\"} 2', 'requests 0.5'], result)
+
+    def test_query_recorder(self):
+        recorder = QueryRecorder()
+        recorder.record(perf_counter(), 3)
+        recorder.record(perf_counter(), 2, queries=0)
+        self.assertEqual((1, 5), (recorder.queries, recorder.rows))
+        recorder.reset()
+        self.assertEqual((0, 0, 0.0), (recorder.queries, recorder.rows, recorder.db_time))
+
+    def test_request_metrics(self):
+        metrics = RequestMetrics()
+        recorder = QueryRecorder()
+        recorder.record(perf_counter(), 1)
+        metrics.observe("/park-car", 200, 0.004, recorder)
+        result = "\n".join(metrics.render())
+        self.assertIn('parking_app_request_duration_seconds_count{endpoint="/park-car",status="200"} 1', result)
+        self.assertIn('parking_app_request_queries_sum{endpoint="/park-car"} 1', result)
+        self.assertIn('parking_app_request_rows_bucket{endpoint="/park-car",le="0"} 0', result)
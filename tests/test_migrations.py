@@ -0,0 +1,201 @@
+import os
+import re
+import sqlite3
+import tempfile
+from datetime import datetime, timedelta
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from parking_app.db import DBData, DBUsers
+from parking_app.migrations import create_index, get_applied_versions, migrate, migrations
+from parking_app.sqlite_backend import connect_to_sqlite, create_database, schema_script_path, seed_script_path
+
+# Statements that read a whole table on purpose: loading the in-process indexes, listing every occupied spot and
+# rebuilding the rollup all need every row.
+whole_table_reads = frozenset([
+    "SELECT spot_id, vehicle_number, zone, level, size_class, has_ev_charger FROM parking_spot_data;",
+    "SELECT spot_id, vehicle_number FROM parking_spot_data WHERE vehicle_number IS NOT NULL ORDER BY spot_id;",
+    "SELECT spot_id FROM parking_spot_data ORDER BY spot_id;",
+    "DELETE FROM occupancy_rollup;",
+])
+
+# The schema the application was first released with, as the SQLite backend would have created it.
+baseline_schema = """
+CREATE TABLE login_data (
+  user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+  username VARCHAR(255) NOT NULL COLLATE NOCASE UNIQUE,
+  email_address VARCHAR(255) NOT NULL COLLATE NOCASE UNIQUE,
+  password VARCHAR(255) NOT NULL
+);
+CREATE TABLE parking_spot_data (
+  spot_id VARCHAR(45) NOT NULL PRIMARY KEY,
+  vehicle_number VARCHAR(100) DEFAULT NULL UNIQUE
+);
+CREATE TABLE parked_vehicles_data (
+  log_id INTEGER PRIMARY KEY AUTOINCREMENT,
+  spot_id VARCHAR(45) NOT NULL REFERENCES parking_spot_data (spot_id),
+  vehicle_number VARCHAR(100) NOT NULL,
+  arrival_time DATETIME NOT NULL,
+  selected_length_of_stay FLOAT NOT NULL,
+  expected_departure_time DATETIME NOT NULL,
+  has_left TINYINT NOT NULL,
+  actual_departure_time DATETIME DEFAULT NULL,
+  has_expired TINYINT NOT NULL
+);
+CREATE INDEX vehicle_number_idx ON parked_vehicles_data (vehicle_number);
+INSERT INTO parking_spot_data (spot_id, vehicle_number) VALUES ('A01', 'Z-810-TU'), ('A02', NULL), ('A03', NULL);
+INSERT INTO parked_vehicles_data (spot_id, vehicle_number, arrival_time, selected_length_of_stay,
+  expected_departure_time, has_left, actual_departure_time, has_expired) VALUES
+  ('A01', 'Z-810-TU', '2022-11-20 08:10:00', 2.0, '2022-11-20 10:10:00', 0, NULL, 0),
+  ('A02', 'U-462-HB', '2022-11-20 08:20:00', 1.0, '2022-11-20 09:20:00', 1, '2022-11-20 09:00:00', 0);
+"""
+
+
+class TestMigrations(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "parking_app.db")
+        create_database(self.path)
+        self.cnx = connect_to_sqlite(self.path)
+
+    def tearDown(self):
+        self.cnx.close()
+        self.directory.cleanup()
+
+    def _index_names(self):
+        return {name for name, in self.cnx.cnx.execute("SELECT name FROM sqlite_master WHERE type = 'index' "
+                                                        "AND tbl_name = 'parked_vehicles_data';")}
+
+    def test_new_database_is_migrated(self):
+        self.assertEqual([version for version, description, steps in migrations], get_applied_versions(self.cnx))
+        self.assertEqual({"has_left_departure_idx", "has_expired_departure_idx", "vehicle_number_has_left_idx",
+                          "spot_id_idx"}, self._index_names())
+        self.assertEqual([], migrate(self.cnx, "sqlite"))
+
+    def test_schema_scripts_match_the_migrations(self):
+        path = os.path.join(self.directory.name, "script.db")
+        cnx = sqlite3.connect(path)
+        with open(schema_script_path) as schema_file:
+            cnx.executescript(schema_file.read())
+        script_indexes = {name for name, in cnx.execute("SELECT name FROM sqlite_master WHERE type = 'index' "
+                                                        "AND tbl_name = 'parked_vehicles_data';")}
+        cnx.close()
+        self.assertEqual(self._index_names(), script_indexes)
+        with open(seed_script_path) as mysql_script_file:
+            mysql_script = mysql_script_file.read()
+        table = re.search(r"CREATE TABLE `parked_vehicles_data` \((.*?)\n\)", mysql_script, re.DOTALL).group(1)
+        self.assertEqual(self._index_names(), set(re.findall(r"^  KEY `(\w+)`", table, re.MULTILINE)))
+        self.assertNotIn("INVISIBLE", mysql_script)
+
+    def test_migrations_are_idempotent(self):
+        # A migration interrupted after creating its index, but before being recorded, runs again cleanly.
+        self.cnx.cnx.execute("DELETE FROM schema_migrations WHERE version >= 3;")
+        self.assertEqual([3, 4, 5, 6, 7, 8], migrate(self.cnx, "sqlite"))
+        self.assertNotIn("vehicle_number_idx", self._index_names())
+        extra_migration = (9, "Index arrivals", [create_index("parked_vehicles_data", "arrival_idx", ["arrival_time"])])
+        self.assertEqual([9], migrate(self.cnx, "sqlite", migrations + [extra_migration]))
+        self.assertIn("arrival_idx", self._index_names())
+        self.assertEqual([], migrate(self.cnx, "sqlite", migrations + [extra_migration]))
+
+    def test_baseline_database_is_upgraded(self):
+        path = os.path.join(self.directory.name, "baseline.db")
+        cnx = sqlite3.connect(path)
+        cnx.executescript(baseline_schema)
+        cnx.close()
+        cnx = connect_to_sqlite(path)
+        self.assertEqual([version for version, description, steps in migrations], migrate(cnx, "sqlite"))
+        db_data = DBData(cnx)
+        self.assertEqual([("A01", "Z-810-TU", "A", 0, "standard", 0)], db_data.get_spots_and_plates()[:1])
+        self.assertEqual((0, 1), (db_data.get_occupancy_version(),
+                                  cnx.cnx.execute("SELECT occupied FROM occupancy_version;").fetchone()[0]))
+        stats = db_data.get_occupancy_stats(datetime(2022, 11, 20), datetime(2022, 11, 21))
+        self.assertEqual((datetime(2022, 11, 20, 8), 2, 0, 2, 2), stats[0][:5])
+        self.assertEqual((datetime(2022, 11, 20, 9), 0, 1, 2, 1), stats[1][:5])
+        self.assertEqual(0, db_data.get_replication_heartbeat())
+        self.assertEqual("A02", db_data.park_at_next_available_spot("N-713-KQ", "1.00", {"level": 0}))
+        db_data.leave_parking_spot("Z-810-TU")
+        self.assertEqual(2, db_data.get_occupancy_version())
+        self.assertEqual([], migrate(cnx, "sqlite"))
+        cnx.close()
+
+    def test_queries_do_not_scan_whole_tables(self):
+        statements = []
+        self.cnx.cnx.set_trace_callback(statements.append)
+        db_users = DBUsers(self.cnx)
+        db_users.create_user("johndoe", "johndoe@example.com", "hashed")
+        db_users.check_if_already_registered("janedoe", "janedoe@example.com")
+        db_users.get_user_data_from_username("johndoe")
+        db_data = DBData(self.cnx)
+        db_data.get_spots()
+        db_data.get_spots_and_plates()
+        db_data.get_occupancy_version()
+        db_data.write_replication_heartbeat(1.0)
+        db_data.get_replication_heartbeat()
+        db_data.get_vacant_spots()
+        db_data.get_vacant_spots_count()
+        db_data.get_unavailable_spots_and_plates()
+        db_data.get_spot_from_plate("S-627-JM")
+        db_data.get_expected_departures()
+        db_data.park_car("A03", "N-713-KQ", "1.00")
+        db_data.park_at_next_available_spot("Q-495-DL", "1.00", {"level": 1})
+        db_data.park_cars([{"parking_spot": "A08", "license_plate": "K-452-BM", "length_of_stay": "1.00"}])
+        db_data.leave_parking_spot("N-713-KQ")
+        db_data.leave_parking_spots([{"license_plate": "K-452-BM"}])
+        for constraints in (None, {"level": 1}):
+            db_data.get_next_available_spot(constraints)
+        stays = db_data.get_unexpired_stays()
+        db_data.get_parked_vehicles_from_stays([log_id for log_id, expected_departure_time in stays])
+        db_data.expire_stays([stays[0][0]])
+        db_data.get_occupancy_stats(datetime(2022, 1, 1), datetime.now() + timedelta(hours=1))
+        list(db_data.iter_parking_history(page_size=10))
+        db_data.rebuild_occupancy_rollup()
+        self.cnx.cnx.set_trace_callback(None)
+        queries = [statement for statement in statements if statement.split(None, 1)[0] in ("SELECT", "UPDATE",
+                                                                                             "DELETE", "INSERT")]
+        self.assertGreater(len(queries), 30)
+        for query in queries:
+            if query in whole_table_reads:
+                continue
+            plan = [row[3] for row in self.cnx.cnx.execute(f"EXPLAIN QUERY PLAN {query}")]
+            scans = [step for step in plan if step.startswith("SCAN ")]
+            self.assertEqual([], scans, query)
+
+
+class TestMySQLMigrations(TestCase):
+
+    def setUp(self):
+        self.cnx = MagicMock()
+        self.cursor = self.cnx.cursor.return_value.__enter__.return_value
+
+    def test_index_migrations(self):
+        self.cursor.__iter__.return_value = [(version,) for version in range(1, 7)]
+        # vehicle_number_has_left_idx does not exist yet, vehicle_number_idx still does.
+        self.cursor.fetchall.side_effect = [[(0,)], [(1,)]]
+        self.assertEqual([7, 8], migrate(self.cnx, "mysql"))
+        statements = [call.args[0] for call in self.cursor.execute.call_args_list]
+        self.assertEqual(["SELECT COUNT(*) FROM information_schema.statistics WHERE table_schema = DATABASE() "
+                          "AND table_name = %s AND index_name = %s;",
+                          "CREATE INDEX vehicle_number_has_left_idx ON parked_vehicles_data "
+                          "(vehicle_number, has_left);",
+                          "SELECT COUNT(*) FROM information_schema.statistics WHERE table_schema = DATABASE() "
+                          "AND table_name = %s AND index_name = %s;",
+                          "DROP INDEX vehicle_number_idx ON parked_vehicles_data;",
+                          "INSERT INTO schema_migrations (version, description, applied_at) VALUES (%s, %s, %s);",
+                          "ALTER TABLE parked_vehicles_data ALTER INDEX spot_id_idx VISIBLE;",
+                          "INSERT INTO schema_migrations (version, description, applied_at) VALUES (%s, %s, %s);"],
+                         statements[2:])
+        self.assertEqual(["parked_vehicles_data", "vehicle_number_has_left_idx"],
+                         self.cursor.execute.call_args_list[2].args[1])
+        self.assertEqual(2, self.cnx.commit.call_count)
+
+    def test_spot_attribute_migration_skips_existing_columns(self):
+        self.cursor.__iter__.return_value = [(1,)] + [(version,) for version in range(3, 9)]
+        self.cursor.fetchall.side_effect = [[(1,)], [(0,)], [(0,)], [(1,)]]
+        self.assertEqual([2], migrate(self.cnx, "mysql"))
+        statements = [call.args[0] for call in self.cursor.execute.call_args_list]
+        self.assertEqual(["ALTER TABLE parking_spot_data ADD COLUMN level INT NOT NULL DEFAULT 0;",
+                          "ALTER TABLE parking_spot_data ADD COLUMN size_class VARCHAR(20) NOT NULL DEFAULT "
+                          "'standard';"], [statement for statement in statements if statement.startswith("ALTER")])
+        self.assertIn("SELECT COUNT(*) FROM information_schema.columns WHERE table_schema = DATABASE() AND "
+                      "table_name = %s AND column_name = %s;", statements)
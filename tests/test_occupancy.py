@@ -0,0 +1,150 @@
+from unittest import TestCase
+from datetime import datetime, timedelta
+
+from parking_app.occupancy import OccupancyIndex
+import parking_app.exceptions
+
+
+class TestOccupancyIndex(TestCase):
+
+    def setUp(self):
+        self.occupancy = OccupancyIndex()
+        self.occupancy.load([("A03", None), ("A01", "Z-810-TU"), ("A02", None), ("A100", "S-627-JM")])
+
+    def test_vacant_spots_are_ordered(self):
+        self.assertEqual(["A02", "A03"], self.occupancy.get_vacant_spots())
+        self.assertEqual(2, self.occupancy.get_vacant_spots_count())
+
+    def test_spots_are_in_canonical_order(self):
+        self.occupancy.park("A02", "N-713-KQ")
+        self.assertEqual(["A01", "A02", "A03", "A100"], self.occupancy.get_spots())
+
+    def test_unavailable_spots_and_plates(self):
+        result = self.occupancy.get_unavailable_spots_and_plates()
+        self.assertEqual({"A01": "Z-810-TU", "A100": "S-627-JM"}, result)
+        self.assertEqual(["A01", "A100"], list(result))
+
+    def test_spot_from_plate(self):
+        self.assertEqual("A100", self.occupancy.get_spot_from_plate("S-627-JM"))
+        with self.assertRaises(parking_app.exceptions.LicensePlateNotFound):
+            self.occupancy.get_spot_from_plate("Q-810-TU")
+
+    def test_park_and_leave_keep_maps_in_sync(self):
+        self.occupancy.park("A02", "N-713-KQ")
+        self.assertEqual(["A03"], self.occupancy.get_vacant_spots())
+        self.assertEqual("A02", self.occupancy.get_spot_from_plate("N-713-KQ"))
+        self.assertEqual("A02", self.occupancy.leave("N-713-KQ"))
+        self.assertEqual(["A02", "A03"], self.occupancy.get_vacant_spots())
+        self.assertIsNone(self.occupancy.leave("N-713-KQ"))
+
+    def test_no_vacant_spots(self):
+        self.occupancy.park("A02", "N-713-KQ")
+        self.occupancy.park("A03", "Q-495-DL")
+        self.assertEqual(0, self.occupancy.get_vacant_spots_count())
+        with self.assertRaises(parking_app.exceptions.NoSpotsAvailable):
+            self.occupancy.get_vacant_spots()
+
+    def test_all_spots_available(self):
+        self.occupancy.leave("Z-810-TU")
+        self.occupancy.leave("S-627-JM")
+        with self.assertRaises(parking_app.exceptions.AllSpotsAvailable):
+            self.occupancy.get_unavailable_spots_and_plates()
+
+    def test_ensure_current_only_reloads_for_newer_versions(self):
+        occupancy = OccupancyIndex()
+        calls = []
+        occupancy.ensure_current(1, lambda: calls.append(1) or ([("A01", None)], []))
+        occupancy.ensure_current(1, lambda: calls.append(1) or ([("A01", None)], []))
+        self.assertEqual(1, len(calls))
+        self.assertTrue(occupancy.has_spot("A01"))
+        occupancy.ensure_current(2, lambda: calls.append(1) or ([("A02", None)], []))
+        self.assertEqual(2, len(calls))
+        self.assertEqual(2, occupancy.version)
+        self.assertFalse(occupancy.has_spot("A01"))
+
+    def test_apply_changes_of_the_next_version(self):
+        self.occupancy.apply(1, parked=[("A02", "N-713-KQ", datetime(2022, 11, 29))], left=["Z-810-TU"])
+        self.assertEqual(1, self.occupancy.version)
+        self.assertEqual(["A01", "A03"], self.occupancy.get_vacant_spots())
+        self.assertEqual(("A02", datetime(2022, 11, 29)), self.occupancy.get_next_departure())
+        self.occupancy.apply(1, left=["N-713-KQ"])
+        self.assertEqual("A02", self.occupancy.get_spot_from_plate("N-713-KQ"))
+
+    def test_apply_after_missed_versions_forces_reload(self):
+        self.occupancy.apply(3, left=["Z-810-TU"])
+        self.assertFalse(self.occupancy.loaded)
+        self.assertEqual("A01", self.occupancy.get_spot_from_plate("Z-810-TU"))
+
+    def test_snapshots_are_cached_per_version(self):
+        renders = []
+
+        def render():
+            renders.append(1)
+            return str(self.occupancy.get_vacant_spots())
+
+        self.assertEqual((0, "['A02', 'A03']"), self.occupancy.get_snapshot("vacant-spots", render))
+        self.assertEqual((0, "['A02', 'A03']"), self.occupancy.get_snapshot("vacant-spots", render))
+        self.assertEqual(1, len(renders))
+        self.occupancy.apply(1, left=["Z-810-TU"])
+        self.assertEqual((1, "['A01', 'A02', 'A03']"), self.occupancy.get_snapshot("vacant-spots", render))
+        self.assertEqual(2, len(renders))
+
+    def test_next_departure_prefers_most_overdue_stay(self):
+        now = datetime.now()
+        self.occupancy.set_expected_departure("A01", now + timedelta(minutes=5))
+        self.occupancy.set_expected_departure("A100", now - timedelta(days=2))
+        self.assertEqual("A100", self.occupancy.get_next_departure()[0])
+
+    def test_next_departure_skips_stale_entries(self):
+        now = datetime.now()
+        self.occupancy.set_expected_departure("A01", now + timedelta(hours=1))
+        self.occupancy.set_expected_departure("A100", now + timedelta(hours=2))
+        self.occupancy.leave("Z-810-TU")
+        self.assertEqual(("A100", now + timedelta(hours=2)), self.occupancy.get_next_departure())
+        self.occupancy.park("A01", "N-713-KQ")
+        self.occupancy.set_expected_departure("A01", now + timedelta(hours=3))
+        self.assertEqual("A100", self.occupancy.get_next_departure()[0])
+        self.occupancy.leave("S-627-JM")
+        self.assertEqual(("A01", now + timedelta(hours=3)), self.occupancy.get_next_departure())
+
+    def test_departures_are_loaded_for_occupied_spots_only(self):
+        occupancy = OccupancyIndex()
+        occupancy.load([("A01", "Z-810-TU"), ("A02", None)],
+                       [("A01", datetime(2022, 11, 29)), ("A02", datetime(2022, 11, 20))])
+        self.assertEqual(("A01", datetime(2022, 11, 29)), occupancy.get_next_departure())
+
+    def test_listeners_receive_deltas(self):
+        events = []
+        self.occupancy.add_listener(lambda event, data: events.append((event, data)))
+        self.occupancy.apply(1, parked=[("A02", "N-713-KQ", datetime(2022, 11, 29))], left=["Z-810-TU"])
+        self.occupancy.expire("A02", "N-713-KQ")
+        self.occupancy.expire("A02", "Q-495-DL")
+        self.assertEqual([("park", {"spot": "A02", "old_plate": None, "new_plate": "N-713-KQ", "vacant_count": 1,
+                                    "next_available_spot": "A03", "version": 1}),
+                          ("leave", {"spot": "A01", "old_plate": "Z-810-TU", "new_plate": None, "vacant_count": 2,
+                                     "next_available_spot": "A01", "version": 1}),
+                          ("expire", {"spot": "A02", "old_plate": "N-713-KQ", "new_plate": "N-713-KQ",
+                                      "vacant_count": 2, "next_available_spot": "A01", "version": 1})], events)
+
+    def test_first_vacant_spot_matching_constraints(self):
+        occupancy = OccupancyIndex()
+        occupancy.load([("A01", None, "A", 1, "compact", 0), ("A02", None, "A", 2, "compact", 1),
+                        ("A03", "Z-810-TU", "A", 2, "compact", 1), ("A04", None, "A", 2, "standard", 1)])
+        self.assertEqual("A01", occupancy.get_first_vacant_spot_matching({}))
+        self.assertEqual("A02", occupancy.get_first_vacant_spot_matching({"level": 2, "has_ev_charger": True}))
+        occupancy.park("A02", "N-713-KQ")
+        self.assertEqual("A04", occupancy.get_first_vacant_spot_matching({"level": 2, "has_ev_charger": True}))
+        with self.assertRaises(parking_app.exceptions.NoSpotsAvailable):
+            occupancy.get_first_vacant_spot_matching({"level": 2, "size_class": "compact"})
+        with self.assertRaises(parking_app.exceptions.NoSpotsAvailable):
+            occupancy.get_first_vacant_spot_matching({"zone": "B"})
+        occupancy.leave("Z-810-TU")
+        self.assertEqual("A03", occupancy.get_first_vacant_spot_matching({"level": 2, "size_class": "compact"}))
+
+    def test_next_departure_matching_constraints(self):
+        occupancy = OccupancyIndex()
+        occupancy.load([("A01", "Z-810-TU", "A", 1, "compact", 0), ("A02", "S-627-JM", "A", 2, "compact", 1)],
+                       [("A01", datetime(2022, 11, 20)), ("A02", datetime(2022, 11, 29))])
+        self.assertEqual(("A01", datetime(2022, 11, 20)), occupancy.get_next_departure_matching({}))
+        self.assertEqual(("A02", datetime(2022, 11, 29)), occupancy.get_next_departure_matching({"level": 2}))
+        self.assertIsNone(occupancy.get_next_departure_matching({"level": 3}))
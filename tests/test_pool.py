@@ -0,0 +1,47 @@
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from parking_app.pool import ConnectionPool
+import parking_app.exceptions
+
+
+class TestConnectionPool(TestCase):
+
+    def setUp(self):
+        self.connect = MagicMock(side_effect=lambda: MagicMock())
+        self.pool = ConnectionPool(self.connect, size=2, timeout=0.01)
+
+    def test_connections_are_reused(self):
+        cnx = self.pool.get_connection()
+        self.pool.release(cnx)
+        result = self.pool.get_connection()
+        self.assertIs(cnx, result)
+        self.assertEqual(1, self.connect.call_count)
+
+    def test_release_rolls_back_open_transaction(self):
+        cnx = self.pool.get_connection()
+        self.pool.release(cnx)
+        cnx.rollback.assert_called_once()
+
+    def test_pool_size_is_bounded(self):
+        self.pool.get_connection()
+        self.pool.get_connection()
+        with self.assertRaises(parking_app.exceptions.PoolExhausted):
+            self.pool.get_connection()
+        self.assertEqual(2, self.connect.call_count)
+
+    def test_unhealthy_connection_is_replaced_on_borrow(self):
+        cnx = self.pool.get_connection()
+        self.pool.release(cnx)
+        cnx.ping.side_effect = Exception("gone away")
+        result = self.pool.get_connection()
+        self.assertIsNot(cnx, result)
+        cnx.close.assert_called_once()
+        self.assertEqual(1, self.pool.stats()["opened"])
+
+    def test_connection_context_manager_returns_connection(self):
+        with self.pool.connection() as cnx:
+            self.assertEqual(1, self.pool.stats()["in_use"])
+        self.assertEqual(0, self.pool.stats()["in_use"])
+        self.assertEqual(1, self.pool.stats()["idle"])
+        self.assertIs(cnx, self.pool.get_connection())
@@ -0,0 +1,49 @@
+from unittest import TestCase
+from unittest.mock import MagicMock
+from time import time
+
+from parking_app.replica import ReplicaMonitor
+
+
+class TestReplicaMonitor(TestCase):
+
+    def setUp(self):
+        self.write_heartbeat = MagicMock()
+        self.read_heartbeat = MagicMock()
+        self.monitor = ReplicaMonitor(self.write_heartbeat, self.read_heartbeat, max_lag=5)
+
+    def test_replica_is_not_used_before_the_first_check(self):
+        self.assertFalse(self.monitor.use_replica())
+        self.assertIsNone(self.monitor.lag())
+
+    def test_replica_that_has_caught_up_is_used(self):
+        self.read_heartbeat.return_value = time() - 1
+        self.monitor.check()
+        self.write_heartbeat.assert_called_once()
+        self.assertTrue(self.monitor.use_replica())
+        self.assertAlmostEqual(1, self.monitor.lag(), delta=0.5)
+
+    def test_lagging_replica_is_not_used(self):
+        self.read_heartbeat.return_value = time() - 60
+        self.monitor.check()
+        self.assertFalse(self.monitor.use_replica())
+        stats = self.monitor.stats()
+        self.assertGreater(stats["lag"], 5)
+        self.assertEqual((0, 0, 1), (stats["failed_checks"], stats["replica_reads"], stats["primary_reads"]))
+
+    def test_session_is_pinned_until_the_replica_has_its_write(self):
+        self.read_heartbeat.return_value = time() - 1
+        self.monitor.check()
+        written_at = time()
+        self.assertFalse(self.monitor.use_replica(written_at))
+        self.read_heartbeat.return_value = time()
+        self.monitor.check()
+        self.assertTrue(self.monitor.use_replica(written_at))
+
+    def test_failed_check_falls_back_to_primary(self):
+        self.read_heartbeat.return_value = time()
+        self.monitor.check()
+        self.read_heartbeat.side_effect = ConnectionError()
+        self.monitor.check()
+        self.assertFalse(self.monitor.use_replica())
+        self.assertEqual(1, self.monitor.stats()["failed_checks"])
@@ -0,0 +1,33 @@
+from datetime import datetime
+from unittest import TestCase
+
+from parking_app.rollups import rollup_events, summarize, arrival_event, departure_event
+
+
+class TestRollups(TestCase):
+
+    def test_events_are_rolled_up_by_hour(self):
+        events = [departure_event(datetime(2022, 11, 20, 6, 0), datetime(2022, 11, 20, 9, 0),
+                                  datetime(2022, 11, 20, 9, 30)),
+                  arrival_event(datetime(2022, 11, 20, 8, 10)), arrival_event(datetime(2022, 11, 20, 8, 50)),
+                  arrival_event(datetime(2022, 11, 20, 9, 5))]
+        hours = rollup_events(events, 10)
+        self.assertEqual({"arrivals": 2, "departures": 0, "peak_occupancy": 12, "closing_occupancy": 12,
+                          "stay_seconds": 0, "overstays": 0}, hours[datetime(2022, 11, 20, 8)])
+        self.assertEqual({"arrivals": 1, "departures": 1, "peak_occupancy": 13, "closing_occupancy": 12,
+                          "stay_seconds": 12600, "overstays": 1}, hours[datetime(2022, 11, 20, 9)])
+
+    def test_departures_count_before_arrivals_at_the_same_time(self):
+        hours = rollup_events([arrival_event(datetime(2022, 11, 20, 8, 10)),
+                               departure_event(datetime(2022, 11, 20, 7), datetime(2022, 11, 20, 9),
+                                               datetime(2022, 11, 20, 8, 10))], 5)
+        self.assertEqual(5, hours[datetime(2022, 11, 20, 8)]["peak_occupancy"])
+
+    def test_summary(self):
+        summary = summarize([(datetime(2022, 11, 20, 8), 2, 0, 12, 12, 0, 0),
+                             (datetime(2022, 11, 20, 9), 1, 2, 13, 11, 9000, 1)])
+        self.assertEqual("2022-11-20T08:00:00", summary["hours"][0]["hour"])
+        self.assertIsNone(summary["hours"][0]["average_stay_seconds"])
+        self.assertEqual(4500, summary["hours"][1]["average_stay_seconds"])
+        self.assertEqual({"arrivals": 3, "departures": 2, "peak_occupancy": 13, "stay_seconds": 9000, "overstays": 1,
+                          "average_stay_seconds": 4500}, summary["totals"])
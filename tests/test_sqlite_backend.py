@@ -0,0 +1,189 @@
+import os
+import tempfile
+from datetime import datetime, timedelta
+from time import time
+from unittest import TestCase
+
+from parking_app.db import DBData, DBUsers
+from parking_app.occupancy import OccupancyIndex
+from parking_app.rollups import summarize
+from parking_app.history import HistoryBuffer
+from parking_app.replica import ReplicaMonitor
+from parking_app.statements import PreparedStatementCache
+from parking_app.sqlite_backend import connect_to_sqlite, create_database, translate
+import parking_app.exceptions
+
+
+class TestSQLiteBackend(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "parking_app.db")
+        create_database(self.path)
+        self.cnx = connect_to_sqlite(self.path)
+
+    def tearDown(self):
+        self.cnx.close()
+        self.directory.cleanup()
+
+    def test_translate(self):
+        self.assertEqual(("SELECT spot_id FROM parking_spot_data WHERE vehicle_number IS NULL LIMIT 1;", True),
+                         translate("SELECT spot_id FROM parking_spot_data WHERE vehicle_number IS NULL LIMIT 1 "
+                                   "FOR UPDATE SKIP LOCKED;"))
+        self.assertEqual(("UPDATE occupancy_version SET version = ? WHERE id = ?;", True),
+                         translate("UPDATE occupancy_version SET version = %s WHERE id = %s;"))
+        self.assertEqual(("SELECT version FROM occupancy_version;", False),
+                         translate("SELECT version FROM occupancy_version;"))
+
+    def test_last_insert_id_is_returned_as_lastrowid(self):
+        occupied = self.cnx.cnx.execute("SELECT occupied FROM occupancy_version;").fetchone()[0]
+        with self.cnx.cursor() as cursor:
+            cursor.execute(DBData.occupancy_version_bump_query, [1])
+            self.assertEqual((1 << 32) | (occupied + 1), cursor.lastrowid)
+            cursor.execute("UPDATE occupancy_version SET version = %s WHERE id = 1;", [5])
+            self.assertNotEqual((1 << 32) | (occupied + 1), cursor.lastrowid)
+        self.cnx.commit()
+        self.assertEqual((5, occupied + 1), self.cnx.cnx.execute("SELECT version, occupied FROM occupancy_version;")
+                         .fetchone())
+
+    def test_database_is_seeded(self):
+        db_data = DBData(self.cnx)
+        self.assertEqual(103, len(db_data.get_spots()))
+        self.assertEqual("A05", db_data.get_spot_from_plate("S-627-JM"))
+        self.assertEqual(0, db_data.get_occupancy_version())
+        self.assertIsInstance(db_data.get_expected_departures()[0][1], datetime)
+
+    def test_parking_and_leaving(self):
+        db_data = DBData(self.cnx)
+        self.assertEqual("A03", db_data.park_car("A03", "N-713-KQ", "1.00"))
+        self.assertFalse(self.cnx.in_transaction)
+        with self.assertRaises(parking_app.exceptions.SpotNotAvailable):
+            db_data.park_car("A03", "Q-495-DL", "1.00")
+        with self.assertRaises(parking_app.exceptions.VehicleAlreadyInOtherSpot):
+            db_data.park_car("A08", "N-713-KQ", "1.00")
+        self.assertEqual(1, db_data.get_occupancy_version())
+        db_data.leave_parking_spot("N-713-KQ")
+        self.assertEqual(2, db_data.get_occupancy_version())
+        with self.assertRaises(parking_app.exceptions.LicensePlateNotFound):
+            db_data.get_spot_from_plate("N-713-KQ")
+
+    def test_parking_at_next_available_spot_with_constraints(self):
+        db_data = DBData(self.cnx, OccupancyIndex())
+        db_data.load_occupancy()
+        self.assertEqual("A03", db_data.park_at_next_available_spot("N-713-KQ", "1.00"))
+        self.assertEqual("A100", db_data.park_at_next_available_spot("Q-495-DL", "1.00", {"has_ev_charger": True,
+                                                                                         "level": 2}))
+        other_db_data = DBData(connect_to_sqlite(self.path), OccupancyIndex())
+        self.assertEqual(2, other_db_data.load_occupancy())
+        self.assertEqual("A100", other_db_data.get_spot_from_plate("Q-495-DL"))
+        other_db_data.cnx.close()
+
+    def test_bulk_parking_and_history(self):
+        db_data = DBData(self.cnx)
+        results = db_data.park_cars([{"parking_spot": "A03", "license_plate": "N-713-KQ", "length_of_stay": "1.00"},
+                                     {"parking_spot": "A01", "license_plate": "Q-495-DL", "length_of_stay": "1.00"}])
+        self.assertEqual("A03", results[0])
+        self.assertIsInstance(results[1], parking_app.exceptions.SpotNotAvailable)
+        results = db_data.leave_parking_spots([{"license_plate": "N-713-KQ"}, {"license_plate": "Q-495-DL"}])
+        self.assertEqual("A03", results[0])
+        history = list(db_data.iter_parking_history(page_size=10, chunk_size=3))
+        self.assertEqual(list(range(1, len(history) + 1)), [row[0] for row in history])
+        self.assertEqual(("A03", "N-713-KQ", 1), (history[-1][1], history[-1][2], history[-1][6]))
+
+    def test_occupancy_rollup(self):
+        db_data = DBData(self.cnx)
+        db_data.park_car("A03", "N-713-KQ", "1.00")
+        db_data.park_cars([{"parking_spot": "A08", "license_plate": "Q-495-DL", "length_of_stay": "1.00"}])
+        db_data.leave_parking_spots([{"license_plate": "S-627-JM"}])
+        db_data.leave_parking_spot("N-713-KQ")
+        stats = db_data.get_occupancy_stats(datetime(2022, 1, 1), datetime.now() + timedelta(hours=1))
+        totals = summarize(stats)["totals"]
+        self.assertEqual((38, 2, 38, 1), (totals["arrivals"], totals["departures"], totals["peak_occupancy"],
+                                          totals["overstays"]))
+        self.assertEqual(36, stats[-1][4])
+        db_data.rebuild_occupancy_rollup()
+        rebuilt = db_data.get_occupancy_stats(datetime(2022, 1, 1), datetime.now() + timedelta(hours=1))
+        # History keeps whole seconds, so the rebuild cannot order the arrivals and departures of this test.
+        self.assertEqual(stats[:-1], rebuilt[:-1])
+        self.assertEqual(stats[-1][:3] + stats[-1][4:], rebuilt[-1][:3] + rebuilt[-1][4:])
+
+    def test_leaving_twice_counts_one_departure(self):
+        db_data = DBData(self.cnx)
+        db_data.park_car("A03", "N-713-KQ", "1.00")
+        # The second worker's index has not seen the first one's leave yet.
+        stale_db_data = DBData(connect_to_sqlite(self.path), OccupancyIndex())
+        stale_db_data.load_occupancy()
+        db_data.leave_parking_spot("N-713-KQ")
+        with self.assertRaises(parking_app.exceptions.LicensePlateNotFound):
+            stale_db_data.leave_parking_spot("N-713-KQ")
+        stale_db_data.cnx.close()
+        self.assertFalse(self.cnx.in_transaction)
+        occupied = self.cnx.cnx.execute("SELECT occupied FROM occupancy_version;").fetchone()[0]
+        self.assertEqual(len(db_data.get_unavailable_spots_and_plates()), occupied)
+        totals = summarize(db_data.get_occupancy_stats(datetime(2022, 1, 1), datetime.now() + timedelta(hours=1)))
+        self.assertEqual(1, totals["totals"]["departures"])
+
+    def test_write_behind_history(self):
+        writer = connect_to_sqlite(self.path)
+        history_buffer = HistoryBuffer(lambda parking_times: DBData(writer).store_parking_times(parking_times),
+                                       flush_interval=60)
+        db_data = DBData(self.cnx, history_buffer=history_buffer)
+        db_data.park_cars([{"parking_spot": "A03", "license_plate": "N-713-KQ", "length_of_stay": "1.00"},
+                           {"parking_spot": "A08", "license_plate": "Q-495-DL", "length_of_stay": "1.00"}])
+        self.assertEqual("A03", db_data.get_spot_from_plate("N-713-KQ"))
+        self.assertEqual(36, len(list(db_data.iter_parking_history())))
+        db_data.leave_parking_spot("N-713-KQ")
+        history = list(db_data.iter_parking_history())
+        self.assertEqual([("N-713-KQ", 1), ("Q-495-DL", 0)], [(row[2], row[6]) for row in history[36:]])
+        self.assertEqual(1, summarize(db_data.get_occupancy_stats(datetime.now() - timedelta(hours=1),
+                                                                  datetime.now() + timedelta(hours=1)))
+                         ["totals"]["departures"])
+        history_buffer.close()
+        writer.close()
+
+    def test_read_replica(self):
+        replica_path = os.path.join(self.directory.name, "replica.db")
+        create_database(replica_path)
+        replica = connect_to_sqlite(replica_path)
+        monitor = ReplicaMonitor(DBData(self.cnx).write_replication_heartbeat,
+                                 DBData(replica).get_replication_heartbeat, max_lag=5)
+        monitor.check()
+        self.assertFalse(monitor.use_replica())
+        self.cnx.cnx.backup(replica.cnx)
+        monitor.check()
+        self.assertTrue(monitor.use_replica())
+        DBData(self.cnx).park_car("A03", "N-713-KQ", "1.00")
+        written_at = time()
+        self.assertFalse(monitor.use_replica(written_at))
+        with self.assertRaises(parking_app.exceptions.LicensePlateNotFound):
+            DBData(self.cnx, read_cnx=replica).get_spot_from_plate("N-713-KQ")
+        monitor.check()
+        self.cnx.cnx.backup(replica.cnx)
+        monitor.check()
+        self.assertTrue(monitor.use_replica(written_at))
+        self.assertEqual("A03", DBData(self.cnx, read_cnx=replica).get_spot_from_plate("N-713-KQ"))
+        DBUsers(self.cnx).create_user("appuser", "appuser@test.dummy.com", "hash")
+        self.assertEqual("appuser", DBUsers(self.cnx, read_cnx=replica).get_user_data_from_username("appuser")
+                         ["username"])
+        replica.close()
+
+    def test_prepared_statements(self):
+        statement_cache = PreparedStatementCache()
+        db_data = DBData(self.cnx, statement_cache=statement_cache)
+        db_data.park_car("A03", "N-713-KQ", "1.00")
+        db_data.leave_parking_spot("N-713-KQ")
+        db_data.park_car("A03", "Q-495-DL", "1.00")
+        self.assertEqual("A03", db_data.get_spot_from_plate("Q-495-DL"))
+        self.assertEqual(3, db_data.get_occupancy_version())
+        self.assertEqual(("A03", "Q-495-DL"), list(db_data.iter_parking_history())[-1][1:3])
+        self.assertEqual({"connections": 1, "statements": 8, "hits": 7, "misses": 8}, statement_cache.stats())
+
+    def test_users(self):
+        db_users = DBUsers(self.cnx)
+        db_users.create_user("appuser", "appuser@test.dummy.com", "hash")
+        self.assertEqual("appuser@test.dummy.com", db_users.get_user_data_from_username("AppUser")["email_address"])
+        with self.assertRaises(parking_app.exceptions.UsernameAlreadyUsed):
+            db_users.create_user("APPUSER", "other@test.dummy.com", "hash")
+        with self.assertRaises(parking_app.exceptions.EmailAlreadyUsed):
+            db_users.create_user("otheruser", "appuser@test.dummy.com", "hash")
+        self.assertEqual((True, False), db_users.check_if_already_registered("appuser", "new@test.dummy.com"))
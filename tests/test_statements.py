@@ -0,0 +1,58 @@
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from parking_app.statements import PreparedStatementCache, StatementCursor
+
+spot_query = "SELECT spot_id FROM parking_spot_data WHERE vehicle_number = %s;"
+
+
+class TestPreparedStatementCache(TestCase):
+
+    def setUp(self):
+        self.statement_cache = PreparedStatementCache()
+        self.cnx = MagicMock()
+        self.cnx.connection_id = 7
+
+    def test_statement_is_prepared_once_per_connection(self):
+        cursor, statement = self.statement_cache.get(self.cnx, spot_query)
+        self.assertEqual((cursor, statement), self.statement_cache.get(self.cnx, "".join(spot_query)))
+        self.assertIs(spot_query, statement)
+        self.cnx.cursor.assert_called_once_with(prepared=True)
+        other_cnx = MagicMock()
+        self.statement_cache.get(other_cnx, spot_query)
+        other_cnx.cursor.assert_called_once_with(prepared=True)
+        self.assertEqual({"connections": 2, "statements": 2, "hits": 1, "misses": 2}, self.statement_cache.stats())
+
+    def test_statements_are_prepared_again_after_reconnecting(self):
+        self.statement_cache.get(self.cnx, spot_query)
+        self.cnx.connection_id = 8
+        self.statement_cache.get(self.cnx, spot_query)
+        self.assertEqual(2, self.cnx.cursor.call_count)
+        self.assertEqual(0, self.statement_cache.stats()["hits"])
+
+
+class TestStatementCursor(TestCase):
+
+    def setUp(self):
+        self.cnx = MagicMock()
+        self.plain_cursor = MagicMock()
+        self.prepared_cursor = MagicMock()
+        self.cnx.cursor.side_effect = lambda prepared=False: self.prepared_cursor if prepared else self.plain_cursor
+        self.statement_cache = PreparedStatementCache()
+
+    def test_listed_statements_run_prepared(self):
+        with StatementCursor(self.cnx, self.statement_cache, frozenset([spot_query])) as cursor:
+            cursor.execute(spot_query, ["S-627-JM"])
+            cursor.execute("".join(spot_query), ["K-452-BM"])
+            self.prepared_cursor.execute.assert_called_with(spot_query, ["K-452-BM"])
+            self.assertIs(spot_query, self.prepared_cursor.execute.call_args.args[0])
+            self.prepared_cursor.rowcount = 1
+            self.assertEqual(1, cursor.rowcount)
+            cursor.execute("SELECT COUNT(*) FROM parking_spot_data;")
+            self.plain_cursor.execute.assert_called_once_with("SELECT COUNT(*) FROM parking_spot_data;")
+            self.plain_cursor.rowcount = 103
+            self.assertEqual(103, cursor.rowcount)
+            cursor.executemany(spot_query, [["S-627-JM"], ["K-452-BM"]])
+            self.plain_cursor.executemany.assert_called_once_with(spot_query, [["S-627-JM"], ["K-452-BM"]])
+        self.plain_cursor.close.assert_called_once()
+        self.prepared_cursor.close.assert_not_called()